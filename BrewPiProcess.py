@@ -30,6 +30,20 @@ import BrewPiSocket
 import BrewPiUtil as util
 
 
+# scripts that control chambers, a brewpi.py process and a brewpiMulti.py process with the same settings conflict
+scripts = ('brewpi.py', 'brewpiMulti.py')
+
+
+def processInfo(process, attribute):
+    """
+    Reads name or cmdline of a psutil process. These are attributes in psutil 1.x and methods in later versions.
+    """
+    value = getattr(process, attribute)
+    if callable(value):
+        value = value()
+    return value
+
+
 class BrewPiProcess:
     """
     This class represents a running BrewPi process.
@@ -40,6 +54,7 @@ class BrewPiProcess:
         self.pid = None  # pid of process
         self.cfg = None  # config file of process, full path
         self.port = None  # serial port the process is connected to
+        self.ports = []  # serial ports of all chambers of the process, more than one for brewpiMulti.py
         self.sock = None  # BrewPiSocket object which the process is connected to
 
     def as_dict(self):
@@ -79,7 +94,7 @@ class BrewPiProcess:
             return 0  # this is me! I don't have a conflict with myself
         if otherProcess.cfg == self.cfg:
             return 1
-        if otherProcess.port == self.port:
+        if set(otherProcess.ports) & set(self.ports):
             return 1
         if [otherProcess.sock.type, otherProcess.sock.file, otherProcess.sock.host, otherProcess.sock.port] == \
                 [self.sock.type, self.sock.file, self.sock.host, self.sock.port]:
@@ -100,7 +115,8 @@ class BrewPiProcesses():
         Returns: list of BrewPiProcess objects
         """
         bpList = []
-        matching = [p for p in psutil.process_iter() if any('python' in p.name and 'brewpi.py'in s for s in p.cmdline)]
+        matching = [p for p in psutil.process_iter() if 'python' in processInfo(p, 'name') and
+                    any(script in s for s in processInfo(p, 'cmdline') for script in scripts)]
         for p in matching:
             bp = self.parseProcess(p)
             bpList.append(bp)
@@ -116,12 +132,17 @@ class BrewPiProcesses():
         bp = BrewPiProcess()
         bp.pid = process._pid
 
-        cfg = [s for s in process.cmdline if '.cfg' in s]  # get config file argument
+        cfg = [s for s in processInfo(process, 'cmdline') if '.cfg' in s]  # get config file argument
         if cfg:
             cfg = cfg[0]  # add full path to config file
         bp.cfg = util.readCfgWithDefaults(cfg)
 
         bp.port = bp.cfg['port']
+        bp.ports = [bp.port]
+        if any('brewpiMulti.py' in s for s in processInfo(process, 'cmdline')):
+            # the chambers of brewpiMulti.py have their own ports, the top level port is their default
+            chambers = bp.cfg.get('chambers', {})
+            bp.ports = [chambers[c].get('port', bp.port) for c in chambers if isinstance(chambers[c], dict)]
         bp.sock = BrewPiSocket.BrewPiSocket(bp.cfg)
         return bp
 
@@ -17,8 +17,48 @@
 import sys
 import socket
 import os
+import struct
 import BrewPiUtil as util
 
+# Framed protocol of the script socket, for clients that keep their connection open.
+# A one-shot client sends a single 'type=value' message and reads the reply until the connection is closed.
+# A framed client sends frames instead and can send the next ones before the replies arrive (pipelining):
+# frame: marker byte (NUL), request id (uint32), length of the data (uint32), data. Integers are big-endian.
+# The data of a request frame is a 'type=value' message, the data of the reply frame with the same request id is
+# everything the script replied to it. Requests without a reply get an empty reply frame.
+# Replies come in the order of the requests. A one-shot message never starts with NUL, which is how the script
+# tells the two apart on a new connection.
+frameMarker = '\x00'
+frameHeader = struct.Struct('!cII')
+maxFrameSize = 16 * 1024 * 1024
+
+
+def packFrame(requestId, data):
+	return frameHeader.pack(frameMarker, requestId, len(data)) + data
+
+
+def unpackFrames(buffer):
+	"""
+	Splits the complete frames off the start of buffer
+
+	Returns:
+	list of (request id, data) tuples and the rest of the buffer, the start of an incomplete frame
+	Raises ValueError when the buffer does not start with a frame or a frame is larger than maxFrameSize
+	"""
+	frames = []
+	start = 0
+	while len(buffer) - start >= frameHeader.size:
+		marker, requestId, length = frameHeader.unpack_from(buffer, start)
+		if marker != frameMarker or length > maxFrameSize:
+			raise ValueError("invalid frame header")
+		end = start + frameHeader.size + length
+		if end > len(buffer):
+			break
+		frames.append((requestId, buffer[start + frameHeader.size:end]))
+		start = end
+	return frames, buffer[start:]
+
+
 class BrewPiSocket:
 	"""
 	A wrapper class for the standard socket class.
@@ -123,3 +163,66 @@ class BrewPiSocket:
 		finally:
 			return conn, msgType, msg
 
+
+class FramedClient:
+	"""
+	Client for the framed protocol on a connected socket, see packFrame.
+	Keeps the connection open, so any number of requests can be sent over it.
+	"""
+
+	def __init__(self, sock):
+		self.sock = sock
+		self.nextId = 1
+		self.buffer = ''
+		self.frames = []  # received frames that were not returned yet
+
+	def send(self, message):
+		"""
+		Sends a request without waiting for the reply
+
+		Returns:
+		the request id, which the reply frame will have
+		"""
+		requestId = self.nextId
+		self.nextId = (self.nextId + 1) & 0xffffffff
+		self.sock.sendall(packFrame(requestId, message))
+		return requestId
+
+	def receive(self):
+		"""
+		Waits for the next reply frame
+
+		Returns:
+		(request id, data) of the reply
+		Raises socket.error when the connection is closed before the reply is complete
+		"""
+		while not self.frames:
+			data = self.sock.recv(65536)
+			if not data:
+				raise socket.error("connection closed by the script")
+			frames, self.buffer = unpackFrames(self.buffer + data)
+			self.frames.extend(frames)
+		return self.frames.pop(0)
+
+	def request(self, message):
+		"""
+		Sends a request and returns the data of its reply
+		"""
+		return self.pipeline([message])[0]
+
+	def pipeline(self, messages):
+		"""
+		Sends all messages, then receives their replies
+
+		Returns:
+		list with the data of the replies, in the order of the messages
+		"""
+		requestIds = [self.send(message) for message in messages]
+		replies = {}
+		while len(replies) < len(requestIds):
+			requestId, data = self.receive()
+			replies[requestId] = data
+		return [replies[requestId] for requestId in requestIds]
+
+	def close(self):
+		self.sock.close()
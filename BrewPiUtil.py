@@ -88,3 +88,22 @@ def scriptPath():
 	That is why this function is needed.
 	"""
 	return os.path.dirname(__file__)
+
+
+def configBool(config, settingName, default=False):
+	"""
+	Reads a boolean setting from a ConfigObj. ConfigObj returns all values as strings,
+	so the string 'false' should not be evaluated as True.
+
+	Params:
+	config: ConfigObj of settings
+	settingName: name of the setting
+	default: value to return when the setting is not present
+
+	Returns:
+	bool
+	"""
+	value = config.get(settingName, default)
+	if isinstance(value, basestring):
+		return value.strip().lower() in ('true', 'yes', 'on', '1')
+	return bool(value)
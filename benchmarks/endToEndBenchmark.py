@@ -0,0 +1,292 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# Runs brewpi.py against the simulated Arduino of brewpiSimulator and measures, end to end:
+# - temperature lines per second the script receives and logs, with the simulator sending them at a fixed rate
+# - round trip time of requests on the script socket while the lines arrive (p50/p99). With --clients, that many
+#   clients poll lcd, getControlSettings and getControlVariables at the same time, like several open browser tabs.
+#   The latencies measured by the socket server of the script (getSocketStats) and the time spent in the command
+#   handlers (getStats) are printed as well.
+#   With --persistent, every client keeps one connection open and pipelines the three requests as frames
+#   (BrewPiSocket.FramedClient), instead of connecting for every request.
+# - with --subscribers, that many clients subscribe to all events while the others poll. Printed are the events per
+#   second by type and the delay from publishing an event in the script until the subscriber received it.
+# - time from the start of the script until the Arduino answered and until the first sample was received
+# The script runs with a temporary config, data directory and socket, so it does not touch an installed BrewPi.
+# With --boottime, the simulator ignores commands for that many seconds, like an Uno that resets when the port
+# is opened.
+# With --blocking, the script runs on its blocking accept loop (blockingLoop = true) instead of the event loop.
+# Run from the script directory:
+# python benchmarks/endToEndBenchmark.py [--rate <lines/s>] [--seconds <s>] [--boottime <s>] [--clients <n>]
+#                                     [--persistent] [--subscribers <n>] [--eventloop] [--blocking]
+
+import getopt
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import simplejson as json
+
+scriptDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, scriptDir)
+import brewpiSimulator
+import BrewPiSocket
+
+
+def request(socketFile, message, timeout=5.0):
+	"""
+	Sends a message to the script socket and returns the reply and the round trip time until the reply arrived.
+	The script closes the connection when the reply is written. Older versions kept it open until the next client
+	connected, so the reply is what was received when the socket has no more data or was closed.
+	"""
+	start = time.time()
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.settimeout(timeout)
+	try:
+		sock.connect(socketFile)
+		sock.sendall(message)
+		reply = [sock.recv(65536)]
+		rtt = time.time() - start
+		sock.settimeout(0.05)
+		while reply[-1]:
+			try:
+				reply.append(sock.recv(65536))
+			except socket.timeout:
+				break
+	finally:
+		sock.close()
+	return ''.join(reply), rtt
+
+
+def percentile(values, fraction):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+pollCommands = ['lcd', 'getControlSettings', 'getControlVariables']
+
+
+def poll(socketFile, seconds, rtts):
+	"""
+	Requests the commands of the web interface in turn for seconds, appends (command, round trip time) to rtts
+	"""
+	end = time.time() + seconds
+	i = 0
+	while time.time() < end:
+		command = pollCommands[i % len(pollCommands)]
+		i += 1
+		try:
+			reply, rtt = request(socketFile, command)
+		except socket.error:
+			rtt = None  # refused or timed out
+		rtts.append((command, rtt))
+		time.sleep(0.01)
+
+
+def pollFramed(socketFile, seconds, rtts):
+	"""
+	Like poll, on one connection that stays open: the commands are sent at once as frames, then the replies are read
+	"""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.settimeout(5.0)
+	sock.connect(socketFile)
+	client = BrewPiSocket.FramedClient(sock)
+	end = time.time() + seconds
+	try:
+		while time.time() < end:
+			start = time.time()
+			commands = dict((client.send(command), command) for command in pollCommands)
+			for i in range(len(commands)):
+				requestId, reply = client.receive()
+				rtts.append((commands[requestId], time.time() - start))
+			time.sleep(0.01)
+	finally:
+		client.close()
+
+
+def subscribe(socketFile, seconds, events):
+	"""
+	Subscribes to all events for seconds, appends (event type, delay from publishing until received) to events
+	"""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.settimeout(1.0)
+	sock.connect(socketFile)
+	sock.sendall('subscribe')
+	stream = sock.makefile()
+	end = time.time() + seconds
+	try:
+		while time.time() < end:
+			try:
+				line = stream.readline()
+			except socket.timeout:
+				continue
+			if not line:
+				break
+			event = json.loads(line)
+			events.append((event['type'], time.time() - event['time']))
+	finally:
+		stream.close()
+		sock.close()
+
+
+def run(rate, seconds, eventLoop, bootTime=0.0, clients=1, persistent=False, subscribers=0, blocking=False):
+	workDir = tempfile.mkdtemp()
+	arduino = brewpiSimulator.FakeArduino(rate=rate, bootTime=bootTime)
+	arduino.start()
+	process = None
+	try:
+		for d in ['data', 'logs', 'www']:
+			os.mkdir(os.path.join(workDir, d))
+		configFile = os.path.join(workDir, 'config.cfg')
+		with open(configFile, 'w') as f:
+			f.write("scriptPath = %s/\nwwwPath = %s/www/\nport = %s\naltport = %s\nbeerName = benchmark\n"
+			        "startupDelay = 10\nboardType = %s\neventLoop = %s\nblockingLoop = %s\n" % (
+				workDir, workDir, arduino.portName, arduino.portName, 'uno' if bootTime else 'leonardo',
+				str(eventLoop).lower(), str(blocking).lower()))
+		socketFile = os.path.join(workDir, 'BEERSOCKET')
+		output = open(os.path.join(workDir, 'logs', 'output.txt'), 'w')
+		process = subprocess.Popen([sys.executable, os.path.join(scriptDir, 'brewpi.py'), '--config', configFile],
+		                           stdout=output, stderr=subprocess.STDOUT)
+		deadline = time.time() + 30
+		while not os.path.exists(socketFile):
+			if time.time() > deadline or process.poll() is not None:
+				output.close()
+				raise RuntimeError("brewpi.py did not start:\n" + open(output.name).read())
+			time.sleep(0.1)
+		time.sleep(1)  # let the startup requests finish
+		startupStats = json.loads(request(socketFile, 'getStartupStats')[0])
+
+		linesBefore = json.loads(request(socketFile, 'getSerialStats')[0])['lines'].get('T', 0)
+		sentBefore = arduino.linesSent
+		results = [[] for i in range(clients)]
+		threads = [threading.Thread(target=pollFramed if persistent else poll, args=(socketFile, seconds, rtts))
+		           for rtts in results]
+		subscriberEvents = [[] for i in range(subscribers)]
+		threads += [threading.Thread(target=subscribe, args=(socketFile, seconds, events)) for events in subscriberEvents]
+		start = time.time()
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		elapsed = time.time() - start
+		stats = json.loads(request(socketFile, 'getSerialStats')[0])
+		logStats = json.loads(request(socketFile, 'getDataLogStats')[0])
+		try:
+			socketStats = json.loads(request(socketFile, 'getSocketStats')[0])
+		except (ValueError, socket.error):
+			socketStats = None  # not available in older versions of the script
+		try:
+			cacheStats = json.loads(request(socketFile, 'getResponseCacheStats')[0])
+		except (ValueError, socket.error):
+			cacheStats = None
+		try:
+			commandStats = json.loads(request(socketFile, 'getStats')[0])['commands']
+		except (ValueError, socket.error):
+			commandStats = None
+		received = stats['lines'].get('T', 0) - linesBefore
+		request(socketFile, 'quit')
+		process.wait()
+		process = None
+
+		if blocking:
+			mode = 'blocking accept loop'
+		else:
+			mode = 'serial port on the event loop' if eventLoop else 'serial reader thread'
+		print "%s, simulator sending %.0f temperature lines/s:" % (mode, rate)
+		print "  lines sent by simulator   %8.0f/s (all types)" % ((arduino.linesSent - sentBefore) / elapsed)
+		print "  temperature lines handled %8.0f/s" % (received / elapsed)
+		print "  data log                  %s" % json.dumps(logStats)
+		print "  startup: Arduino answered after %.2f s, first sample after %.2f s" % (
+			startupStats['handshake'], startupStats['firstSample'])
+		rtts = [rtt for result in results for command, rtt in result if rtt is not None]
+		failed = sum(1 for result in results for command, rtt in result if rtt is None)
+		if rtts:
+			print "  %d %s clients, %d requests (%.0f/s), %d failed, round trip p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+				clients, 'persistent' if persistent else 'one-shot', len(rtts), len(rtts) / elapsed, failed,
+				percentile(rtts, 0.5) * 1000, percentile(rtts, 0.99) * 1000, max(rtts) * 1000)
+		for command in pollCommands:
+			commandRtts = [rtt for result in results for c, rtt in result if c == command and rtt is not None]
+			if commandRtts:
+				print "    %-22s p50 %.2f ms, p99 %.2f ms" % (
+					command, percentile(commandRtts, 0.5) * 1000, percentile(commandRtts, 0.99) * 1000)
+		if socketStats:
+			latency = socketStats['latency']
+			print "  script socket server: max %d connections at once, %d timed out, latency p50 %.2f ms, p99 %.2f ms" % (
+				socketStats['maxConnections'], socketStats['timeouts'], latency['p50Latency'] * 1000,
+				latency['p99Latency'] * 1000)
+		if subscribers:
+			events = [event for result in subscriberEvents for event in result]
+			counts = {}
+			for eventType, delay in events:
+				counts[eventType] = counts.get(eventType, 0) + 1
+			delays = [delay for eventType, delay in events]
+			print "  %d subscribers, events/s per subscriber: %s" % (subscribers, ", ".join(
+				"%s %.1f" % (eventType, count / elapsed / subscribers) for eventType, count in sorted(counts.items())))
+			if delays:
+				print "    delay from publish to receive p50 %.2f ms, p99 %.2f ms" % (
+					percentile(delays, 0.5) * 1000, percentile(delays, 0.99) * 1000)
+		if cacheStats:
+			print "  response cache hit rate: " + ", ".join(
+				"%s %.1f%%" % (command, cacheStats[command]['hitRate'] * 100) for command in pollCommands
+				if command in cacheStats)
+		if commandStats:
+			# time spent in the handlers, which hold the state lock of the control loop
+			print "  command handlers (getStats): " + ", ".join(
+				"%s %d calls, avg %.3f ms, max %.2f ms" % (command, commandStats[command]['calls'],
+				                                          commandStats[command]['avgLatencyMs'],
+				                                          commandStats[command]['maxLatencyMs'])
+				for command in pollCommands if command in commandStats)
+	finally:
+		if process is not None:
+			process.kill()
+		arduino.stop()
+		shutil.rmtree(workDir)
+
+
+if __name__ == '__main__':
+	opts, args = getopt.getopt(sys.argv[1:], "r:s:b:c:pn:ek",
+	                           ['rate=', 'seconds=', 'boottime=', 'clients=', 'persistent', 'subscribers=', 'eventloop',
+	                            'blocking'])
+	rate = 200.0
+	seconds = 10.0
+	eventLoop = False
+	bootTime = 0.0
+	clients = 1
+	persistent = False
+	subscribers = 0
+	blocking = False
+	for o, a in opts:
+		if o in ('-r', '--rate'):
+			rate = float(a)
+		elif o in ('-s', '--seconds'):
+			seconds = float(a)
+		elif o in ('-b', '--boottime'):
+			bootTime = float(a)
+		elif o in ('-c', '--clients'):
+			clients = int(a)
+		elif o in ('-p', '--persistent'):
+			persistent = True
+		elif o in ('-n', '--subscribers'):
+			subscribers = int(a)
+		elif o in ('-e', '--eventloop'):
+			eventLoop = True
+		elif o in ('-k', '--blocking'):
+			blocking = True
+	run(rate, seconds, eventLoop, bootTime, clients, persistent, subscribers, blocking)
@@ -0,0 +1,126 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compares the memory and CPU use of N chambers run by one brewpiMulti.py process with N brewpi.py processes.
+# Every chamber is a simulated Arduino (brewpiSimulator) that sends temperature lines at a fixed rate.
+# Linux only, memory and CPU time are read from /proc.
+# Run from the script directory: python benchmarks/multiControllerBenchmark.py [--chambers 1,2,4,8] [--seconds <s>]
+
+import getopt
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+scriptDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, scriptDir)
+import brewpiSimulator
+
+clockTicks = os.sysconf('SC_CLK_TCK')
+
+
+def processUsage(pid):
+	""" Returns resident memory in MB and used CPU seconds of a process """
+	with open('/proc/%d/status' % pid) as f:
+		rss = [int(line.split()[1]) for line in f if line.startswith('VmRSS:')][0] / 1024.0
+	with open('/proc/%d/stat' % pid) as f:
+		fields = f.read().rsplit(')', 1)[1].split()
+	return rss, (int(fields[11]) + int(fields[12])) / float(clockTicks)
+
+
+def writeConfig(fileName, workDir, settings, chambers=None):
+	with open(fileName, 'w') as f:
+		f.write("scriptPath = %s/\nwwwPath = %s/www/\nstartupDelay = 0\n" % (workDir, workDir))
+		for key, value in settings.items():
+			f.write("%s = %s\n" % (key, value))
+		if chambers:
+			f.write("[chambers]\n")
+			for name, port in chambers:
+				f.write("    [[%s]]\n    port = %s\n    beerName = %s\n" % (name, port, name))
+
+
+def measure(processes, seconds):
+	time.sleep(3)  # startup
+	before = [processUsage(p.pid)[1] for p in processes]
+	time.sleep(seconds)
+	usage = [processUsage(p.pid) for p in processes]
+	rss = sum(u[0] for u in usage)
+	cpu = sum(u[1] - b for u, b in zip(usage, before)) / seconds * 100
+	return rss, cpu
+
+
+def run(count, rate, seconds, multi):
+	workDirs = []
+	arduinos = [brewpiSimulator.FakeArduino() for i in range(count)]
+	processes = []
+	output = open(os.devnull, 'w')
+	try:
+		for arduino in arduinos:
+			arduino.start()
+		if multi:
+			workDir = tempfile.mkdtemp()
+			workDirs.append(workDir)
+			os.mkdir(os.path.join(workDir, 'www'))
+			os.mkdir(os.path.join(workDir, 'data'))
+			configFile = os.path.join(workDir, 'config.cfg')
+			writeConfig(configFile, workDir, {}, [('chamber%d' % i, a.portName) for i, a in enumerate(arduinos)])
+			processes.append(subprocess.Popen([sys.executable, os.path.join(scriptDir, 'brewpiMulti.py'),
+			                                   '--config', configFile], stdout=output, stderr=output))
+		else:
+			for arduino in arduinos:
+				workDir = tempfile.mkdtemp()
+				workDirs.append(workDir)
+				for d in ['www', 'data']:
+					os.mkdir(os.path.join(workDir, d))
+				configFile = os.path.join(workDir, 'config.cfg')
+				writeConfig(configFile, workDir, dict(port=arduino.portName, altport=arduino.portName,
+				                                      beerName='chamber', eventLoop='true'))
+				processes.append(subprocess.Popen([sys.executable, os.path.join(scriptDir, 'brewpi.py'),
+				                                   '--config', configFile], stdout=output, stderr=output))
+		time.sleep(2)
+		for arduino in arduinos:
+			arduino.rate = rate  # after the version handshake
+		return measure(processes, seconds)
+	finally:
+		for process in processes:
+			process.kill()
+			process.wait()
+		for arduino in arduinos:
+			arduino.stop()
+		for workDir in workDirs:
+			shutil.rmtree(workDir)
+
+
+if __name__ == '__main__':
+	opts, args = getopt.getopt(sys.argv[1:], "c:r:s:", ['chambers=', 'rate=', 'seconds='])
+	counts = [1, 2, 4, 8]
+	rate = 10.0
+	seconds = 10.0
+	for o, a in opts:
+		if o in ('-c', '--chambers'):
+			counts = [int(c) for c in a.split(',')]
+		elif o in ('-r', '--rate'):
+			rate = float(a)
+		elif o in ('-s', '--seconds'):
+			seconds = float(a)
+	print "%d temperature lines/s per chamber, CPU averaged over %.0f s" % (rate, seconds)
+	print "chambers   brewpi.py processes: RSS MB   CPU %   | brewpiMulti.py: RSS MB   CPU %"
+	for count in counts:
+		single = run(count, rate, seconds, False)
+		multi = run(count, rate, seconds, True)
+		print "%8d   %29.1f %7.1f   | %22.1f %7.1f" % (count, single[0], single[1], multi[0], multi[1])
@@ -0,0 +1,90 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measures how many days of fermentation data per second the parsing and logging stack ingests, by replaying
+# a made up serial session as fast as possible with brewpiReplay.
+# The session has the traffic of an idle web interface: LCD text and control settings every 10 seconds,
+# a temperature sample every logging interval and now and then a log message from the Arduino.
+# Run from the script directory:
+# python benchmarks/replayBenchmark.py [--days <days>] [--interval <s>] [--capture <file>]
+# With --capture, a recorded session is replayed instead.
+
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import brewpiCapture
+import brewpiReplay
+
+
+def session(days, interval):
+	""" Generator for the frames of a made up session, as written to a capture file """
+	start = time.mktime((2014, 3, 1, 12, 0, 0, 0, 0, -1))
+	yield start, brewpiCapture.fromArduino, 'N:{"v":"0.2.3","n":"benchmark","c":"","s":2,"y":1,"b":"s","l":"1"}\n'
+	for second in xrange(0, int(days * 86400), 10):
+		t = start + second
+		beer = 19.0 + (second % 3600) / 36000.0
+		if second % 20 == 0:
+			yield t, brewpiCapture.toArduino, 'l'
+		yield t + 0.05, brewpiCapture.fromArduino, (
+			'L:["Mode   Beer Constant","Beer   %.1f  19.0 \xb0C","Fridge 18.9  18.5 \xb0C","Idling for     00m05"]\n'
+			% beer)
+		yield t + 0.1, brewpiCapture.fromArduino, 'S:{"mode":"b","beerSet":19.0,"fridgeSet":18.5,"heatEst":0.2,"coolEst":5}\n'
+		if second % interval == 0:
+			yield t + 0.15, brewpiCapture.fromArduino, (
+				'T:{"BeerTemp":%.2f,"BeerSet":19.0,"BeerAnn":null,"FridgeTemp":18.91,"FridgeSet":18.5,'
+				'"FridgeAnn":null,"RoomTemp":21.3,"State":0}\n' % beer)
+		if second % 3600 == 0:
+			yield t + 0.2, brewpiCapture.fromArduino, 'D:{"logType":"I","logID":2,"V":[5,"28FF6C2A04000014","19.02"]}\n'
+
+
+if __name__ == '__main__':
+	opts, args = getopt.getopt(sys.argv[1:], "d:i:c:", ['days=', 'interval=', 'capture='])
+	days = 7.0
+	interval = 120
+	captureFile = None
+	for o, a in opts:
+		if o in ('-d', '--days'):
+			days = float(a)
+		elif o in ('-i', '--interval'):
+			interval = int(a)
+		elif o in ('-c', '--capture'):
+			captureFile = a
+	workDir = tempfile.mkdtemp()
+	try:
+		if captureFile is None:
+			captureFile = os.path.join(workDir, 'session.bpcap')
+			brewpiCapture.writeCaptureFile(captureFile, session(days, interval))
+		replay = brewpiReplay.Replay(os.path.join(workDir, 'replay'))
+		stdout = sys.stdout
+		sys.stdout = open(os.devnull, 'w')  # the temperature lines that brewpi.py prints
+		try:
+			replay.run(brewpiCapture.readCaptureFile(captureFile))
+		finally:
+			sys.stdout = stdout
+		stats = replay.finish()
+		lines = sum(stats['lines'].values())
+		print "%.1f days, %d lines, %d samples" % (stats['recordedSeconds'] / 86400.0, lines,
+		                                           stats['dataLog']['samplesWritten'])
+		print "replayed in %.2f s: %.1f days of data per second, %.0f lines/s, %.0f samples/s" % (
+			stats['replaySeconds'], stats['daysPerSecond'], lines / stats['replaySeconds'],
+			stats['dataLog']['samplesWritten'] / stats['replaySeconds'])
+	finally:
+		shutil.rmtree(workDir)
@@ -0,0 +1,79 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measures the time a chamber takes to make the reply to the commands that the web interface polls:
+# lcd, getControlSettings (in beer constant and in profile mode, which reads the profile name from the profile file)
+# and getControlVariables. Every command is measured with the cached reply, and with the reply invalidated before
+# every request, which is the cost of encoding it as it was done for every request before.
+# Run from the script directory: python benchmarks/responseCacheBenchmark.py [number of requests]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import configobj
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import brewpiChamber
+import brewpiResponseCache
+
+
+class NullConnection:
+	def send(self, data):
+		pass
+
+	sendall = send
+
+
+def measure(chamber, command, count, cached):
+	conn = NullConnection()
+	lineType = [t for t, commands in brewpiResponseCache.commandsForLine.items() if command in commands][0]
+	start = time.time()
+	for i in xrange(count):
+		if not cached:
+			chamber.responseCache.lineChanged(lineType)
+		chamber.handleMessage(conn, command, '')
+	return (time.time() - start) / count
+
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	workDir = tempfile.mkdtemp()
+	try:
+		config = configobj.ConfigObj(['scriptPath = %s' % workDir, 'wwwPath = %s/www' % workDir, 'interval = 120.0',
+		                              'dataLogging = active', '[chambers]', '[[f1]]', 'port = none'])
+		chamber = brewpiChamber.Chamber('f1', config, os.path.join(workDir, 'config.cfg'), None, None)
+		os.makedirs(chamber.config['scriptPath'] + 'settings')
+		with open(chamber.config['scriptPath'] + 'settings/tempProfile.csv', 'w') as f:
+			f.write("date,temperature,ale\n2013-01-01T00:00:00,20.0\n")
+		chamber.handleLcdText('["Mode   Beer Constant","Beer   19.0  19.0 \xb0C","Fridge 18.9  18.5 \xb0C",'
+		                      '"Idling for     00m05"]')
+		chamber.handleControlVariables('{"beerDiff":0.02,"diffIntegral":0.5,"beerSlope":-0.01,"p":1.2,"i":0.3,'
+		                               '"d":-0.1,"estPeak":18.9,"negPeakEst":0.0,"posPeakEst":0.0,"negPeak":0.0,'
+		                               '"posPeak":0.0}')
+		print "us per request              encoded    cached"
+		for mode in ('b', 'p'):
+			chamber.handleControlSettings('{"mode":"%s","beerSet":19.0,"fridgeSet":18.5,"heatEst":0.2,"coolEst":5}'
+			                              % mode)
+			for command in ('lcd', 'getControlSettings', 'getControlVariables'):
+				if mode == 'p' and command != 'getControlSettings':
+					continue
+				name = command + (' (profile)' if mode == 'p' else '')
+				print "%-28s %7.2f %9.2f" % (name, measure(chamber, command, count, False) * 1e6,
+				                             measure(chamber, command, count, True) * 1e6)
+	finally:
+		shutil.rmtree(workDir)
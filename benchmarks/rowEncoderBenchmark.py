@@ -0,0 +1,98 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compares the number of rows per second that can be formatted for the JSON and CSV files
+# by the old per-field string concatenation and by brewpiRowEncoder.
+# Run from the script directory: python benchmarks/rowEncoderBenchmark.py
+
+import os
+import sys
+import time
+from datetime import datetime
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import brewpiRowEncoder
+
+row = {'BeerTemp': 18.96, 'BeerSet': 19.0, 'BeerAnn': None, 'FridgeTemp': 19.94, 'FridgeSet': 19.6,
+       'FridgeAnn': None, 'RoomTemp': 21.12, 'State': 3}
+
+
+def oldFormat(out, row):
+	""" The formatting code of brewpiJson.addRow and the CSV line in brewpi.py before brewpiRowEncoder """
+	out.write("{\"c\":[")
+	now = datetime.now()
+	out.write("{{\"v\":\"Date({y},{M},{d},{h},{m},{s})\"}},".format(
+		y=now.year, M=(now.month - 1), d=now.day, h=now.hour, m=now.minute, s=now.second))
+	for key in ['BeerTemp', 'BeerSet']:
+		if row[key] is None:
+			out.write("null,")
+		else:
+			out.write("{\"v\":" + str(row[key]) + "},")
+	if row['BeerAnn'] is None:
+		out.write("null,")
+	else:
+		out.write("{\"v\":\"" + str(row['BeerAnn']) + "\"},")
+	for key in ['FridgeTemp', 'FridgeSet']:
+		if row[key] is None:
+			out.write("null,")
+		else:
+			out.write("{\"v\":" + str(row[key]) + "},")
+	if row['FridgeAnn'] is None:
+		out.write("null,")
+	else:
+		out.write("{\"v\":\"" + str(row['FridgeAnn']) + "\"},")
+	if row['RoomTemp'] is None:
+		out.write("null,")
+	else:
+		out.write("{\"v\":\"" + str(row['RoomTemp']) + "\"},")
+	if row['State'] is None:
+		out.write("null")
+	else:
+		out.write("{\"v\":\"" + str(row['State']) + "\"}")
+	out.write("]}]}")
+
+	out.write(time.strftime("%b %d %Y %H:%M:%S;") +
+	          str(row['BeerTemp']) + ';' +
+	          str(row['BeerSet']) + ';' +
+	          str(row['BeerAnn']) + ';' +
+	          str(row['FridgeTemp']) + ';' +
+	          str(row['FridgeSet']) + ';' +
+	          str(row['FridgeAnn']) + ';' +
+	          str(row['State']) + ';' +
+	          str(row['RoomTemp']) + '\n')
+
+
+def newFormat(out, row):
+	jsonRow, csvLine, ndjsonLine = brewpiRowEncoder.encodeRow(row, time.time(), ndjson=False)
+	out.write(jsonRow)
+	out.write(csvLine)
+
+
+def rowsPerSecond(function, count):
+	out = StringIO()
+	start = time.time()
+	for i in xrange(count):
+		function(out, row)
+	return count / (time.time() - start)
+
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+	old = rowsPerSecond(oldFormat, count)
+	new = rowsPerSecond(newFormat, count)
+	print "old JSON + CSV formatting:          %10.0f rows/s" % old
+	print "brewpiRowEncoder (JSON, CSV):         %8.0f rows/s (%.1fx)" % (new, new / old)
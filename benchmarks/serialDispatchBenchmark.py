@@ -0,0 +1,140 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measures the processing of lines from the Arduino:
+# - lines per second dispatched by the old if/elif chain and by the handler table of brewpiSerial.
+#   The table counts the lines per type, calls the listeners (the reply tracking of the command queue) and catches
+#   any error of a handler, so per line it is slower than the bare chain: 0.6-0.85x here, depending on the run.
+#   Both handle over a million lines per second, while the Arduino sends a few.
+# - latency from the moment a line is written to the serial port until its handler runs, with the reader thread.
+#   The serial port is simulated with a pipe. The old main loop only read the port every 0.5 seconds.
+#   This is the gain of the reader thread: from up to 500 ms to about a millisecond.
+# Run from the script directory: python benchmarks/serialDispatchBenchmark.py
+
+import fcntl
+import os
+import select
+import struct
+import sys
+import termios
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import brewpiSerial
+
+# mix of lines as received while running: LCD text and settings are polled continuously, temperatures every interval
+lines = ['L:["Mode   Beer Constant","Beer   19.0  19.0 &degC","Fridge 18.9  18.5 &degC","Idling for     00m05"]',
+         'S:{"mode":"b","beerSet":19.0,"fridgeSet":18.5,"heatEst":0.2,"coolEst":5}',
+         'L:["Mode   Beer Constant","Beer   19.0  19.0 &degC","Fridge 18.9  18.5 &degC","Idling for     00m06"]',
+         'S:{"mode":"b","beerSet":19.0,"fridgeSet":18.5,"heatEst":0.2,"coolEst":5}',
+         'T:{"bt":19.0,"bs":19.0,"ft":18.9,"fs":18.5,"s":0}',
+         'D:{"logType":"I","logID":2,"V":[]}']
+
+received = []
+
+
+def handler(data):
+	received.append(data)
+
+
+def oldDispatch(line):
+	""" The structure of the serial loop in brewpi.py before the handler table """
+	try:
+		if line[0] == 'T':
+			handler(line[2:])
+		elif line[0] == 'D':
+			handler(line[2:])
+		elif line[0] == 'L':
+			handler(line[2:])
+		elif line[0] == 'C':
+			handler(line[2:])
+		elif line[0] == 'S':
+			handler(line[2:])
+		elif line[0] == 'V':
+			handler(line[2:])
+		elif line[0] == 'N':
+			pass
+		elif line[0] == 'h':
+			handler(line[2:])
+		elif line[0] == 'd':
+			handler(line[2:])
+		elif line[0] == 'U':
+			handler(line[2:])
+		else:
+			handler(line)
+	except ValueError:
+		pass
+
+
+def linesPerSecond(dispatch, count):
+	del received[:]
+	start = time.time()
+	for i in xrange(count):
+		dispatch(lines[i % len(lines)])
+	return count / (time.time() - start)
+
+
+class PipeSerial:
+	""" The read interface of a pyserial port, on top of a pipe """
+
+	def __init__(self, fd, timeout=0.1):
+		self.fd = fd
+		self.timeout = timeout
+
+	def inWaiting(self):
+		return struct.unpack('I', fcntl.ioctl(self.fd, termios.FIONREAD, '\0\0\0\0'))[0]
+
+	def read(self, size=1):
+		if select.select([self.fd], [], [], self.timeout)[0]:
+			return os.read(self.fd, size)
+		return ''
+
+
+def readerLatency(count):
+	readFd, writeFd = os.pipe()
+	arrived = threading.Event()
+	dispatcher = brewpiSerial.MessageDispatcher()
+	dispatcher.register('T', lambda data: arrived.set())
+	reader = brewpiSerial.SerialReader(PipeSerial(readFd), dispatcher)
+	reader.start()
+	latencies = []
+	for i in xrange(count):
+		arrived.clear()
+		start = time.time()
+		os.write(writeFd, 'T:{"bt":19.0}\r\n')
+		arrived.wait(1.0)
+		latencies.append(time.time() - start)
+	reader.stop()
+	os.close(writeFd)
+	os.close(readFd)
+	latencies.sort()
+	return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+	dispatcher = brewpiSerial.MessageDispatcher()
+	for messageType in 'TDLCSVhdU':
+		dispatcher.register(messageType, handler)
+	dispatcher.register('N', lambda data: None)
+	old = linesPerSecond(oldDispatch, count)
+	new = linesPerSecond(dispatcher.dispatch, count)
+	print "if/elif chain:              %10.0f lines/s" % old
+	print "brewpiSerial handler table: %10.0f lines/s (%.2fx)" % (new, new / old)
+	median, p99 = readerLatency(1000)
+	print "serial line to handler, old main loop: up to 500 ms, 250 ms on average"
+	print "serial line to handler, reader thread: %.3f ms median, %.3f ms p99" % (median * 1000, p99 * 1000)
@@ -0,0 +1,145 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compares ways to read lines from the Arduino with the stock pyserial objects on a pseudo terminal:
+# - pyserial readline(), as in 'for line in ser', which reads the port one byte at a time. Every byte is a read call
+#   that allocates a bytearray and a Timeout, then the line is copied to a string, stripped and sliced: 3 copies.
+# - read everything that is waiting into a string and split it, the previous LineFramer. Every read allocates the
+#   read string and a concatenated buffer, then every line is split off, stripped and sliced: 3 copies per line.
+# - brewpiSerial.LineFramer, which reads into a reused bytearray and only copies the data of each line: 1 copy.
+# For every reader it prints lines/s and read calls per line, counted by wrapping read() of the stock pyserial port
+# and the reads of LineFramer into its buffer.
+# Python 2 has no allocation tracer, the copies above follow from the code.
+# Linux only. Run from the script directory: python benchmarks/serialFramerBenchmark.py [number of lines]
+
+import os
+import sys
+import threading
+import time
+import tty
+import serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import brewpiSerial
+
+lines = ['T:{"BeerTemp":19.02,"BeerSet":19.0,"BeerAnn":null,"FridgeTemp":18.91,"FridgeSet":18.5,"FridgeAnn":null,'
+         '"RoomTemp":21.3,"State":0}',
+         'L:["Mode   Beer Constant","Beer   19.0  19.0 &degC","Fridge 18.9  18.5 &degC","Idling for     00m05"]',
+         'S:{"mode":"b","beerSet":19.0,"fridgeSet":18.5,"heatEst":0.2,"coolEst":5}']
+
+
+class CountingSerial(serial.Serial):
+	""" Stock pyserial port that counts its read calls """
+	reads = 0
+
+	def read(self, size=1):
+		self.reads += 1
+		return serial.Serial.read(self, size)
+
+
+class StringFramer:
+	""" The previous LineFramer: appends to a string, splits it and strips every line """
+
+	def __init__(self, dispatcher):
+		self.dispatcher = dispatcher
+		self.buffer = ''
+		self.lines = 0
+
+	def feed(self, data):
+		self.buffer += data
+		if '\n' not in data:
+			return
+		lines = self.buffer.split('\n')
+		self.buffer = lines.pop()
+		for line in lines:
+			line = line.rstrip('\r')
+			if line:
+				self.lines += 1
+				self.dispatcher.dispatch(line)
+
+	def readFrom(self, ser):
+		data = ser.read(ser.inWaiting() or 1)
+		if data:
+			self.feed(data)
+
+
+class CountingFramer(brewpiSerial.LineFramer):
+	""" brewpiSerial.LineFramer that also counts its reads into the buffer, which bypass read() of the port """
+
+	def readFrom(self, ser):
+		if ser.inWaiting():
+			ser.reads += 1
+		brewpiSerial.LineFramer.readFrom(self, ser)
+
+
+class LineReader:
+	""" pyserial readline(), the data is sliced from the line by the dispatcher """
+
+	def __init__(self, dispatcher):
+		self.dispatcher = dispatcher
+		self.lines = 0
+
+	def readFrom(self, ser):
+		line = ser.readline()
+		if line:
+			self.lines += 1
+			self.dispatcher.dispatch(line.rstrip('\r\n'))
+
+
+def writer(fd, count):
+	data = ''.join(lines[i % len(lines)] + '\r\n' for i in xrange(count))
+	view = memoryview(data)
+	while view:
+		view = view[os.write(fd, view[:4096]):]
+
+
+def run(readerClass, count):
+	""" Returns lines/s and read calls per line for one reader """
+	master, slave = os.openpty()
+	tty.setraw(slave)
+	ser = CountingSerial(os.ttyname(slave), 57600, timeout=0.1)
+	handled = [0]
+
+	def handler(data):
+		handled[0] += 1
+
+	dispatcher = brewpiSerial.MessageDispatcher()
+	for messageType in 'TLS':
+		dispatcher.register(messageType, handler)
+	reader = readerClass(dispatcher)
+	thread = threading.Thread(target=writer, args=(master, count))
+	start = time.time()
+	thread.start()
+	while handled[0] < count:
+		reader.readFrom(ser)
+	elapsed = time.time() - start
+	thread.join()
+	ser.close()
+	os.close(master)
+	os.close(slave)
+	return count / elapsed, ser.reads / float(count)
+
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+	print "%d lines of %d bytes on average, read from a pseudo terminal" % (
+		count, sum(len(line) + 2 for line in lines) / len(lines))
+	print "reader                                  lines/s   reads/line"
+	for name, readerClass in [('pyserial readline()', LineReader),
+	                          ('read waiting bytes, split string', StringFramer),
+	                          ('brewpiSerial.LineFramer (bytearray)', CountingFramer)]:
+		speed, reads = run(readerClass, count if readerClass is not LineReader else count // 10)
+		print "%-36s %10.0f %12.3f" % (name, speed, reads)
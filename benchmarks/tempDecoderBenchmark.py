@@ -0,0 +1,92 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# Measures the cost per temperature line of turning the data of a 'T' line into the row for the data log:
+# - the previous path of brewpi.py: json.loads, renameTempKey building its dict for every key, merge into prevTempJson
+# - the previous path of brewpiChamber: the same with a module level rename dict
+# - brewpiSample.TempDecoder, for lines with the known short keys and for lines with long keys (generic path)
+# Each path ends with the row dict that is queued for the data log writer.
+# Run from the script directory: python benchmarks/tempDecoderBenchmark.py [number of lines]
+
+import os
+import sys
+import time
+import simplejson as json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import brewpiSample
+
+lines = ['{"bt":%.2f,"bs":19.0,"ba":null,"ft":%.2f,"fs":18.5,"fa":null,"rt":21.3,"s":%d}' % (
+	19.0 + i * 0.01, 18.5 + (i % 7) * 0.1, i % 3) for i in range(100)]
+longLines = [line.replace('"bt"', '"BeerTemp"').replace('"ft"', '"FridgeTemp"') for line in lines]
+
+
+def renameTempKey(key):
+	rename = {
+		"bt": "BeerTemp",
+		"bs": "BeerSet",
+		"ba": "BeerAnn",
+		"ft": "FridgeTemp",
+		"fs": "FridgeSet",
+		"fa": "FridgeAnn",
+		"rt": "RoomTemp",
+		"s": "State",
+		"t": "Time"}
+	return rename.get(key, key)
+
+
+prevTempJson = dict(BeerTemp=0, FridgeTemp=0, BeerAnn=None, FridgeAnn=None, RoomTemp=None, State=None, BeerSet=0,
+                    FridgeSet=0)
+
+
+def oldScriptPath(data):
+	newData = json.loads(data)
+	for key in newData:
+		prevTempJson[renameTempKey(key)] = newData[key]
+	return dict(prevTempJson)  # the copy made by DataLogWriter.put
+
+
+def oldChamberPath(data, renameTempKeys=brewpiSample.renameTempKeys):
+	newData = json.loads(data)
+	for key in newData:
+		prevTempJson[renameTempKeys.get(key, key)] = newData[key]
+	return dict(prevTempJson)
+
+
+decoder = brewpiSample.TempDecoder()
+
+
+def decoderPath(data):
+	return dict(decoder.decode(data).asDict())
+
+
+def microseconds(path, data, count):
+	start = time.time()
+	for i in xrange(count // len(data)):
+		for line in data:
+			path(line)
+	return (time.time() - start) / count * 1e6
+
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+	old = microseconds(oldScriptPath, lines, count)
+	print "brewpi.py, json.loads + renameTempKey:        %6.2f us/line" % old
+	print "brewpiChamber, json.loads + rename dict:      %6.2f us/line" % microseconds(oldChamberPath, lines, count)
+	new = microseconds(decoderPath, lines, count)
+	print "TempDecoder, short keys:                      %6.2f us/line (%.1fx)" % (new, old / new)
+	decoder = brewpiSample.TempDecoder()
+	print "TempDecoder, long keys (generic path):        %6.2f us/line" % microseconds(decoderPath, longLines, count)
@@ -0,0 +1,284 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import threading
+import time
+import BrewPiUtil as util
+
+# Capture of the serial traffic with the Arduino, to diagnose intermittent serial problems after the fact.
+# Every read from and every write to the port is a frame: monotonic timestamp, direction and the bytes.
+# The last frames are kept in a ring buffer in memory, which can be requested on the socket (getSerialCapture)
+# and is saved to a capture file when the script crashes. Optionally, all frames are also appended to a capture file.
+#
+# Capture file: the header, then one record per frame:
+# header: magic, wall clock time and monotonic time of the same moment, to convert frame times to wall clock time
+# record: monotonic time, direction, length, bytes
+fileMagic = 'BPCAP1\n'
+fileHeaderFormat = '<dd'
+recordHeaderFormat = '<dcI'
+recordHeaderSize = struct.calcsize(recordHeaderFormat)
+
+fromArduino = '<'
+toArduino = '>'
+
+
+def loadMonotonicClock():
+	"""
+	Returns a function for the time of CLOCK_MONOTONIC in seconds, which does not jump when the system clock is set.
+	Python 2 has no time.monotonic, so clock_gettime is called with ctypes. Falls back to time.time when not on Linux.
+	"""
+	class timespec(ctypes.Structure):
+		_fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+	if not sys.platform.startswith('linux'):
+		return time.time
+	try:
+		librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+		clock_gettime = librt.clock_gettime
+	except (OSError, AttributeError, TypeError):
+		return time.time
+	clockMonotonic = 1  # CLOCK_MONOTONIC
+	if clock_gettime(clockMonotonic, ctypes.byref(timespec())) != 0:
+		return time.time
+
+	def monotonic():
+		t = timespec()  # one per call, the reader thread and the main thread both record frames
+		clock_gettime(clockMonotonic, ctypes.byref(t))
+		return t.tv_sec + t.tv_nsec * 1e-9
+
+	return monotonic
+
+
+monotonic = loadMonotonicClock()
+
+
+class SerialCapture:
+	"""
+	Ring buffer of the frames read from and written to a serial port.
+	Frames are recorded by the reader thread and by the thread that writes to the port, so all state is behind a lock.
+	"""
+
+	def __init__(self, size=1000, fileName=None, maxFileSize=10 * 1024 * 1024):
+		"""
+		Params:
+		size: number of frames kept in memory
+		fileName: capture file to which all frames are appended, None to only keep them in memory
+		maxFileSize: when the capture file grows beyond this size, it is moved to <fileName>.1 and a new one is started.
+		The capture file of the previous run is moved to <fileName>.1 as well.
+		"""
+		self.frames = collections.deque(maxlen=size)
+		self.startTime = time.time()
+		self.startMonotonic = monotonic()
+		self.fileName = fileName
+		self.maxFileSize = maxFileSize
+		self.file = None
+		self.counts = {fromArduino: 0, toArduino: 0}
+		self.bytes = {fromArduino: 0, toArduino: 0}
+		self.lock = threading.Lock()
+		if fileName:
+			self.openFile()
+
+	def openFile(self):
+		if os.path.exists(self.fileName):
+			os.rename(self.fileName, self.fileName + '.1')
+		self.file = open(self.fileName, 'wb')
+		self.file.write(fileMagic + struct.pack(fileHeaderFormat, self.startTime, self.startMonotonic))
+
+	def record(self, direction, data):
+		"""
+		Adds a frame. Called for every read and write, so it only appends to the ring buffer and the file buffer.
+		"""
+		with self.lock:
+			timestamp = monotonic()
+			self.frames.append((timestamp, direction, data))
+			self.counts[direction] += 1
+			self.bytes[direction] += len(data)
+			if self.file is not None:
+				self.file.write(struct.pack(recordHeaderFormat, timestamp, direction, len(data)) + data)
+				if self.file.tell() > self.maxFileSize:
+					self.file.close()
+					self.openFile()
+
+	def attach(self, ser):
+		"""
+		Records all reads and writes of an open serial port, by wrapping the read and write methods of the instance.
+		brewpiSerial.LineFramer reads into its buffer without read and records those reads itself.
+		"""
+		read = ser.read
+		write = ser.write
+
+		def capturedRead(size=1):
+			data = read(size)
+			if data:
+				self.record(fromArduino, data)
+			return data
+
+		def capturedWrite(data):
+			self.record(toArduino, data)
+			return write(data)
+
+		ser.read = capturedRead
+		ser.write = capturedWrite
+		ser.capture = self
+
+	def wallTime(self, timestamp):
+		return self.startTime + timestamp - self.startMonotonic
+
+	def toJson(self, count=None):
+		"""
+		Returns the last frames as a list of [wall clock time, direction, data] for the socket.
+		Bytes that are not ASCII, like the degree sign in the LCD text, are decoded as latin-1.
+		"""
+		with self.lock:
+			frames = list(self.frames)
+		if count is not None:
+			frames = frames[-count:]
+		return [[round(self.wallTime(t), 6), direction, data.decode('latin-1')] for t, direction, data in frames]
+
+	def save(self, fileName):
+		"""
+		Writes the frames in the ring buffer to a new capture file
+		"""
+		with self.lock:
+			frames = list(self.frames)
+		with open(fileName, 'wb') as f:
+			f.write(fileMagic + struct.pack(fileHeaderFormat, self.startTime, self.startMonotonic))
+			for timestamp, direction, data in frames:
+				f.write(struct.pack(recordHeaderFormat, timestamp, direction, len(data)) + data)
+
+	def stats(self):
+		with self.lock:
+			return dict(frames=dict(self.counts), bytes=dict(self.bytes), buffered=len(self.frames),
+			            capacity=self.frames.maxlen, fileName=self.fileName)
+
+	def flush(self):
+		with self.lock:
+			if self.file is not None:
+				self.file.flush()
+
+	def close(self):
+		with self.lock:
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+
+
+def readCaptureFile(fileName):
+	"""
+	Generator for the frames in a capture file, as (wall clock time, direction, data).
+	Reading stops at an incomplete last record, which was being written when the script stopped.
+	"""
+	with open(fileName, 'rb') as f:
+		if f.read(len(fileMagic)) != fileMagic:
+			raise ValueError("%s is not a serial capture file" % fileName)
+		startTime, startMonotonic = struct.unpack(fileHeaderFormat, f.read(struct.calcsize(fileHeaderFormat)))
+		while True:
+			header = f.read(recordHeaderSize)
+			if len(header) < recordHeaderSize:
+				return
+			timestamp, direction, length = struct.unpack(recordHeaderFormat, header)
+			data = f.read(length)
+			if len(data) < length:
+				return
+			yield startTime + timestamp - startMonotonic, direction, data
+
+
+def writeCaptureFile(fileName, frames):
+	"""
+	Writes frames given as (wall clock time, direction, data) to a capture file, for example a session made up for a test
+	"""
+	with open(fileName, 'wb') as f:
+		f.write(fileMagic + struct.pack(fileHeaderFormat, 0.0, 0.0))  # the times of the records are wall clock times
+		for timestamp, direction, data in frames:
+			f.write(struct.pack(recordHeaderFormat, timestamp, direction, len(data)) + data)
+
+
+def captureFromConfig(config):
+	"""
+	Creates the serial capture for the settings in a config:
+	serialCapture (default true), serialCaptureSize (frames in memory, default 1000) and
+	serialCaptureFile (file that all frames are appended to, default none).
+	The old dumpSerial setting appends all frames to logs/serialCapture.bpcap.
+	Returns None when capturing is switched off.
+	"""
+	if not util.configBool(config, 'serialCapture', True):
+		return None
+	fileName = config.get('serialCaptureFile') or None
+	if fileName is None and util.configBool(config, 'dumpSerial', False):
+		fileName = util.addSlash(config['scriptPath']) + 'logs/serialCapture.bpcap'
+	return SerialCapture(size=int(config.get('serialCaptureSize', 1000)), fileName=fileName)
+
+
+def captureFileName(path, name):
+	""" Returns the name of a new capture file in path, with the time in the name """
+	return os.path.join(path, '%s-%s.bpcap' % (name, time.strftime('%Y%m%d-%H%M%S')))
+
+
+# functions that save the captures when the script or one of its threads stops with an exception
+crashHandlers = []
+
+
+def installCrashHandler(captures, path):
+	"""
+	Saves the ring buffers of the captures to capture files in path when the script stops with an exception.
+	sys.excepthook is not called for threads, the threads of the script call saveCrashCaptures themselves.
+
+	Params:
+	captures: function that returns a dict of name: SerialCapture, called when the exception happens
+	path: directory for the capture files
+	"""
+	previousHook = sys.excepthook
+
+	def saveCaptures():
+		for name, capture in captures().items():
+			if capture is None:
+				continue
+			fileName = captureFileName(path, 'crash-' + name)
+			try:
+				capture.save(fileName)
+				util.logMessage("Serial capture of the last %d frames saved to %s" % (len(capture.frames), fileName))
+			except IOError as e:
+				util.logMessage("Could not save serial capture to %s: %s" % (fileName, e.strerror))
+
+	def excepthook(excType, value, tb):
+		saveCaptures()
+		previousHook(excType, value, tb)
+
+	crashHandlers.append(saveCaptures)
+	sys.excepthook = excepthook
+
+
+def saveCrashCaptures():
+	"""
+	Saves the captures of the installed crash handlers, called by a thread that stops with an exception
+	"""
+	for saveCaptures in list(crashHandlers):
+		saveCaptures()
+
+
+if __name__ == '__main__':
+	# prints a capture file, one frame per line
+	if len(sys.argv) != 2:
+		sys.exit("Usage: python brewpiCapture.py <capture file>")
+	for frameTime, frameDirection, frameData in readCaptureFile(sys.argv[1]):
+		print "%s.%03d %s %r" % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(frameTime)),
+		                         int(frameTime * 1000) % 1000, frameDirection, frameData)
@@ -0,0 +1,852 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import os
+import re
+import shutil
+import time
+import configobj
+import serial
+import simplejson as json
+import brewpiJson
+import brewpiLogWriter
+import brewpiRollup
+import brewpiIndex
+import brewpiHistory
+import brewpiSerial
+import brewpiEventLoop
+import brewpiCapture
+import brewpiSample
+import brewpiResponseCache
+import brewpiCommands
+import expandLogMessage
+import temperatureProfile
+import pinList
+import BrewPiUtil as util
+from brewpiVersion import AvrInfo
+
+# One fermentation chamber: the state of its Arduino, its serial port, its data files, temperature profile and
+# socket commands. brewpi.py runs a single chamber, brewpiMulti.py runs several chambers that share one event loop,
+# one socket and one data log writer.
+#
+# In multi-controller mode, every chamber has its own directory for data and settings, chambers/<chamber>/ in
+# scriptPath and in wwwPath, with the same layout as the directories of a single controller.
+# The chamber of brewpi.py has no name and uses scriptPath and wwwPath themselves.
+
+compatibleBrewpiVersion = "0.2.3"
+
+# Settings will be read from Arduino, initialize with same defaults as Arduino.
+# This is mainly to show what's expected. Will all be overwritten on the first update from the arduino
+defaultControlSettings = dict(mode='b', beerSet=20.0, fridgeSet=20.0, heatEstimator=0.2, coolEstimator=5)
+defaultControlConstants = dict(tempFormat="C", tempSetMin=1.0, tempSetMax=30.0, pidMax=10.0, Kp=20.000, Ki=0.600,
+                               Kd=-3.000, iMaxErr=0.500, idleRangeH=1.000, idleRangeL=-1.000, heatTargetH=0.301,
+                               heatTargetL=-0.199, coolTargetH=0.199, coolTargetL=-0.301, maxHeatTimeForEst="600",
+                               maxCoolTimeForEst="1200", fridgeFastFilt="1", fridgeSlowFilt="4", fridgeSlopeFilt="3",
+                               beerFastFilt="3", beerSlowFilt="5", beerSlopeFilt="4", lah=0, hs=0)
+defaultControlVariables = dict(beerDiff=0.000, diffIntegral=0.000, beerSlope=0.000, p=0.000, i=0.000, d=0.000,
+                               estPeak=0.000, negPeakEst=0.000, posPeakEst=0.000, negPeak=0.000, posPeak=0.000)
+
+versionTimeout = 12.0  # seconds of version requests before a chamber is reported as not programmed
+
+
+def chamberIds(config):
+	"""
+	Returns the names of the chambers in the [chambers] section of the config, in config file order
+	"""
+	chambers = config.get('chambers', {})
+	return [name for name in chambers if isinstance(chambers[name], dict)]
+
+
+def isValidChamberId(chamberId):
+	# chamber names are used in file names and to route socket messages
+	return re.match(r'^[A-Za-z0-9_-]+$', chamberId) is not None
+
+
+def parseMessage(message):
+	"""
+	Splits a socket message in multi-controller mode into chamber, message type and value.
+	A message for a chamber starts with the chamber name and a slash: 'fermenter2/setBeer=18.5'.
+
+	Returns:
+	(chamber name or None, message type, value) tuple
+	"""
+	chamberId = None
+	slash = message.find('/')
+	if slash > 0 and '=' not in message[:slash]:
+		chamberId, message = message[:slash], message[slash + 1:]
+	if "=" in message:
+		messageType, value = message.split("=", 1)
+	else:
+		messageType, value = message, ""
+	return chamberId, messageType, value
+
+
+def chamberConfig(config, chamberId):
+	"""
+	Returns the settings of a chamber: the top level settings, with the paths of the chamber directories and the
+	settings of the chamber section in [chambers]. The single chamber of brewpi.py (chamberId None) only has the top
+	level settings.
+	"""
+	settings = dict((key, value) for key, value in config.items() if not isinstance(value, dict))
+	settings['scriptPath'] = util.addSlash(config['scriptPath'])
+	settings['wwwPath'] = util.addSlash(config['wwwPath'])
+	if chamberId is not None:
+		settings['scriptPath'] += 'chambers/' + chamberId + '/'
+		settings['wwwPath'] += 'chambers/' + chamberId + '/'
+		settings.update(config['chambers'][chamberId])
+	return settings
+
+
+commandTable = []  # (name, method, parser) of the socket commands, registered in the CommandRegistry of every chamber
+
+
+def chamberCommand(name, parse=brewpiCommands.text):
+	"""
+	Decorator for the Chamber methods that handle a socket command, see brewpiCommands.CommandRegistry.register
+	"""
+	def decorator(method):
+		commandTable.append((name, method, parse))
+		return method
+	return decorator
+
+
+class Chamber:
+	def __init__(self, chamberId, config, configFile, loop, dataLogWriter, clock=time.time, lock=None):
+		"""
+		Params:
+		chamberId: name of the chamber section in the config, None for the single chamber of brewpi.py
+		config: ConfigObj of the process, with the [chambers] section in multi-controller mode
+		configFile: user config file, chamber settings that are changed on the socket are saved there
+		loop: brewpiEventLoop.EventLoop that reads the serial port
+		dataLogWriter: brewpiLogWriter.DataLogWriter shared by all chambers
+		clock: function that returns the time of the samples and the day of the data files. brewpiReplay
+		       replaces it with the recorded time.
+		lock: lock that is held while the handlers of the received lines run, when a serial reader thread runs
+		      them (see startReading). The event loop callbacks should hold it too.
+		"""
+		self.chamberId = chamberId
+		self.clock = clock
+		self.config = chamberConfig(config, chamberId)
+		self.profilePath = util.addSlash(config['wwwPath']) + 'data/profiles/'  # profiles are shared by all chambers
+		self.configFile = configFile
+		self.loop = loop
+		self.dataLogWriter = dataLogWriter
+
+		self.cs = dict(defaultControlSettings)
+		self.cc = dict(defaultControlConstants)
+		self.cv = dict(defaultControlVariables)
+		self.deviceList = dict(listState="", installed=[], available=[])
+		self.lcdText = ['Script starting up', ' ', ' ', ' ']
+		self.tempDecoder = brewpiSample.TempDecoder()
+		self.responseCache = brewpiResponseCache.ResponseCache()
+		self.events = brewpiEventLoop.EventPublisher(loop) if loop is not None else None
+		self.prevDataTime = 0.0
+		self.avrVersion = None
+		self.openTime = None
+		self.quietTime = 0.0
+		self.versionInterval = 0.1
+		self.versionWarning = False
+		self.startupStats = dict(handshake=None, firstSample=None)  # seconds after the port was opened
+
+		self.ser = None
+		self.transport = None
+		self.reader = None
+		self.capture = None
+		self.poller = brewpiSerial.DemandPoller(activeSeconds=float(self.config.get('pollActiveSeconds', 30)),
+		                                        idleInterval=float(self.config.get('pollIdleInterval', 10)))
+		self.commandQueue = brewpiSerial.CommandQueue(timeout=float(self.config.get('serialReplyTimeout', 5)))
+		self.dispatcher = brewpiSerial.MessageDispatcher(lock=lock)
+		self.dispatcher.addListener(self.commandQueue.reply)
+		for messageType, handler in [('T', self.handleTemperatures),
+		                             ('D', self.handleDebugMessage),
+		                             ('L', self.handleLcdText),
+		                             ('C', self.handleControlConstants),
+		                             ('S', self.handleControlSettings),
+		                             ('V', self.handleControlVariables),
+		                             ('N', self.handleVersion),
+		                             ('h', self.handleAvailableDevices),
+		                             ('d', self.handleInstalledDevices),
+		                             ('U', self.handleDeviceUpdate)]:
+			self.dispatcher.register(messageType, handler)
+		self.framer = brewpiSerial.LineFramer(self.dispatcher)
+		self.commands = brewpiCommands.CommandRegistry(self.logMessage)
+		for name, method, parse in commandTable:
+			self.commands.register(name, functools.partial(method, self), parse)
+
+		self.day = ""
+		self.jsonFileName = None
+		self.wwwJsonFileName = None
+		self.logTarget = None
+		self.rollups = None
+		self.index = None
+
+	def logMessage(self, message):
+		if self.chamberId is None:
+			util.logMessage(message)
+		else:
+			util.logMessage("[%s] %s" % (self.chamberId, message))
+		self.publishEvent('log', message)
+
+	def publishEvent(self, eventType, data):
+		if self.events is not None:
+			self.events.publish(eventType, data)
+
+	def setConfig(self, settingName, value):
+		"""
+		Changes a setting of the chamber and saves it in its section of the user config file,
+		at the top level for the single chamber of brewpi.py
+		"""
+		if self.chamberId is None:
+			util.configSet(self.configFile, settingName, value)
+		else:
+			try:
+				userConfig = configobj.ConfigObj(self.configFile)
+				userConfig.setdefault('chambers', {}).setdefault(self.chamberId, {})[settingName] = value
+				userConfig.write()
+			except IOError as e:
+				self.logMessage("I/O error(%d) while updating %s: %s " % (e.errno, self.configFile, e.strerror))
+		self.config[settingName] = value
+
+	def changeWwwSetting(self, settingName, value):
+		# userSettings.json is a copy of some of the settings that are needed by the web server.
+		# This allows the web server to load properly, even when the script is not running.
+		wwwSettingsFileName = self.config['wwwPath'] + 'userSettings.json'
+		wwwSettings = {}
+		if os.path.exists(wwwSettingsFileName):
+			try:
+				wwwSettings = json.load(open(wwwSettingsFileName, 'rb'))
+			except json.JSONDecodeError:
+				self.logMessage("Error in decoding userSettings.json, creating new empty json file")
+		wwwSettings[settingName] = str(value)
+		with open(wwwSettingsFileName, 'wb') as wwwSettingsFile:
+			wwwSettingsFile.write(json.dumps(wwwSettings))
+
+	def startLogging(self):
+		"""
+		Creates the directories of the chamber and starts logging the current beer
+		"""
+		for path in [self.config['scriptPath'] + 'settings', self.config['scriptPath'] + 'logs', self.config['wwwPath']]:
+			if not os.path.exists(path):
+				os.makedirs(path)
+		self.startBeer(self.config['beerName'])
+
+	def open(self):
+		"""
+		Starts logging and opens the serial port.
+		The version of the Arduino is requested without waiting for it, the reply is handled by the event loop.
+		"""
+		self.startLogging()
+		try:
+			ser = serial.Serial(self.config['port'], 57600, timeout=0.1)
+		except serial.SerialException as e:
+			self.logMessage("Error opening serial port: %s. The chamber is offline." % str(e))
+			self.setLcdText(['Could not open', 'serial port', self.config['port'], ' '])
+			return
+		self.usePort(ser)
+		self.startReading()
+		self.openTime = time.time()
+		if brewpiSerial.resetsOnOpen(self.config['boardType']):
+			self.quietTime = float(self.config.get('startupDelay', 10))
+		self.requestVersion()
+
+	def usePort(self, ser):
+		"""
+		Uses an open serial port for the Arduino of the chamber. The last frames sent and received are captured,
+		to diagnose serial problems afterwards.
+		"""
+		self.ser = ser
+		self.capture = brewpiCapture.captureFromConfig(self.config)
+		if self.capture is not None:
+			self.capture.attach(ser)
+
+	def startReading(self, readerThread=False, onError=None):
+		"""
+		Starts dispatching the lines received on the serial port as soon as they arrive
+
+		Params:
+		readerThread: read the port in a brewpiSerial.SerialReader thread instead of on the event loop.
+		              Windows cannot wait for a serial port with select.
+		onError: function that is called on the event loop with the exception when reading the port failed,
+		         serialError by default
+		"""
+		if onError is None:
+			onError = self.serialError
+		if readerThread:
+			self.reader = brewpiSerial.SerialReader(self.ser, self.dispatcher,
+			                                        onError=lambda e: self.loop.callSoonThreadsafe(onError, e))
+			self.framer = self.reader.framer
+			self.reader.start()
+		else:
+			self.transport = brewpiEventLoop.SerialTransport(self.loop, self.ser, self.framer, onError=onError)
+
+	def close(self):
+		if self.transport is not None:
+			self.transport.close()
+			self.transport = None
+		if self.reader is not None:
+			self.reader.stop()
+			self.reader = None
+		if self.ser is not None:
+			self.ser.close()
+			self.ser = None
+		if self.capture is not None:
+			self.capture.close()
+
+	def serialError(self, e):
+		"""
+		Called when reading the serial port failed, for example because the Arduino was unplugged.
+		The port is closed and the chamber is offline until the script is restarted, the other chambers keep running.
+		"""
+		self.logMessage("Serial port failed, the chamber is offline: %s" % str(e))
+		self.close()
+		self.setLcdText(['Serial port failed', self.config['port'], 'Chamber is offline', ' '])
+
+	def requestVersion(self):
+		"""
+		Startup handshake on the event loop, with the same timing as brewpiSerial.requestVersion.
+		Requests are repeated until the version is received, so an Arduino that is connected later is found too.
+		"""
+		if self.avrVersion is not None or self.ser is None:
+			return
+		elapsed = time.time() - self.openTime
+		if elapsed < self.quietTime and not self.framer.received:
+			self.loop.callLater(0.1, self.requestVersion)  # let a board that reset on open boot first
+			return
+		if not self.versionWarning and elapsed >= self.quietTime + versionTimeout:
+			self.versionWarning = True
+			self.warnNoVersion()
+		self.commandQueue.put('n')
+		self.commandQueue.flush(self.ser)
+		self.loop.callLater(self.versionInterval, self.requestVersion)
+		self.versionInterval = min(self.versionInterval * 2, 1.0)
+
+	def warnNoVersion(self):
+		self.logMessage("Warning: Cannot receive version number from Arduino. " +
+		                "Your Arduino is either not programmed or running a very old version of BrewPi. " +
+		                "Please upload a new version of BrewPi to your Arduino.")
+		self.setLcdText(['Could not receive', 'version from Arduino', 'Please (re)program', 'your Arduino'])
+
+	# handlers for the lines received from the Arduino of this chamber
+
+	def handleTemperatures(self, data):
+		self.prevDataTime = self.clock()
+		prefix = time.strftime("%b %d %Y %H:%M:%S  ", time.localtime(self.prevDataTime))
+		if self.chamberId is not None:
+			prefix += self.chamberId + " "
+		print prefix + data
+		if self.startupStats['firstSample'] is None:
+			self.startupStats['firstSample'] = time.time() - self.openTime
+			self.logMessage("Notification: first sample received %.2f seconds after startup" %
+			                self.startupStats['firstSample'])
+		row = self.tempDecoder.decode(data).asDict()
+		self.publishEvent('sample', row)
+		if self.config['dataLogging'] in ('paused', 'stopped') or self.logTarget is None:
+			return
+		self.dataLogWriter.put(self.logTarget, row, self.prevDataTime)
+
+	def handleDebugMessage(self, data):
+		try:
+			self.logMessage("Arduino debug message: " + expandLogMessage.expandLogMessage(data))
+		except Exception, e:  # catch all exceptions, because out of date file could cause errors
+			self.logMessage("Error while expanding log message '" + data + "'" + str(e))
+
+	def handleLcdText(self, data):
+		self.setLcdText(json.loads(data.replace('\xb0', '&deg')))
+
+	def handleControlConstants(self, data):
+		constants = json.loads(data)
+		if constants != self.cc:
+			self.cc = constants
+			self.responseCache.lineChanged('C')
+			self.publishEvent('controlConstants', constants)
+
+	def handleControlSettings(self, data):
+		settings = json.loads(data)
+		if settings != self.cs:
+			self.cs = settings
+			self.responseCache.lineChanged('S')
+			self.publishEvent('controlSettings', settings)
+
+	def handleControlVariables(self, data):
+		variables = json.loads(data)
+		if variables != self.cv:
+			self.cv = variables
+			self.responseCache.lineChanged('V')
+			self.publishEvent('controlVariables', variables)
+
+	def setLcdText(self, lcdText):
+		if lcdText != self.lcdText:
+			self.lcdText = lcdText
+			self.responseCache.lineChanged('L')
+			self.publishEvent('lcd', lcdText)
+
+	def setControlSettings(self, **settings):
+		"""
+		Changes control settings that are sent to the Arduino, before it replies with the new settings
+		"""
+		self.cs.update(settings)
+		self.responseCache.lineChanged('S')
+		self.publishEvent('controlSettings', self.cs)
+
+	def encodeControlSettings(self):
+		"""
+		Returns the JSON reply to getControlSettings: the control settings, the logging state and in profile mode the
+		name of the active profile, which is stored in the header of the profile file
+		"""
+		settings = dict(self.cs, dataLogging=self.config['dataLogging'])
+		if self.cs['mode'] == "p":
+			with open(self.config['scriptPath'] + 'settings/tempProfile.csv', 'r') as prof:
+				settings['profile'] = prof.readline().split(",")[-1].rstrip("\n")
+		return json.dumps(settings)
+
+	def handleVersion(self, data):
+		if self.avrVersion is not None:
+			return
+		self.avrVersion = AvrInfo(data)
+		self.startupStats['handshake'] = time.time() - self.openTime
+		self.logMessage("Found Arduino " + str(self.avrVersion.board) +
+		                " with a " + str(self.avrVersion.shield) + " shield, " +
+		                "running BrewPi version " + str(self.avrVersion.version) +
+		                " build " + str(self.avrVersion.build) +
+		                " in %.2f seconds" % self.startupStats['handshake'])
+		if self.avrVersion.version != compatibleBrewpiVersion:
+			self.logMessage("Warning: BrewPi version compatible with this script is " + compatibleBrewpiVersion +
+			                " but version number received is " + str(self.avrVersion.version))
+		if int(self.avrVersion.log) != int(expandLogMessage.getVersion()):
+			self.logMessage("Warning: version number of local copy of logMessages.h " +
+			                "does not match log version number received from Arduino." +
+			                "Arduino version = " + str(self.avrVersion.log) +
+			                ", local copy version = " + str(expandLogMessage.getVersion()))
+		self.commandQueue.put('s')  # request control settings cs
+		self.commandQueue.put('c')  # request control constants cc
+		self.commandQueue.put('t')  # request the first sample now instead of in the first serial pass
+
+	def handleAvailableDevices(self, data):
+		self.deviceList['available'] = json.loads(data)
+		self.deviceList['listState'] = self.deviceList['listState'].strip('h') + "h"
+		self.logMessage("Available devices received: " + str(self.deviceList['available']))
+		self.publishDeviceList()
+
+	def handleInstalledDevices(self, data):
+		self.deviceList['installed'] = json.loads(data)
+		self.deviceList['listState'] = self.deviceList['listState'].strip('d') + "d"
+		self.logMessage("Installed devices received: " + str(self.deviceList['installed']))
+		self.publishDeviceList()
+
+	def publishDeviceList(self):
+		if self.deviceList['listState'] in ["dh", "hd"]:
+			self.publishEvent('deviceList', self.deviceList)
+
+	def handleDeviceUpdate(self, data):
+		self.logMessage("Device updated to: " + data)
+
+	# data logging, in the directory of the chamber
+
+	def startBeer(self, beerName):
+		if self.config['dataLogging'] == 'active':
+			dataPath = util.addSlash(self.config['scriptPath'] + 'data/' + beerName)
+			wwwDataPath = util.addSlash(self.config['wwwPath'] + 'data/' + beerName)
+			for path in [dataPath, wwwDataPath]:
+				if not os.path.exists(path):
+					os.makedirs(path)
+					os.chmod(path, 0775)  # give group all permissions
+			self.day = time.strftime("%Y-%m-%d", time.localtime(self.clock()))
+			jsonFileName = beerName + '-' + self.day
+			if os.path.isfile(dataPath + jsonFileName + '.json'):
+				i = 1
+				while os.path.isfile(dataPath + jsonFileName + '-' + str(i) + '.json'):
+					i += 1
+				jsonFileName = jsonFileName + '-' + str(i)
+			self.jsonFileName = dataPath + jsonFileName + '.json'
+			self.wwwJsonFileName = wwwDataPath + jsonFileName + '.json'
+			brewpiJson.newEmptyFile(self.jsonFileName)
+			self.rollups = brewpiRollup.Rollups(dataPath, beerName)
+			self.index = brewpiIndex.BeerIndex(dataPath, beerName)
+			self.openLogTarget()
+		self.changeWwwSetting('beerName', beerName)
+
+	def openLogTarget(self):
+		beerName = self.config['beerName']
+		dataPath = util.addSlash(self.config['scriptPath'] + 'data/' + beerName)
+		wwwDataPath = util.addSlash(self.config['wwwPath'] + 'data/' + beerName)
+		ndjsonFileName = None
+		if util.configBool(self.config, 'ndjsonFiles', False):
+			ndjsonFileName = dataPath + beerName + '.ndjson'
+		self.logTarget = brewpiLogWriter.LogTarget(self.jsonFileName, self.wwwJsonFileName,
+		                                           dataPath + beerName + '.csv', wwwDataPath + beerName + '.csv',
+		                                           dataTableFiles=util.configBool(self.config, 'dataTableFiles', True),
+		                                           rollups=self.rollups, index=self.index,
+		                                           ndjsonFileName=ndjsonFileName, stream=self.chamberId)
+
+	def checkNewDay(self):
+		day = time.strftime("%Y-%m-%d", time.localtime(self.clock()))
+		if self.config['dataLogging'] == 'active' and self.day != day:
+			self.logMessage("Notification: New day, creating new JSON file.")
+			self.day = day
+			beerName = self.config['beerName']
+			jsonFileName = beerName + '/' + beerName + '-' + self.day + '.json'
+			self.jsonFileName = self.config['scriptPath'] + 'data/' + jsonFileName
+			self.wwwJsonFileName = self.config['wwwPath'] + 'data/' + jsonFileName
+			brewpiJson.newEmptyFile(self.jsonFileName)
+			self.openLogTarget()
+
+	def serialPass(self):
+		"""
+		Requests new data from the Arduino and applies the temperature profile, every serial check interval.
+		The replies are processed by the serial message handlers when they arrive.
+		"""
+		if self.ser is None:
+			return
+		if self.avrVersion is None:
+			self.commandQueue.flush(self.ser)
+			return
+		if self.events is not None:
+			# subscribers get the LCD text and settings as quickly as polling clients
+			if self.events.wants('lcd'):
+				self.poller.demand('l')
+			if self.events.wants('controlSettings'):
+				self.poller.demand('s')
+		for request in ('l', 's'):
+			if self.poller.due(request):
+				self.commandQueue.put(request)
+		if self.clock() - self.prevDataTime >= float(self.config['interval']):
+			self.commandQueue.put("t")
+		if self.cs['mode'] == 'p':
+			newTemp = temperatureProfile.getNewTemp(self.config['scriptPath'])
+			if newTemp != self.cs['beerSet']:
+				self.setControlSettings(beerSet=newTemp)
+				if self.cc['tempSetMin'] < newTemp < self.cc['tempSetMax']:
+					self.commandQueue.put("j{beerSet:" + str(self.cs['beerSet']) + "}")
+				elif newTemp is None:
+					self.logMessage("Temperature control disabled by empty cell in profile.")
+					self.commandQueue.put("j{beerSet:-99999}")
+		self.commandQueue.expire()
+		self.commandQueue.flush(self.ser)
+
+	def setTemperature(self, mode, settingName, newTemp, description):
+		if self.cc['tempSetMin'] <= newTemp <= self.cc['tempSetMax']:
+			self.setControlSettings(**{'mode': mode, settingName: round(newTemp, 2)})
+			self.commandQueue.put("j{mode:%s, %s:%s}" % (mode, settingName, str(self.cs[settingName])))
+			self.logMessage("Notification: %s temperature set to %s degrees in web interface" %
+			                (description, str(self.cs[settingName])))
+			return True
+		self.logMessage("%s temperature setting %s is outside of allowed range %s - %s" %
+		                (description, str(newTemp), str(self.cc['tempSetMin']), str(self.cc['tempSetMax'])))
+		return False
+
+	def handleMessage(self, conn, messageType, value):
+		"""
+		Processes a socket message for this chamber and sends the reply to conn, see commandTable.
+		brewpi.py and brewpiMulti.py register the commands for the whole process in the same registry.
+
+		Returns:
+		True when the serial communication of the chamber should be done right away, to update the Arduino
+		"""
+		return self.commands.call(conn, messageType, value)
+
+	@chamberCommand("lcd")
+	def lcdCommand(self, conn, value):
+		conn.send(self.responseCache.reply('lcd', lambda: json.dumps(self.lcdText)))
+		return self.poller.demand('l')
+
+	@chamberCommand("getMode")
+	def getModeCommand(self, conn, value):
+		conn.send(self.responseCache.reply('getMode', lambda: str(self.cs['mode'])))
+		return self.poller.demand('s')
+
+	@chamberCommand("getFridge")
+	def getFridgeCommand(self, conn, value):
+		conn.send(self.responseCache.reply('getFridge', lambda: str(self.cs['fridgeSet'])))
+		return self.poller.demand('s')
+
+	@chamberCommand("getBeer")
+	def getBeerCommand(self, conn, value):
+		conn.send(self.responseCache.reply('getBeer', lambda: str(self.cs['beerSet'])))
+		return self.poller.demand('s')
+
+	@chamberCommand("getControlConstants")
+	def getControlConstantsCommand(self, conn, value):
+		conn.send(self.responseCache.reply('getControlConstants', lambda: json.dumps(self.cc)))
+
+	@chamberCommand("getControlSettings")
+	def getControlSettingsCommand(self, conn, value):
+		# the reply also depends on the config, the profile name only changes with the profileName setting
+		conn.send(self.responseCache.reply('getControlSettings', self.encodeControlSettings,
+		                                   (self.config['dataLogging'], self.config.get('profileName'))))
+		return self.poller.demand('s')
+
+	@chamberCommand("getControlVariables")
+	def getControlVariablesCommand(self, conn, value):
+		conn.send(self.responseCache.reply('getControlVariables', lambda: json.dumps(self.cv)))
+
+	@chamberCommand("getResponseCacheStats")
+	def getResponseCacheStatsCommand(self, conn, value):
+		conn.send(json.dumps(self.responseCache.stats()))
+
+	@chamberCommand("subscribe")
+	def subscribeCommand(self, conn, value):
+		# the blocking loop of brewpi.py closes its connections after the reply, they cannot be subscribed
+		if self.events is not None and isinstance(conn, brewpiEventLoop.Connection):
+			self.events.subscribe(conn, value)
+
+	@chamberCommand("getEventStats")
+	def getEventStatsCommand(self, conn, value):
+		conn.send(json.dumps(self.events.stats() if self.events is not None else None))
+
+	@chamberCommand("getStats")
+	def getStatsCommand(self, conn, value):
+		conn.send(json.dumps(self.commands.stats()))
+
+	@chamberCommand("getRollups", brewpiCommands.rollupRange)
+	def getRollupsCommand(self, conn, request):
+		start, end, points = request
+		conn.sendall(json.dumps(self.rollups.query(start, end, points) if self.rollups is not None else None))
+
+	@chamberCommand("getSamples", brewpiCommands.timeRange)
+	def getSamplesCommand(self, conn, timeRange):
+		start, end = timeRange
+		if self.index is not None:
+			conn.sendall(brewpiJson.dataTable(self.index.query(start, end)))
+		else:
+			conn.send(json.dumps(None))
+
+	@chamberCommand("getHistory", brewpiCommands.timeRange)
+	def getHistoryCommand(self, conn, timeRange):
+		start, end = timeRange
+		if self.index is not None:
+			history = brewpiHistory.History(self.index.dataPath, self.index, start, end)
+			try:
+				conn.sendall(json.dumps(history.toJson()))
+			finally:
+				history.close()
+		else:
+			conn.send(json.dumps(None))
+
+	@chamberCommand("getDataTable")
+	def getDataTableCommand(self, conn, value):
+		if self.logTarget is not None:
+			conn.sendall(self.logTarget.store.dataTableJson())
+		else:
+			conn.send(json.dumps(None))
+
+	@chamberCommand("getSerialStats")
+	def getSerialStatsCommand(self, conn, value):
+		conn.send(json.dumps(dict(commands=self.commandQueue.getStats(), lines=self.dispatcher.stats(),
+		                          lineErrors=self.dispatcher.errorStats())))
+
+	@chamberCommand("getStartupStats")  # seconds until the Arduino answered and until the first sample
+	def getStartupStatsCommand(self, conn, value):
+		conn.send(json.dumps(self.startupStats))
+
+	@chamberCommand("getPollStats")
+	def getPollStatsCommand(self, conn, value):
+		conn.send(json.dumps(self.poller.stats()))
+
+	@chamberCommand("getSerialCapture", brewpiCommands.optional(brewpiCommands.intValue))
+	def getSerialCaptureCommand(self, conn, count):
+		if self.capture is not None:
+			conn.sendall(json.dumps(dict(stats=self.capture.stats(), frames=self.capture.toJson(count))))
+		else:
+			conn.send(json.dumps(None))
+
+	@chamberCommand("saveSerialCapture")
+	def saveSerialCaptureCommand(self, conn, value):
+		if self.capture is not None:
+			fileName = brewpiCapture.captureFileName(self.config['scriptPath'] + 'logs', 'serial')
+			self.capture.save(fileName)
+			self.logMessage("Serial capture saved to " + fileName)
+			conn.send(json.dumps(fileName))
+		else:
+			conn.send(json.dumps(None))
+
+	@chamberCommand("refreshControlConstants")
+	def refreshControlConstantsCommand(self, conn, value):
+		self.commandQueue.put("c")
+		return True
+
+	@chamberCommand("refreshControlSettings")
+	def refreshControlSettingsCommand(self, conn, value):
+		self.commandQueue.put("s")
+		return True
+
+	@chamberCommand("refreshControlVariables")
+	def refreshControlVariablesCommand(self, conn, value):
+		self.commandQueue.put("v")
+		return True
+
+	@chamberCommand("loadDefaultControlSettings")
+	def loadDefaultControlSettingsCommand(self, conn, value):
+		self.commandQueue.put("S")
+		return True
+
+	@chamberCommand("loadDefaultControlConstants")
+	def loadDefaultControlConstantsCommand(self, conn, value):
+		self.commandQueue.put("C")
+		return True
+
+	@chamberCommand("setBeer", brewpiCommands.floatValue)
+	def setBeerCommand(self, conn, newTemp):
+		return self.setTemperature('b', 'beerSet', newTemp, "Beer")
+
+	@chamberCommand("setFridge", brewpiCommands.floatValue)
+	def setFridgeCommand(self, conn, newTemp):
+		return self.setTemperature('f', 'fridgeSet', newTemp, "Fridge")
+
+	@chamberCommand("setOff")
+	def setOffCommand(self, conn, value):
+		self.setControlSettings(mode='o')
+		self.commandQueue.put("j{mode:o}")
+		self.logMessage("Notification: Temperature control disabled")
+		return True
+
+	@chamberCommand("setParameters", brewpiCommands.jsonValue)
+	def setParametersCommand(self, conn, decoded):
+		self.commandQueue.put("j" + json.dumps(decoded))
+		if 'tempFormat' in decoded:
+			self.changeWwwSetting('tempFormat', decoded['tempFormat'])
+		return True
+
+	@chamberCommand("interval", brewpiCommands.between(brewpiCommands.intValue, 6, 4999))
+	def intervalCommand(self, conn, newInterval):
+		self.setConfig('interval', str(float(newInterval)))
+		self.logMessage("Notification: Interval changed to " + str(newInterval) + " seconds")
+
+	@chamberCommand("startNewBrew")
+	def startNewBrewCommand(self, conn, value):
+		if len(value) > 1:  # shorter names are probably invalid
+			self.setConfig('beerName', value)
+			self.setConfig('dataLogging', 'active')
+			self.startBeer(value)
+			self.logMessage("Notification: Restarted logging for beer '%s'." % value)
+			result = {'status': 0, 'statusMessage': "Successfully started switched to new brew '%s'. " % value +
+			                                        "Please reload the page."}
+		else:
+			result = {'status': 1, 'statusMessage': "Invalid new brew name '%s', "
+			                                        "please enter a name with at least 2 characters" % value}
+		conn.send(json.dumps(result))
+
+	@chamberCommand("pauseLogging")
+	def pauseLoggingCommand(self, conn, value):
+		conn.send(json.dumps(self.changeLogging("pauseLogging")))
+
+	@chamberCommand("resumeLogging")
+	def resumeLoggingCommand(self, conn, value):
+		conn.send(json.dumps(self.changeLogging("resumeLogging")))
+
+	@chamberCommand("stopLogging")
+	def stopLoggingCommand(self, conn, value):
+		conn.send(json.dumps(self.changeLogging("stopLogging")))
+
+	@chamberCommand("dateTimeFormatDisplay")
+	def dateTimeFormatDisplayCommand(self, conn, value):
+		self.setConfig('dateTimeFormatDisplay', value)
+		self.changeWwwSetting('dateTimeFormatDisplay', value)
+		self.logMessage("Changing date format config setting: " + value)
+
+	@chamberCommand("setActiveProfile")
+	def setActiveProfileCommand(self, conn, value):
+		return self.setActiveProfile(conn, value)
+
+	@chamberCommand("refreshDeviceList")
+	def refreshDeviceListCommand(self, conn, value):
+		self.deviceList['listState'] = ""  # invalidate local copy
+		if value.find("readValues") != -1:
+			self.commandQueue.put("d{r:1}")
+			self.commandQueue.put("h{u:-1,v:1}")
+		else:
+			self.commandQueue.put("d{}")
+			self.commandQueue.put("h{u:-1}")
+		return True
+
+	@chamberCommand("getDeviceList")
+	def getDeviceListCommand(self, conn, value):
+		if self.deviceList['listState'] in ["dh", "hd"] and self.avrVersion is not None:
+			response = dict(board=self.avrVersion.board,
+			                shield=self.avrVersion.shield,
+			                deviceList=self.deviceList,
+			                pinList=pinList.getPinList(self.avrVersion.board, self.avrVersion.shield))
+			conn.send(json.dumps(response))
+		else:
+			conn.send("device-list-not-up-to-date")
+
+	@chamberCommand("applyDevice", brewpiCommands.jsonText)  # the value is checked to be JSON and sent as it is
+	def applyDeviceCommand(self, conn, value):
+		self.commandQueue.put("U" + value)
+		self.deviceList['listState'] = ""
+		return True
+
+	def changeLogging(self, messageType):
+		dataLogging = self.config['dataLogging']
+		if messageType == "stopLogging":
+			self.logMessage("Stopped data logging, as requested in web interface. " +
+			                "BrewPi will continue to control temperatures, but will not log any data.")
+			self.setConfig('beerName', None)
+			self.setConfig('dataLogging', 'stopped')
+			self.changeWwwSetting('beerName', None)
+			return {'status': 0, 'statusMessage': "Successfully stopped logging"}
+		elif messageType == "pauseLogging":
+			if dataLogging == 'active':
+				self.logMessage("Paused logging data, as requested in web interface. " +
+				                "BrewPi will continue to control temperatures, but will not log any data until resumed.")
+				self.setConfig('dataLogging', 'paused')
+				return {'status': 0, 'statusMessage': "Successfully paused logging."}
+			return {'status': 1, 'statusMessage': "Logging already paused or stopped."}
+		else:
+			if dataLogging == 'paused':
+				self.logMessage("Continued logging data, as requested in web interface.")
+				self.setConfig('dataLogging', 'active')
+				return {'status': 0, 'statusMessage': "Successfully continued logging."}
+			return {'status': 1, 'statusMessage': "Logging was not paused."}
+
+	def setActiveProfile(self, conn, profileName):
+		"""
+		Copies a profile from the shared profile directory in the www dir to the settings of the chamber.
+		The previous profile is kept as tempProfile.csv.old.
+		"""
+		self.logMessage("Setting profile '%s' as active profile" % profileName)
+		self.setConfig('profileName', profileName)
+		self.changeWwwSetting('profileName', profileName)
+		profileSrcFile = self.profilePath + profileName + ".csv"
+		profileDestFile = self.config['scriptPath'] + 'settings/tempProfile.csv'
+		try:
+			shutil.copy(profileSrcFile, profileDestFile + '.new')
+			with open(profileDestFile + '.new', 'r') as original:
+				line1 = original.readline().rstrip("\n")
+				rest = original.read()
+			with open(profileDestFile + '.new', 'w') as modified:
+				modified.write(line1 + "," + profileName + "\n" + rest)
+			if os.path.isfile(profileDestFile):
+				shutil.copy(profileDestFile, profileDestFile + '.old')
+			os.rename(profileDestFile + '.new', profileDestFile)
+		except IOError as e:
+			conn.send("I/O Error(%d) updating profile: %s " % (e.errno, e.strerror))
+			return False
+		conn.send("Profile successfully updated")
+		if self.cs['mode'] != 'p':
+			self.setControlSettings(mode='p')
+			self.commandQueue.put("j{mode:p}")
+			self.logMessage("Notification: Profile mode enabled")
+			return True
+		return False
+
+	def summary(self):
+		""" Returns the state of the chamber for the getChambers message """
+		return dict(chamber=self.chamberId, beerName=self.config['beerName'], port=self.config['port'],
+		            mode=self.cs['mode'], beerSet=self.cs['beerSet'], fridgeSet=self.cs['fridgeSet'],
+		            dataLogging=self.config['dataLogging'], online=self.avrVersion is not None,
+		            version=self.avrVersion.version if self.avrVersion is not None else None,
+		            startup=self.startupStats)
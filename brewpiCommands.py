@@ -0,0 +1,220 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import collections
+import time
+import simplejson as json
+import BrewPiUtil as util
+
+# Table of the socket commands, like brewpiSerial.MessageDispatcher is for the lines of the Arduino.
+# A message 'setBeer=18.5' is looked up by its name, the value is converted by the parser of the command and the
+# handler is called with the converted value. Values that the parser rejects are logged and the handler is not called.
+# Every call is timed, so the commands that hold up the control loop can be found with the getStats command.
+
+# upper bounds of the latency histogram buckets in milliseconds, the last bucket counts the slower calls
+latencyBucketsMs = (0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000)
+latencyBounds = [bound / 1000.0 for bound in latencyBucketsMs]
+
+
+class CommandError(ValueError):
+	"""
+	Raised by a parser for a value that is not valid for the command, the message is logged
+	"""
+	pass
+
+
+def text(value):
+	""" Parser that passes the value on unchanged, the default """
+	return value
+
+
+def floatValue(value):
+	try:
+		return float(value)
+	except ValueError:
+		raise CommandError("cannot convert '%s' to float" % value)
+
+
+def intValue(value):
+	try:
+		return int(value)
+	except ValueError:
+		raise CommandError("cannot convert '%s' to int" % value)
+
+
+def jsonValue(value):
+	""" Parser for JSON values, returns the decoded value """
+	try:
+		return json.loads(value)
+	except json.JSONDecodeError, e:
+		raise CommandError("invalid JSON: %s" % str(e))
+
+
+def jsonText(value):
+	""" Parser for JSON that is passed on as it was received, like the device settings for the Arduino """
+	jsonValue(value)
+	return value
+
+
+def optional(parse, default=None):
+	""" Returns a parser that returns default for an empty value and uses parse otherwise """
+	def parseOptional(value):
+		return parse(value) if value else default
+	return parseOptional
+
+
+def between(parse, low, high):
+	""" Returns a parser that only accepts values from low to high, both included """
+	def parseBetween(value):
+		result = parse(value)
+		if not low <= result <= high:
+			raise CommandError("%s is outside of allowed range %s - %s" % (result, low, high))
+		return result
+	return parseBetween
+
+
+def timeRange(value):
+	"""
+	Parser for the JSON time range of getSamples and getHistory: start and optionally end, in seconds since epoch.
+	Returns (start, end), end is now when it is not given.
+	"""
+	request = jsonValue(value)
+	try:
+		start = float(request['start'])
+		end = float(request.get('end', time.time()))
+	except (ValueError, KeyError, TypeError, AttributeError):
+		raise CommandError("expected start and end in seconds since epoch")
+	return start, end
+
+
+def rollupRange(value):
+	"""
+	Parser for the JSON request of getRollups: optional start, end (seconds since epoch) and number of points.
+	Returns (start, end, points), by default 500 points for the last 7 days.
+	"""
+	request = jsonValue(value) if value else {}
+	try:
+		end = float(request.get('end', time.time()))
+		start = float(request.get('start', end - 7 * 86400))
+		points = int(request.get('points', 500))
+	except (ValueError, TypeError, AttributeError):
+		raise CommandError("expected start, end and points numbers")
+	return start, end, points
+
+
+class CommandRegistry:
+	"""
+	Handlers for the socket commands, keyed by name, with call counts, errors and a latency histogram per command
+	"""
+
+	def __init__(self, logMessage=util.logMessage):
+		"""
+		Params:
+		logMessage: function that logs the rejected values and unknown commands
+		"""
+		self.logMessage = logMessage
+		self.commands = {}  # name: (handler, parser)
+		self.calls = collections.defaultdict(int)
+		self.errors = collections.defaultdict(int)
+		self.totalTime = collections.defaultdict(float)
+		self.maxTime = collections.defaultdict(float)
+		self.histograms = {}
+		self.unknown = 0
+
+	def register(self, name, handler, parse=text):
+		"""
+		Registers the handler for a command, replacing the previous handler
+
+		Params:
+		name: message type, the part of the message before the '='
+		handler: function that takes the connection and the parsed value as arguments. It returns True when the
+		         serial communication should be done right away, to update the Arduino.
+		parse: function that converts the value of the message for the handler, raises ValueError for invalid values
+		"""
+		self.commands[name] = (handler, parse)
+
+	def __contains__(self, name):
+		return name in self.commands
+
+	def command(self, name, parse=text):
+		""" Decorator that registers a function as the handler of a command """
+		def decorator(handler):
+			self.register(name, handler, parse)
+			return handler
+		return decorator
+
+	def dispatch(self, conn, message):
+		"""
+		Calls the handler for a message 'name=value'
+
+		Returns:
+		True when the serial communication should be done right away
+		"""
+		if "=" in message:
+			name, value = message.split("=", 1)
+		else:
+			name, value = message, ""
+		return self.call(conn, name, value)
+
+	def call(self, conn, name, value):
+		"""
+		Calls the handler for a message that was already split in name and value
+		"""
+		try:
+			handler, parse = self.commands[name]
+		except KeyError:
+			self.unknown += 1
+			self.logMessage("Error: Received invalid message on socket: " + name + ("=" + value if value else ""))
+			return False
+		start = time.time()
+		try:
+			try:
+				argument = parse(value)
+			except ValueError, e:
+				self.errors[name] += 1
+				self.logMessage("Error: invalid value for %s received: %s" % (name, str(e)))
+				return False
+			try:
+				return bool(handler(conn, argument))
+			except Exception:
+				self.errors[name] += 1
+				raise
+		finally:
+			self.record(name, time.time() - start)
+
+	def record(self, name, seconds):
+		self.calls[name] += 1
+		self.totalTime[name] += seconds
+		if seconds > self.maxTime[name]:
+			self.maxTime[name] = seconds
+		histogram = self.histograms.get(name)
+		if histogram is None:
+			histogram = self.histograms[name] = [0] * (len(latencyBounds) + 1)
+		histogram[bisect.bisect_left(latencyBounds, seconds)] += 1
+
+	def stats(self):
+		"""
+		Returns the calls, errors and latencies per command that was called, for the getStats command.
+		histogram has the number of calls per bucket of latencyBucketsMs, the last one counts the slower calls.
+		"""
+		commands = {}
+		for name, calls in self.calls.items():
+			commands[name] = dict(calls=calls, errors=self.errors[name],
+			                      avgLatencyMs=self.totalTime[name] * 1000 / calls,
+			                      maxLatencyMs=self.maxTime[name] * 1000,
+			                      histogram=list(self.histograms[name]))
+		return dict(commands=commands, unknown=self.unknown, latencyBucketsMs=list(latencyBucketsMs))
@@ -0,0 +1,343 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# Converts the logged data of all beers to another format, one output file per beer.
+# Beers are converted in parallel with a process pool. Each data file is read and written before the next one
+# is opened, so memory use depends on the size of a single file, not on the length of the brew.
+#
+# Usage: python brewpiConvert.py --output <dir> [--format bps|ndjson|npz|sqlite] [--data <dir>]
+#                                [--source json|csv] [--processes <n>] [beer name ...]
+
+import getopt
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+import time
+import traceback
+import brewpiJson
+import brewpiRowEncoder
+import brewpiStore
+import brewpiHistory
+import brewpiIndex
+import BrewPiUtil as util
+
+# columns of the CSV file of a beer. Older files do not have the State and RoomTemp columns.
+csvColumns = ('BeerTemp', 'BeerSet', 'BeerAnn', 'FridgeTemp', 'FridgeSet', 'FridgeAnn', 'State', 'RoomTemp')
+sampleColumns = ('Time', 'BeerTemp', 'BeerSet', 'BeerAnn', 'FridgeTemp', 'FridgeSet', 'FridgeAnn', 'RoomTemp', 'State')
+csvChunkSize = 1000  # rows of a CSV file that are converted together
+
+
+def parseCsvLine(line):
+	"""
+	Parses a line of the CSV file of a beer into a row dict with the same keys as brewpiJson.parseDataTable
+	"""
+	fields = line.rstrip('\r\n').split(';')
+	row = dict.fromkeys(csvColumns)
+	row['Time'] = time.mktime(time.strptime(fields[0], brewpiRowEncoder.csvTimeFormat))
+	for key, value in zip(csvColumns, fields[1:]):
+		if value in ('None', ''):
+			continue
+		elif key in brewpiStore.annotationFields:
+			row[key] = value
+		elif key == 'State':
+			row[key] = int(value)
+		else:
+			row[key] = float(value)
+	return row
+
+
+def dataFileKey(fileName):
+	""" Sort key for daily data files: by date, <beer>-YYYY-MM-DD.json before <beer>-YYYY-MM-DD-2.json """
+	m = re.search(r'-(\d{4}-\d{2}-\d{2})(?:-(\d+))?\.json$', fileName)
+	return m.group(1), int(m.group(2) or 0)
+
+
+def findBeers(dataPath):
+	""" Returns the names of the beers in the data directory """
+	return sorted(name for name in os.listdir(dataPath) if os.path.isdir(os.path.join(dataPath, name)))
+
+
+def readBeer(dataPath, beerName, source='json'):
+	"""
+	Generator for the rows of a beer, one list of rows per chunk, in time order.
+	The daily JSON files are read one at a time. The CSV file is read when the source is 'csv' or when the beer has
+	no JSON files, in chunks of csvChunkSize rows.
+	"""
+	beerPath = os.path.join(dataPath, beerName)
+	regex = brewpiIndex.dataFileRegex(beerName)
+	jsonFiles = sorted([f for f in os.listdir(beerPath) if regex.match(f)], key=dataFileKey)
+	csvFileName = os.path.join(beerPath, beerName + '.csv')
+	if source == 'json' and jsonFiles:
+		for jsonFile in jsonFiles:
+			with open(os.path.join(beerPath, jsonFile), 'rb') as f:
+				text = f.read()
+			try:
+				rows = list(brewpiJson.parseDataTable(text))
+			except (ValueError, KeyError, TypeError), e:
+				util.logMessage("Skipping data file %s: %s" % (jsonFile, str(e)))
+				continue
+			yield sorted(rows, key=lambda r: r['Time'])
+	elif os.path.exists(csvFileName):
+		with open(csvFileName, 'rb') as f:
+			chunk = []
+			for line in f:
+				if not line.strip():
+					continue
+				try:
+					chunk.append(parseCsvLine(line))
+				except (ValueError, IndexError):
+					continue  # incomplete line
+				if len(chunk) >= csvChunkSize:
+					yield chunk
+					chunk = []
+			if chunk:
+				yield chunk
+
+
+class StoreWriter:
+	""" Writes the compact binary sample store, the same format brewpi.py logs to (see brewpiStore) """
+	extension = brewpiStore.segmentExtension
+
+	def __init__(self, fileName):
+		self.store = brewpiStore.SampleStore(fileName)
+
+	def write(self, rows):
+		self.store.appendMany(rows, [row['Time'] for row in rows])
+
+	def close(self):
+		self.store.sync()
+		self.store.close()
+
+
+class NdjsonWriter:
+	""" Writes newline delimited JSON, one sample per line """
+	extension = '.ndjson'
+
+	def __init__(self, fileName):
+		self.file = open(fileName, 'wb')
+
+	def write(self, rows):
+		self.file.write(''.join(brewpiRowEncoder.ndjsonRow(row, row['Time']) for row in rows))
+
+	def close(self):
+		self.file.close()
+
+
+class NpzWriter:
+	"""
+	Writes a NumPy .npz file with an array per column. The samples are first written to a temporary sample store,
+	which is memory mapped to save the columns, so the complete beer is never held in memory as Python objects.
+	"""
+	extension = '.npz'
+
+	def __init__(self, fileName):
+		if brewpiHistory.numpy is None:
+			raise ImportError("Converting to .npz requires NumPy, install it with 'sudo apt-get install python-numpy'")
+		self.fileName = fileName
+		self.storeFileName = fileName + '.tmp' + brewpiStore.segmentExtension
+		self.storeWriter = StoreWriter(self.storeFileName)
+
+	def write(self, rows):
+		self.storeWriter.write(rows)
+
+	def close(self):
+		numpy = brewpiHistory.numpy
+		annotations = self.storeWriter.store.annotations()
+		self.storeWriter.close()
+		reader = brewpiHistory.SegmentReader(self.storeFileName)
+		try:
+			columns = reader.columns(float('-inf'), float('inf'))
+			# annotations are rare, they are stored as separate arrays with the index of the sample they belong to
+			indexes = sorted(annotations)
+			columns['annotationIndex'] = numpy.array(indexes, dtype='u4')
+			columns['BeerAnn'] = numpy.array([annotations[i][0] or '' for i in indexes], dtype=unicode)
+			columns['FridgeAnn'] = numpy.array([annotations[i][1] or '' for i in indexes], dtype=unicode)
+			with open(self.fileName, 'wb') as f:
+				numpy.savez_compressed(f, **columns)
+		finally:
+			reader.close()
+			for tmp in [self.storeFileName, brewpiStore.annotationFileName(self.storeFileName)]:
+				if os.path.exists(tmp):
+					os.remove(tmp)
+
+
+class SqliteWriter:
+	""" Writes an SQLite database with a samples table, with the time as primary key """
+	extension = '.sqlite'
+
+	def __init__(self, fileName):
+		self.db = sqlite3.connect(fileName)
+		self.db.execute('CREATE TABLE IF NOT EXISTS samples (Time REAL PRIMARY KEY, BeerTemp REAL, BeerSet REAL, '
+		                'BeerAnn TEXT, FridgeTemp REAL, FridgeSet REAL, FridgeAnn TEXT, RoomTemp REAL, State INTEGER)')
+		self.insert = 'INSERT OR REPLACE INTO samples (%s) VALUES (%s)' % (
+			','.join(sampleColumns), ','.join(['?'] * len(sampleColumns)))
+
+	def write(self, rows):
+		self.db.executemany(self.insert, ([row[key] for key in sampleColumns] for row in rows))
+		self.db.commit()  # one transaction per data file
+
+	def close(self):
+		self.db.close()
+
+
+writers = {'bps': StoreWriter, 'ndjson': NdjsonWriter, 'npz': NpzWriter, 'sqlite': SqliteWriter}
+
+
+def outputFileName(outputPath, beerName, outputFormat):
+	return os.path.join(outputPath, beerName + writers[outputFormat].extension)
+
+
+def convertBeer(job):
+	"""
+	Converts all data of a beer. Runs in a worker process, so errors are returned instead of raised.
+
+	Params:
+	job: tuple of data directory, beer name, output directory, output format and source ('json' or 'csv')
+
+	Returns:
+	dict with the beer name, the number of chunks and samples, the duration in seconds and an error message or None
+	"""
+	dataPath, beerName, outputPath, outputFormat, source = job
+	result = dict(beer=beerName, chunks=0, samples=0, seconds=0.0, error=None)
+	start = time.time()
+	fileName = outputFileName(outputPath, beerName, outputFormat)
+	existing = [fileName]
+	if outputFormat == 'bps':
+		existing.append(brewpiStore.annotationFileName(fileName))
+	for f in existing:
+		if os.path.exists(f):
+			os.remove(f)  # convert from scratch
+	try:
+		writer = writers[outputFormat](fileName)
+		try:
+			lastTime = None
+			for rows in readBeer(dataPath, beerName, source):
+				if lastTime is not None:
+					rows = [row for row in rows if row['Time'] > lastTime]  # overlapping files
+				if not rows:
+					continue
+				writer.write(rows)
+				lastTime = rows[-1]['Time']
+				result['chunks'] += 1
+				result['samples'] += len(rows)
+		finally:
+			writer.close()
+	except Exception, e:
+		result['error'] = "%s\n%s" % (str(e), traceback.format_exc())
+	result['seconds'] = time.time() - start
+	return result
+
+
+def convert(dataPath, outputPath, outputFormat, beerNames=None, source='json', processes=None, report=None):
+	"""
+	Converts the data of multiple beers in parallel
+
+	Params:
+	dataPath: data directory with a subdirectory per beer
+	outputPath: directory for the output files, one per beer
+	outputFormat: one of the keys of writers
+	beerNames: beers to convert, defaults to all beers in the data directory
+	source: 'json' to read the daily DataTable files, 'csv' to read the CSV file of the beer
+	processes: number of worker processes, defaults to the number of CPUs. 1 converts in this process.
+	report: called with the result dict of each beer when it is done, in order of completion
+
+	Returns:
+	list of the result dicts
+	"""
+	if beerNames is None:
+		beerNames = findBeers(dataPath)
+	if not os.path.exists(outputPath):
+		os.makedirs(outputPath)
+	jobs = [(dataPath, beerName, outputPath, outputFormat, source) for beerName in beerNames]
+	processes = processes or multiprocessing.cpu_count()
+	results = []
+	if processes == 1 or len(jobs) <= 1:
+		for job in jobs:
+			results.append(convertBeer(job))
+			if report:
+				report(results[-1])
+		return results
+	pool = multiprocessing.Pool(min(processes, len(jobs)))
+	try:
+		for result in pool.imap_unordered(convertBeer, jobs):
+			results.append(result)
+			if report:
+				report(result)
+		pool.close()
+	except KeyboardInterrupt:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+	return results
+
+
+def main(argv):
+	usage = "Usage: python brewpiConvert.py --output <dir> [--format %s] [--data <dir>] " \
+	        "[--source json|csv] [--processes <n>] [beer name ...]" % '|'.join(sorted(writers))
+	try:
+		opts, args = getopt.getopt(argv, "ho:f:d:s:p:", ['help', 'output=', 'format=', 'data=', 'source=', 'processes='])
+	except getopt.GetoptError:
+		print usage
+		return 2
+
+	dataPath = util.addSlash(sys.path[0]) + 'data/'
+	outputPath = None
+	outputFormat = 'bps'
+	source = 'json'
+	processes = None
+	for o, a in opts:
+		if o in ('-h', '--help'):
+			print usage
+			return 0
+		elif o in ('-o', '--output'):
+			outputPath = a
+		elif o in ('-f', '--format'):
+			outputFormat = a
+		elif o in ('-d', '--data'):
+			dataPath = a
+		elif o in ('-s', '--source'):
+			source = a
+		elif o in ('-p', '--processes'):
+			processes = int(a)
+	if outputPath is None or outputFormat not in writers or source not in ('json', 'csv'):
+		print usage
+		return 2
+
+	beerNames = args or findBeers(dataPath)
+	progress = dict(done=0, samples=0)
+	start = time.time()
+
+	def report(result):
+		progress['done'] += 1
+		progress['samples'] += result['samples']
+		if result['error']:
+			print "[%d/%d] %s: error: %s" % (progress['done'], len(beerNames), result['beer'], result['error'])
+		else:
+			print "[%d/%d] %s: %d samples in %.1f s" % (progress['done'], len(beerNames), result['beer'],
+			                                            result['samples'], result['seconds'])
+		sys.stdout.flush()
+
+	results = convert(dataPath, outputPath, outputFormat, beerNames, source, processes, report)
+	print "Converted %d samples of %d beers to %s in %.1f s" % (progress['samples'], len(beerNames),
+	                                                           outputFormat, time.time() - start)
+	return 1 if any(result['error'] for result in results) else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,633 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import errno
+import heapq
+import itertools
+import select
+import socket
+import threading
+import time
+import traceback
+import serial
+import simplejson as json
+import BrewPiSocket
+import BrewPiUtil as util
+
+# A single threaded event loop for brewpi.py, built on select. It waits for the control socket, the connections of
+# the web clients and the serial port at the same time, and runs periodic tasks in between.
+# Nothing waits for a slow client: connections are non-blocking and replies are written when the socket is writable.
+# Serial data is handled before socket messages in every pass of the loop.
+
+wouldBlock = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+class Timer:
+	"""
+	Handle for a scheduled callback, returned by EventLoop.callLater and EventLoop.callEvery
+	"""
+
+	def __init__(self, callback, args, interval=None):
+		self.callback = callback
+		self.args = args
+		self.interval = interval  # None for a callback that runs once
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+
+class EventLoop:
+	def __init__(self):
+		self.readers = {}  # file descriptor to callback
+		self.writers = {}
+		self.priorityReaders = set()  # file descriptors that are handled first when they are readable
+		self.timers = []  # heap of (time, sequence number, Timer)
+		self.sequence = itertools.count()
+		self.ready = collections.deque()  # callbacks to run in the next pass
+		self.running = False
+		self.wakeupLock = threading.Lock()
+		self.wakeupReader = None  # socket pair that wakes up select for callbacks from other threads
+		self.wakeupWriter = None
+
+	def addReader(self, fd, callback, priority=False):
+		"""
+		Calls callback without arguments when fd is readable
+
+		Params:
+		fd: file descriptor or object with a fileno method
+		priority: handle this reader before the others, used for the serial port
+		"""
+		fd = fileNumber(fd)
+		self.readers[fd] = callback
+		if priority:
+			self.priorityReaders.add(fd)
+
+	def removeReader(self, fd):
+		fd = fileNumber(fd)
+		self.readers.pop(fd, None)
+		self.priorityReaders.discard(fd)
+
+	def addWriter(self, fd, callback):
+		self.writers[fileNumber(fd)] = callback
+
+	def removeWriter(self, fd):
+		self.writers.pop(fileNumber(fd), None)
+
+	def callSoon(self, callback, *args):
+		self.ready.append((callback, args))
+
+	def callSoonThreadsafe(self, callback, *args):
+		"""
+		callSoon for other threads, like the serial reader thread. Wakes up the loop when it waits in select.
+		"""
+		self.ready.append((callback, args))
+		if self.wakeupWriter is None:
+			self.openWakeup()
+		try:
+			self.wakeupWriter.send('\0')
+		except socket.error:
+			pass  # the buffer is full of wake up bytes, the loop wakes up anyway
+
+	def openWakeup(self):
+		"""
+		Creates the socket pair that wakes up select. Call it from the thread of the loop before other threads call
+		callSoonThreadsafe: when it is created by another thread, the select that is waiting does not watch it yet.
+		"""
+		with self.wakeupLock:
+			if self.wakeupWriter is None:
+				reader, writer = socketPair()
+				reader.setblocking(0)
+				writer.setblocking(0)
+				self.wakeupReader = reader
+				self.addReader(reader, self.drainWakeup)
+				self.wakeupWriter = writer
+
+	def drainWakeup(self):
+		try:
+			self.wakeupReader.recv(4096)
+		except socket.error:
+			pass
+
+	def close(self):
+		"""
+		Closes the sockets of the loop itself, not the ones that were added
+		"""
+		if self.wakeupReader is not None:
+			self.removeReader(self.wakeupReader)
+			self.wakeupReader.close()
+			self.wakeupWriter.close()
+			self.wakeupReader = self.wakeupWriter = None
+
+	def callLater(self, delay, callback, *args):
+		timer = Timer(callback, args)
+		heapq.heappush(self.timers, (time.time() + delay, next(self.sequence), timer))
+		return timer
+
+	def callEvery(self, interval, callback, *args):
+		"""
+		Calls callback every interval seconds, the first time after one interval
+		"""
+		timer = Timer(callback, args, interval)
+		heapq.heappush(self.timers, (time.time() + interval, next(self.sequence), timer))
+		return timer
+
+	def stop(self):
+		self.running = False
+
+	def run(self):
+		"""
+		Runs the loop until stop is called
+		"""
+		self.running = True
+		while self.running:
+			self.runOnce()
+
+	def runOnce(self, maxTimeout=1.0):
+		"""
+		Waits for the next event or timer, with at most maxTimeout seconds, and runs the callbacks that are due
+		"""
+		timeout = maxTimeout
+		if self.ready:
+			timeout = 0
+		elif self.timers:
+			timeout = max(0, min(timeout, self.timers[0][0] - time.time()))
+		try:
+			readable, writable, _ = select.select(self.readers.keys(), self.writers.keys(), [], timeout)
+		except select.error, e:
+			if e.args[0] == errno.EINTR:
+				return
+			raise
+		readable.sort(key=lambda fd: fd not in self.priorityReaders)
+		for fd in readable:
+			callback = self.readers.get(fd)  # a previous callback may have removed it
+			if callback is not None:
+				self.runCallback(callback, ())
+		for fd in writable:
+			callback = self.writers.get(fd)
+			if callback is not None:
+				self.runCallback(callback, ())
+
+		now = time.time()
+		while self.timers and self.timers[0][0] <= now:
+			when, sequence, timer = heapq.heappop(self.timers)
+			if timer.cancelled:
+				continue
+			if timer.interval is not None:
+				# schedule from the planned time, so a periodic task does not drift, but skip missed runs
+				nextTime = when + timer.interval
+				if nextTime <= now:
+					nextTime = now + timer.interval
+				heapq.heappush(self.timers, (nextTime, next(self.sequence), timer))
+			self.runCallback(timer.callback, timer.args)
+
+		for i in range(len(self.ready)):  # callbacks added while running these wait for the next pass
+			callback, args = self.ready.popleft()
+			self.runCallback(callback, args)
+
+	def runCallback(self, callback, args):
+		# an error in one callback should not stop the script
+		try:
+			callback(*args)
+		except Exception, e:
+			util.logMessage("Error in event loop callback %s: %s" % (getattr(callback, '__name__', callback), str(e)))
+			traceback.print_exc()
+
+
+def fileNumber(fd):
+	return fd if isinstance(fd, (int, long)) else fd.fileno()
+
+
+def socketPair():
+	"""
+	Returns a pair of connected sockets. socket.socketpair is not available on Windows, where a TCP connection
+	on the loopback interface is used instead.
+	"""
+	if hasattr(socket, 'socketpair'):
+		return socket.socketpair()
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	try:
+		listener.bind(('127.0.0.1', 0))
+		listener.listen(1)
+		client = socket.create_connection(listener.getsockname())
+		server, address = listener.accept()
+	finally:
+		listener.close()
+	return server, client
+
+
+class RequestStats:
+	"""
+	Latencies of a socket command until the whole reply was written, from the accept of a one-shot connection or
+	from the arrival of a framed request
+	"""
+
+	def __init__(self, window=1000):
+		self.requests = 0
+		self.maxLatency = 0.0
+		self.recent = collections.deque(maxlen=window)
+
+	def add(self, latency):
+		self.requests += 1
+		self.maxLatency = max(self.maxLatency, latency)
+		self.recent.append(latency)
+
+	def toDict(self):
+		recent = sorted(self.recent)
+		result = dict(requests=self.requests, maxLatency=self.maxLatency, p50Latency=None, p99Latency=None)
+		if recent:
+			result['p50Latency'] = recent[len(recent) // 2]
+			result['p99Latency'] = recent[min(len(recent) - 1, int(len(recent) * 0.99))]
+		return result
+
+
+class Connection:
+	"""
+	A client connection of the MessageServer. It has the send and sendall methods of a socket,
+	so message handlers can reply to it in the same way as to a blocking socket.
+	Replies are buffered and written when the socket is writable.
+
+	A one-shot connection carries one message. It is closed when the reply is sent, when the client closes it, or
+	when it is still open clientTimeout seconds after it was accepted.
+	A framed connection (see BrewPiSocket.packFrame) carries any number of requests, which are handled in order.
+	It stays open until the client closes it or sends nothing for clientTimeout seconds. While replies wait for the
+	client to read them, no new requests are read.
+	A connection that subscribed to events (see EventPublisher) stays open until the client closes it.
+	"""
+
+	def __init__(self, server, sock):
+		self.server = server
+		self.loop = server.loop
+		self.sock = sock
+		self.fd = sock.fileno()
+		self.out = []
+		self.closed = False
+		self.framed = None  # decided by the first byte that is received
+		self.buffer = ''  # start of an incomplete frame
+		self.accepted = time.time()
+		self.lastActive = self.accepted
+		self.waiting = []  # (command, start time) of the requests whose replies are in out
+		self.writing = False  # waiting for the socket to become writable
+		self.requestId = None  # id of the framed request that is being handled
+		self.subscription = None
+		self.timer = self.loop.callLater(server.clientTimeout, self.timeout)
+
+	def send(self, data):
+		self.out.append(data)
+		return len(data)
+
+	def sendall(self, data):
+		self.out.append(data)
+
+	def readable(self):
+		try:
+			data = self.sock.recv(65536)
+		except socket.error, e:
+			if e.args[0] in wouldBlock:
+				return
+			self.close()
+			return
+		if not data:
+			self.close()  # the reader is removed while replies wait to be written, so all replies were sent
+			return
+		if self.framed is None:
+			self.framed = data.startswith(BrewPiSocket.frameMarker)
+		if self.framed:
+			self.readFrames(data)
+		elif self.subscription is not None:
+			return  # the client of an event stream has nothing more to say, only its close is noticed
+		else:
+			self.loop.removeReader(self.fd)
+			self.handle(data, self.accepted)
+
+	def readFrames(self, data):
+		self.lastActive = time.time()
+		try:
+			frames, self.buffer = BrewPiSocket.unpackFrames(self.buffer + data)
+		except ValueError:
+			util.logMessage("Error: invalid frame received on socket, connection closed")
+			self.close()
+			return
+		for requestId, message in frames:
+			mark = len(self.out)
+			self.requestId = requestId
+			self.handle(message, self.lastActive, flush=False)
+			reply = ''.join(self.out[mark:])
+			self.out[mark:] = [BrewPiSocket.frameHeader.pack(BrewPiSocket.frameMarker, requestId, len(reply)), reply]
+		if frames:
+			self.flush()
+
+	def handle(self, message, startTime, flush=True):
+		self.server.messages += 1
+		self.waiting.append((message.split('=', 1)[0], startTime))
+		try:
+			self.server.handler(self, message)
+		finally:
+			if flush:
+				self.flush()
+
+	def flush(self):
+		"""
+		Writes as much of the buffered replies as the socket accepts, waits for it to become writable for the rest
+		"""
+		data = ''.join(self.out)
+		self.out = []
+		while data:
+			try:
+				sent = self.sock.send(data)
+			except socket.error, e:
+				if e.args[0] in wouldBlock:
+					self.out = [data]
+					self.writing = True
+					self.loop.removeReader(self.fd)
+					self.loop.addWriter(self.fd, self.flush)
+					return
+				self.close()  # client is gone
+				return
+			data = data[sent:]
+		self.writing = False
+		self.loop.removeWriter(self.fd)
+		now = time.time()
+		for command, startTime in self.waiting:
+			self.server.requestDone(command, now - startTime)
+		self.waiting = []
+		if self.framed or self.subscription is not None:
+			self.lastActive = now
+			if not self.closed:
+				self.loop.addReader(self.fd, self.readable)
+		else:
+			self.close()
+
+	def subscribe(self, subscription):
+		"""
+		Keeps the connection open for the events of subscription. On a framed connection, the events are sent as
+		reply frames with the id of the subscribe request.
+		"""
+		self.subscription = subscription
+		subscription.requestId = self.requestId
+
+	def pendingBytes(self):
+		return sum(len(data) for data in self.out)
+
+	def pushEvent(self, data):
+		"""
+		Sends an event of the subscription, after the replies and events that are waiting to be written
+		"""
+		if self.framed:
+			data = BrewPiSocket.packFrame(self.subscription.requestId, data)
+		self.out.append(data)
+		if not self.writing:
+			self.flush()
+
+	def timeout(self):
+		"""
+		Closes a connection of a client that did not send a message or did not read the reply in time.
+		A framed connection is closed when it was idle for clientTimeout seconds.
+		"""
+		if self.closed or self.subscription is not None:
+			return
+		if self.framed:
+			idle = time.time() - self.lastActive
+			if idle < self.server.clientTimeout:
+				self.timer = self.loop.callLater(self.server.clientTimeout - idle, self.timeout)
+				return
+		self.server.timeouts += 1
+		self.close()
+
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		self.timer.cancel()
+		if self.subscription is not None:
+			self.subscription.close()
+		self.loop.removeReader(self.fd)
+		self.loop.removeWriter(self.fd)
+		try:
+			self.sock.close()
+		except socket.error:
+			pass
+		self.server.connections.discard(self)
+
+
+class MessageServer:
+	"""
+	Serves the control socket (BEERSOCKET or TCP) from the event loop.
+	A client sends one message and receives the replies, then the connection is closed. Or it keeps the connection
+	open and sends framed requests, see Connection. Any number of clients can be connected at the same time.
+	The latency of every request is kept per command.
+	"""
+	maxCommands = 50  # requests with other command names are counted as 'other', garbage should not grow the stats
+
+	def __init__(self, loop, listenSocket, handler, clientTimeout=10.0):
+		"""
+		Params:
+		loop: EventLoop
+		listenSocket: bound and listening socket
+		handler: function called with a Connection and the received message
+		clientTimeout: seconds a one-shot connection may stay open, from its accept until the reply was written,
+		and seconds a framed connection may be idle
+		"""
+		self.loop = loop
+		self.socket = listenSocket
+		self.handler = handler
+		self.clientTimeout = clientTimeout
+		self.connections = set()
+		self.maxConnections = 0
+		self.messages = 0
+		self.timeouts = 0
+		self.latency = RequestStats()
+		self.commandLatency = {}
+		listenSocket.setblocking(0)
+		loop.addReader(listenSocket, self.accept)
+
+	def accept(self):
+		while True:  # accept all waiting clients
+			try:
+				sock, address = self.socket.accept()
+			except socket.error, e:
+				if e.args[0] in wouldBlock:
+					return
+				raise
+			sock.setblocking(0)
+			connection = Connection(self, sock)
+			self.connections.add(connection)
+			self.maxConnections = max(self.maxConnections, len(self.connections))
+			self.loop.addReader(connection.fd, connection.readable)
+
+	def requestDone(self, command, latency):
+		self.latency.add(latency)
+		if command not in self.commandLatency:
+			if len(self.commandLatency) >= self.maxCommands:
+				command = 'other'
+			self.commandLatency.setdefault(command, RequestStats())
+		self.commandLatency[command].add(latency)
+
+	def stats(self):
+		"""
+		Returns the connection counts and the request latencies in seconds (p50, p99 and max), in total and per command
+		"""
+		return dict(connections=len(self.connections), maxConnections=self.maxConnections, messages=self.messages,
+		            timeouts=self.timeouts, latency=self.latency.toDict(),
+		            commands=dict((command, stats.toDict()) for command, stats in self.commandLatency.items()))
+
+	def close(self):
+		self.loop.removeReader(self.socket)
+		for connection in list(self.connections):
+			connection.close()
+
+
+class Subscription:
+	""" Event types a client subscribed to and the events that were dropped for it """
+
+	def __init__(self, publisher, conn, eventTypes):
+		self.publisher = publisher
+		self.conn = conn
+		self.eventTypes = eventTypes
+		self.requestId = None
+		self.events = 0
+		self.dropped = 0  # dropped since the last event that was sent
+
+	def push(self, event):
+		conn = self.conn
+		if conn.closed:
+			return
+		if conn.pendingBytes() + len(event) > self.publisher.maxBuffered:
+			self.dropped += 1
+			self.publisher.dropped += 1
+			return
+		if self.dropped:
+			conn.pushEvent(encodeEvent('dropped', self.dropped))
+			self.dropped = 0
+		self.events += 1
+		conn.pushEvent(event)
+
+	def close(self):
+		self.publisher.unsubscribe(self)
+
+
+def encodeEvent(eventType, data):
+	# byte strings are text from the Arduino, like the degree sign of the LCD, which is latin-1
+	return json.dumps(dict(type=eventType, time=time.time(), data=data), encoding='latin-1') + '\n'
+
+
+class EventPublisher:
+	"""
+	Streams events to the clients that sent the subscribe command, as newline-delimited JSON:
+	{"type": "lcd", "time": 1380000000.0, "data": ["Mode   Beer Constant", ...]}
+	Events are published as they come off the serial link, from any thread. They are encoded once and written to
+	the subscribers by the event loop.
+
+	Every subscriber has a buffer of maxBuffered bytes. Events that do not fit, because the client does not read
+	fast enough, are dropped for that client. It gets a 'dropped' event with the number of dropped events when its
+	buffer has room again, so it can request the state again.
+	"""
+	eventTypes = ('sample', 'lcd', 'controlSettings', 'controlConstants', 'controlVariables', 'deviceList', 'log')
+
+	def __init__(self, loop, maxBuffered=65536):
+		self.loop = loop
+		self.maxBuffered = maxBuffered
+		self.subscriptions = set()
+		self.subscribers = dict((eventType, 0) for eventType in self.eventTypes)  # read by other threads
+		self.published = 0
+		self.dropped = 0
+		loop.openWakeup()
+
+	def subscribe(self, conn, value):
+		"""
+		Turns a connection of the MessageServer into an event stream. The first event is 'subscribed', with the
+		event types of the subscription.
+
+		Params:
+		conn: Connection that received the subscribe command
+		value: comma separated event types, empty for all types. Unknown types are ignored.
+		"""
+		eventTypes = [eventType for eventType in value.split(',') if eventType in self.subscribers]
+		if not value:
+			eventTypes = list(self.eventTypes)
+		subscription = Subscription(self, conn, frozenset(eventTypes))
+		conn.subscribe(subscription)
+		self.subscriptions.add(subscription)
+		for eventType in subscription.eventTypes:
+			self.subscribers[eventType] += 1
+		# sent after the reply to the subscribe command
+		self.loop.callSoon(subscription.push, encodeEvent('subscribed', sorted(eventTypes)))
+
+	def unsubscribe(self, subscription):
+		if subscription in self.subscriptions:
+			self.subscriptions.remove(subscription)
+			for eventType in subscription.eventTypes:
+				self.subscribers[eventType] -= 1
+
+	def wants(self, eventType):
+		"""
+		Returns True when a client subscribed to eventType
+		"""
+		return self.subscribers.get(eventType, 0) > 0
+
+	def publish(self, eventType, data):
+		"""
+		Sends an event to the subscribers of its type. Can be called from any thread. The data is encoded right away,
+		so it can be changed after the call.
+		"""
+		if not self.subscribers.get(eventType):
+			return
+		self.loop.callSoonThreadsafe(self.deliver, eventType, encodeEvent(eventType, data))
+
+	def deliver(self, eventType, event):
+		self.published += 1
+		for subscription in list(self.subscriptions):
+			if eventType in subscription.eventTypes:
+				subscription.push(event)
+
+	def stats(self):
+		return dict(subscribers=len(self.subscriptions), published=self.published, dropped=self.dropped,
+		            subscriptions=[dict(eventTypes=sorted(s.eventTypes), events=s.events, buffered=s.conn.pendingBytes())
+		                           for s in self.subscriptions])
+
+
+class SerialTransport:
+	"""
+	Reads the serial port from the event loop when its file descriptor is readable, before any socket is handled
+	"""
+
+	def __init__(self, loop, ser, framer, onError=None):
+		"""
+		Params:
+		loop: EventLoop
+		ser: open serial port with a file descriptor (not available on Windows)
+		framer: brewpiSerial.LineFramer that dispatches the received lines
+		onError: function that is called with the exception when reading the port failed, after the port is no longer read
+		"""
+		self.loop = loop
+		self.ser = ser
+		self.framer = framer
+		self.onError = onError
+		loop.addReader(ser.fileno(), self.readable, priority=True)
+
+	def readable(self):
+		try:
+			# at least one byte is waiting, so this does not block
+			self.framer.readFrom(self.ser)
+		except (serial.SerialException, OSError, IOError), e:
+			util.logMessage("Error reading serial port, stopped reading it: %s" % str(e))
+			self.close()
+			if self.onError is not None:
+				self.onError(e)
+
+	def close(self):
+		self.loop.removeReader(self.ser.fileno())
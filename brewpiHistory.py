@@ -0,0 +1,185 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import array
+import mmap
+import os
+import struct
+import brewpiStore
+
+# NumPy is optional. It is not installed on a standard Pi installation, but when it is available
+# the columns are returned as arrays that point directly into the memory mapped file.
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+columns = ('Time',) + brewpiStore.tempFields + ('State',)
+
+if numpy is not None:
+	recordDtype = numpy.dtype([('Time', '<f8')] + [(key, '<f4') for key in brewpiStore.tempFields] +
+	                          [('State', 'u1'), ('padding', 'V3')])
+	assert recordDtype.itemsize == brewpiStore.recordSize
+
+arrayTypes = dict([(key, 'f') for key in brewpiStore.tempFields], Time='d', State='B')
+timeStruct = struct.Struct('<d')
+
+
+class SegmentReader:
+	"""
+	Reads a sample segment file through a read-only memory map.
+	The map covers the records that were complete when the reader was opened (or refreshed), so reads are
+	consistent while the log writer keeps appending. Pages are only loaded from the SD card when they are accessed,
+	so files larger than the available memory can be read.
+	"""
+
+	def __init__(self, fileName):
+		self.fileName = fileName
+		self.file = open(fileName, 'rb')
+		brewpiStore.checkHeader(self.file.read(brewpiStore.headerSize), fileName)
+		self.map = None
+		self.count = 0
+		self.refresh()
+
+	def __len__(self):
+		return self.count
+
+	def refresh(self):
+		"""
+		Maps the records that were appended since the reader was opened
+		"""
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+		self.count = brewpiStore.recordCount(self.fileName)
+		if self.count:
+			length = brewpiStore.headerSize + self.count * brewpiStore.recordSize
+			self.map = mmap.mmap(self.file.fileno(), length, access=mmap.ACCESS_READ)
+
+	def close(self):
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+		self.file.close()
+
+	def timeAt(self, index):
+		return timeStruct.unpack_from(self.map, brewpiStore.headerSize + index * brewpiStore.recordSize)[0]
+
+	def findTime(self, t):
+		"""
+		Binary search for the index of the first record at or after time t
+		"""
+		low, high = 0, self.count
+		while low < high:
+			mid = (low + high) // 2
+			if self.timeAt(mid) < t:
+				low = mid + 1
+			else:
+				high = mid
+		return low
+
+	def window(self, start, end):
+		"""
+		Returns the indexes (first, stop) of the records with a time between start and end
+		"""
+		return self.findTime(start), self.findTime(end + 1e-6)
+
+	def records(self, start, end):
+		"""
+		Returns the records between start and end as a NumPy structured array that is a view on the memory map,
+		nothing is copied. Returns None when NumPy is not installed.
+		The view is only valid until the reader is refreshed or closed.
+		"""
+		if numpy is None:
+			return None
+		first, stop = self.window(start, end)
+		if self.map is None or first >= stop:
+			return numpy.zeros(0, dtype=recordDtype)
+		return numpy.frombuffer(self.map, dtype=recordDtype, count=stop - first,
+		                        offset=brewpiStore.headerSize + first * brewpiStore.recordSize)
+
+	def columns(self, start, end):
+		"""
+		Returns a dict with an array for each column of the records between start and end.
+		With NumPy the arrays are views on the memory map. Without NumPy, array.array objects are filled from the map.
+		Missing temperatures are NaN, a missing state is brewpiStore.noState.
+		"""
+		if numpy is not None:
+			records = self.records(start, end)
+			return dict((key, records[key]) for key in columns)
+
+		result = dict((key, array.array(arrayTypes[key])) for key in columns)
+		first, stop = self.window(start, end)
+		unpack = brewpiStore.recordStruct.unpack_from
+		appends = [result[key].append for key in columns]
+		for index in xrange(first, stop):
+			values = unpack(self.map, brewpiStore.headerSize + index * brewpiStore.recordSize)
+			for append, value in zip(appends, values):
+				append(value)
+		return result
+
+
+class History:
+	"""
+	The columns of all sample segments of a beer in a time range, as views on the memory mapped segments.
+	Close the history when the columns are no longer needed.
+	"""
+
+	def __init__(self, dataPath, index, start, end):
+		"""
+		Params:
+		dataPath: data directory of the beer
+		index: brewpiIndex.BeerIndex of the beer, used to find the segments that overlap with the time range
+		start, end: time range in seconds since epoch
+		"""
+		self.readers = []
+		self.segments = []  # column dicts, one for each segment, in time order
+		for entry in index.files(start, end):
+			if not entry['segment']:
+				continue  # older data file without a sample segment
+			segmentFileName = os.path.join(dataPath, entry['segment'])
+			if not os.path.exists(segmentFileName):
+				continue
+			reader = SegmentReader(segmentFileName)
+			self.readers.append(reader)
+			self.segments.append(reader.columns(start, end))
+
+	def close(self):
+		self.segments = []
+		for reader in self.readers:
+			reader.close()
+		self.readers = []
+
+	def toJson(self):
+		return toJson(self.segments)
+
+
+def toJson(columnDicts):
+	"""
+	Joins the column dicts of multiple segments to a dict of lists that can be encoded as JSON.
+	Missing values become None.
+	"""
+	joined = dict((key, []) for key in columns)
+	for cols in columnDicts:
+		for key in columns:
+			values = cols[key].tolist()
+			if key == 'State':
+				joined[key] += [None if v == brewpiStore.noState else v for v in values]
+			elif key == 'Time':
+				joined[key] += values
+			else:
+				joined[key] += [None if v != v else round(v, brewpiStore.tempDecimals) for v in values]
+	return joined
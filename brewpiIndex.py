@@ -0,0 +1,195 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import threading
+import simplejson as json
+import brewpiJson
+import brewpiStore
+import brewpiMirror
+import BrewPiUtil as util
+
+# The index of a beer lists its daily data files with the time of the first and last sample, the number of rows
+# and the byte range of the sample records. A query for a time range only opens the files that overlap with it,
+# and for binary sample segments only reads the records in the range.
+indexExtension = '.index'
+indexVersion = 1
+
+
+def indexFileName(dataPath, beerName):
+	return os.path.join(dataPath, beerName + indexExtension)
+
+
+def dataFileRegex(beerName):
+	""" Matches the daily data files of a beer: <beer>-YYYY-MM-DD.json or <beer>-YYYY-MM-DD-N.json """
+	return re.compile(re.escape(beerName) + r'-\d{4}-\d{2}-\d{2}(-\d+)?\.json$')
+
+
+def segmentEntry(jsonFile, segmentFileName):
+	"""
+	Creates an index entry for a data file that has a binary sample segment
+	"""
+	count = brewpiStore.recordCount(segmentFileName)
+	entry = dict(file=jsonFile, segment=os.path.basename(segmentFileName), first=None, last=None, rows=count,
+	             dataStart=brewpiStore.headerSize, dataEnd=brewpiStore.headerSize + count * brewpiStore.recordSize)
+	if count:
+		rows = list(brewpiStore.readRows(segmentFileName, 0, 1)) + \
+			list(brewpiStore.readRows(segmentFileName, count - 1, count))
+		entry['first'] = rows[0]['Time']
+		entry['last'] = rows[-1]['Time']
+	return entry
+
+
+def jsonEntry(jsonFile, jsonFileName):
+	"""
+	Creates an index entry for a data file that only exists as DataTable JSON, written before the sample store existed.
+	The byte range is the complete file, the file has to be parsed to read its rows.
+	"""
+	size = os.path.getsize(jsonFileName)
+	entry = dict(file=jsonFile, segment=None, first=None, last=None, rows=0, dataStart=0, dataEnd=size)
+	try:
+		with open(jsonFileName, 'rb') as f:
+			for row in brewpiJson.parseDataTable(f.read()):
+				if entry['first'] is None:
+					entry['first'] = row['Time']
+				entry['last'] = row['Time']
+				entry['rows'] += 1
+	except (ValueError, KeyError, TypeError), e:
+		util.logMessage("Could not index data file %s: %s" % (jsonFileName, str(e)))
+	return entry
+
+
+class BeerIndex:
+	"""
+	Time range index across the daily data files of a beer.
+	The log writer updates it when samples are appended, it can be rebuilt from the files in the data directory.
+	"""
+
+	def __init__(self, dataPath, beerName):
+		self.dataPath = dataPath
+		self.beerName = beerName
+		self.fileName = indexFileName(dataPath, beerName)
+		self.lock = threading.Lock()  # updated in the log writer thread, queried from the socket
+		self.entries = []
+		self.dirty = False
+		if not self.load():
+			self.rebuild()
+
+	def load(self):
+		"""
+		Loads the index file. Returns False when it does not exist or cannot be used.
+		"""
+		if not os.path.exists(self.fileName):
+			return False
+		try:
+			with open(self.fileName, 'rb') as f:
+				decoded = json.load(f)
+		except (IOError, ValueError):
+			util.logMessage("Index %s is corrupt, rebuilding it" % self.fileName)
+			return False
+		if decoded.get('version') != indexVersion:
+			return False
+		self.entries = decoded['files']
+		return True
+
+	def rebuild(self):
+		"""
+		Rebuilds the index from the data files of the beer
+		"""
+		regex = dataFileRegex(self.beerName)
+		entries = []
+		if os.path.isdir(self.dataPath):
+			for jsonFile in os.listdir(self.dataPath):
+				if not regex.match(jsonFile):
+					continue
+				jsonFileName = os.path.join(self.dataPath, jsonFile)
+				segmentFileName = brewpiStore.segmentFileName(jsonFileName)
+				if os.path.exists(segmentFileName):
+					entries.append(segmentEntry(jsonFile, segmentFileName))
+				else:
+					entries.append(jsonEntry(jsonFile, jsonFileName))
+		entries.sort(key=lambda e: (e['first'] is None, e['first'], e['file']))
+		with self.lock:
+			self.entries = entries
+			self.dirty = True
+		self.save()
+
+	def save(self):
+		"""
+		Writes the index to disk when it has changed, with an atomic rename
+		"""
+		with self.lock:
+			if not self.dirty:
+				return
+			encoded = json.dumps(dict(version=indexVersion, files=self.entries))
+			self.dirty = False
+		tmp = brewpiMirror.tempFileName(self.fileName)
+		with open(tmp, 'wb') as f:
+			f.write(encoded)
+		os.rename(tmp, self.fileName)
+
+	def update(self, jsonFileName, store):
+		"""
+		Updates the entry of a data file after samples have been appended to its store
+
+		Params:
+		jsonFileName: the DataTable JSON file of the data file
+		store: the brewpiStore.SampleStore of the data file
+		"""
+		jsonFile = os.path.basename(jsonFileName)
+		with self.lock:
+			entry = None
+			for e in reversed(self.entries):  # normally the last entry
+				if e['file'] == jsonFile:
+					entry = e
+					break
+			if entry is None:
+				entry = dict(file=jsonFile, segment=os.path.basename(store.fileName), first=None, last=None, rows=0,
+				             dataStart=brewpiStore.headerSize, dataEnd=brewpiStore.headerSize)
+				self.entries.append(entry)
+			entry['segment'] = os.path.basename(store.fileName)
+			if entry['first'] is None and len(store):
+				entry['first'] = next(store.rows(0, 1))['Time']
+			entry['last'] = store.lastTime
+			entry['rows'] = len(store)
+			entry['dataEnd'] = brewpiStore.headerSize + len(store) * brewpiStore.recordSize
+			self.dirty = True
+
+	def files(self, start, end):
+		"""
+		Returns the index entries of the files with samples between start and end
+		"""
+		with self.lock:
+			return [dict(e) for e in self.entries
+			        if e['first'] is not None and e['first'] <= end and e['last'] >= start]
+
+	def query(self, start, end):
+		"""
+		Generator for the samples between start and end (seconds since epoch), in time order.
+		Only the files that overlap with the range are opened.
+		"""
+		for entry in self.files(start, end):
+			if entry['segment']:
+				segmentFileName = os.path.join(self.dataPath, entry['segment'])
+				first, stop = brewpiStore.indexRange(segmentFileName, start, end)
+				for row in brewpiStore.readRows(segmentFileName, first, min(stop, entry['rows'])):
+					yield row
+			else:
+				with open(os.path.join(self.dataPath, entry['file']), 'rb') as f:
+					for row in brewpiJson.parseDataTable(f.read()):
+						if start <= row['Time'] <= end:
+							yield row
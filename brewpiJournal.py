@@ -0,0 +1,241 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import struct
+import time
+import zlib
+import simplejson as json
+import brewpiJson
+import brewpiRowEncoder
+import brewpiLogWriter
+import brewpiRollup
+import brewpiIndex
+import BrewPiUtil as util
+
+# Samples are appended to the journal and forced to disk before they are written to the data files.
+# When the data files are synced, the journal is emptied again, so it only holds the samples that might not have
+# reached the data files yet. After a crash, recovery replays those samples, which takes time proportional to the
+# journal, not to the size of the data files.
+#
+# Each record is one batch of samples for one log target:
+# payload length, CRC32 of the payload, JSON payload {"target": {...}, "samples": [[timestamp, row], ...]}
+recordHeaderFormat = '<II'
+recordHeaderSize = struct.calcsize(recordHeaderFormat)
+
+
+class SampleJournal:
+	"""
+	Write-ahead journal of the samples written by the log writer
+	"""
+
+	def __init__(self, fileName):
+		self.fileName = fileName
+		self.file = open(fileName, 'ab', 0)  # unbuffered, every record is a single write
+		self.records = 0
+		self.checkpoints = 0
+
+	def __repr__(self):
+		"""
+		This special function ensures SampleJournal is printed as a dict of its member variables in print statements.
+		"""
+		return repr(self.__dict__)
+
+	def append(self, target, rows, timestamps):
+		"""
+		Appends a batch of samples for a target and forces it to disk
+
+		Args:
+		target: brewpiLogWriter.LogTarget the samples will be written to
+		rows: list of row dicts
+		timestamps: list of seconds since epoch, one for each row
+		"""
+		payload = json.dumps(dict(target=target.description(), samples=zip(timestamps, rows)))
+		self.file.write(struct.pack(recordHeaderFormat, len(payload), zlib.crc32(payload) & 0xffffffff) + payload)
+		os.fsync(self.file.fileno())
+		self.records += 1
+
+	def checkpoint(self):
+		"""
+		Empties the journal. Called when all journaled samples have been written to the data files and synced.
+		"""
+		if self.records:
+			self.file.truncate(0)
+			os.fsync(self.file.fileno())
+			self.records = 0
+			self.checkpoints += 1
+
+	def close(self):
+		self.file.close()
+
+
+def readRecords(fileName):
+	"""
+	Generator for the payloads of the complete records in a journal.
+	Reading stops at the first record that is incomplete or has a wrong checksum: it was being written during the crash.
+	"""
+	if not os.path.exists(fileName):
+		return
+	with open(fileName, 'rb') as f:
+		while True:
+			header = f.read(recordHeaderSize)
+			if len(header) < recordHeaderSize:
+				return
+			length, crc = struct.unpack(recordHeaderFormat, header)
+			payload = f.read(length)
+			if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+				util.logMessage("Journal %s ends with an incomplete record, it is ignored" % fileName)
+				return
+			yield json.loads(payload)
+
+
+def repairLines(fileName, parseLine):
+	"""
+	Removes an incomplete last line from a line based data file and returns the time of the last line.
+	Only the end of the file is read.
+
+	Args:
+	fileName: CSV or NDJSON data file
+	parseLine: function that returns the time of a line in seconds since epoch
+	"""
+	if not os.path.exists(fileName):
+		return None
+	with open(fileName, 'r+b') as f:
+		f.seek(0, os.SEEK_END)
+		size = f.tell()
+		f.seek(max(0, size - 4096))
+		tail = f.read()
+		end = tail.rfind('\n') + 1
+		if end < len(tail):
+			f.truncate(size - len(tail) + end)
+		lines = tail[:end].splitlines()
+	try:
+		return parseLine(lines[-1]) if lines else None
+	except (ValueError, KeyError, IndexError):
+		return None
+
+
+def csvLineTime(line):
+	return time.mktime(time.strptime(line.split(';')[0], brewpiRowEncoder.csvTimeFormat))
+
+
+def ndjsonLineTime(line):
+	return json.loads(line)['Time']
+
+
+def recover(fileName):
+	"""
+	Replays the samples in a journal to the data files they were written to. Each data file only receives the samples
+	that are newer than its last complete row, after an incomplete row at the end of the file has been removed.
+	The journal is emptied afterwards.
+
+	Returns:
+	number of samples in the journal
+	"""
+	recovered = 0
+	for record in readRecords(fileName):
+		samples = record['samples']
+		if not samples:
+			continue
+		try:
+			recoverTarget(record['target'], [s[1] for s in samples], [s[0] for s in samples])
+		except (IOError, OSError, ValueError), e:
+			util.logMessage("Error recovering samples from journal: %s" % str(e))
+		recovered += len(samples)
+	if recovered:
+		util.logMessage("Recovered %d samples from journal %s" % (recovered, fileName))
+	if os.path.exists(fileName):
+		open(fileName, 'wb').close()
+	return recovered
+
+
+def appendText(fileName, text):
+	if text:
+		f = open(fileName, 'ab')
+		f.write(text)
+		f.close()
+
+
+def recoverTarget(description, rows, timestamps):
+	"""
+	Replays a batch of journaled samples to the files of a log target
+
+	Args:
+	description: dict with the file names of the target, from brewpiLogWriter.LogTarget.description
+	rows: list of row dicts
+	timestamps: list of seconds since epoch, one for each row
+	"""
+	def newer(last, key):
+		if last is None:
+			return set(range(len(timestamps)))
+		return set(i for i, ts in enumerate(timestamps) if key(ts) > last)
+
+	def seconds(ts):  # the JSON and CSV files store the time in whole seconds
+		return int(ts)
+
+	def milliseconds(ts):
+		return round(ts, 3)
+
+	jsonFileName = description['jsonFileName']
+	csvFileName = description['csvFileName']
+	ndjsonFileName = description['ndjsonFileName']
+	dataTableFiles = description['dataTableFiles']
+	jsonSelected = newer(brewpiJson.repairFile(jsonFileName), seconds) if dataTableFiles else set()
+	csvSelected = newer(repairLines(csvFileName, csvLineTime), seconds)
+	ndjsonSelected = newer(repairLines(ndjsonFileName, ndjsonLineTime), milliseconds) if ndjsonFileName else set()
+
+	rollups = None
+	index = None
+	if description['beerName']:
+		rollups = brewpiRollup.Rollups(description['dataPath'], description['beerName'])
+		index = brewpiIndex.BeerIndex(description['dataPath'], description['beerName'])
+	target = brewpiLogWriter.LogTarget(jsonFileName, description['wwwJsonFileName'],
+	                                   csvFileName, description['wwwCsvFileName'],
+	                                   dataTableFiles=dataTableFiles, rollups=rollups, index=index,
+	                                   ndjsonFileName=ndjsonFileName)
+	if rollups is not None:
+		rollups.replay(rows, timestamps)
+
+	storeSelected = sorted(newer(target.store.lastTime, float))
+	if storeSelected:
+		target.store.appendMany([rows[i] for i in storeSelected], [timestamps[i] for i in storeSelected])
+		if index is not None:
+			index.update(jsonFileName, target.store)
+
+	jsonRows = []
+	csvLines = []
+	ndjsonLines = []
+	for i, (row, timestamp) in enumerate(zip(rows, timestamps)):
+		try:
+			jsonRow, csvLine, ndjsonLine = brewpiRowEncoder.encodeRow(row, timestamp, ndjson=bool(ndjsonFileName))
+		except KeyError:
+			continue  # the log writer did not write this row either
+		if i in jsonSelected:
+			jsonRows.append(jsonRow)
+		if i in csvSelected:
+			csvLines.append(csvLine)
+		if i in ndjsonSelected:
+			ndjsonLines.append(ndjsonLine)
+	if jsonRows:
+		brewpiJson.addFormattedRows(jsonFileName, jsonRows)
+	appendText(csvFileName, ''.join(csvLines))
+	if ndjsonFileName:
+		appendText(ndjsonFileName, ''.join(ndjsonLines))
+
+	if dataTableFiles:
+		target.jsonMirror.sync()
+	target.csvMirror.sync()
+	target.finish()  # syncs all files and writes the rollups and index
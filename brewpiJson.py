@@ -18,6 +18,8 @@ from datetime import datetime
 import time
 import os
 import re
+import simplejson as json
+import brewpiRowEncoder
 
 jsonCols = ("\"cols\":[" +
             "{\"type\":\"datetime\",\"id\":\"Time\",\"label\":\"Time\"}," +
@@ -40,72 +42,171 @@ def fixJson(j):
 	return j
 
 
+def formatRow(row, now):
+	"""
+	Formats a row as a DataTable JSON row, something like this:
+	{"c":[{"v":"Date(2012,8,26,0,1,0)"},{"v":18.96},{"v":19.0},null,{"v":19.94},{"v":19.6},null]}
+
+	Params:
+	row: dict with the sample values
+	now: datetime of the sample
+	"""
+	return brewpiRowEncoder.jsonRow(row, now.timetuple())
+
+
 def addRow(jsonFileName, row):
+	addRows(jsonFileName, [row], [datetime.now()])
+
+
+def addRows(jsonFileName, rows, times):
+	"""
+	Adds rows to a DataTable JSON file, with a single write
+
+	Params:
+	jsonFileName: file created with newEmptyFile
+	rows: list of row dicts
+	times: list of datetimes, one for each row
+	"""
+	addFormattedRows(jsonFileName, [formatRow(row, now) for row, now in zip(rows, times)])
+
+
+def addFormattedRows(jsonFileName, jsonRows):
+	"""
+	Adds rows that are already formatted by brewpiRowEncoder to a DataTable JSON file, with a single write
+	"""
 	jsonFile = open(jsonFileName, "r+")
 	jsonFile.seek(-3, 2)  # Go insert point to add the last row
 	ch = jsonFile.read(1)
 	jsonFile.seek(0, os.SEEK_CUR)
 	# when alternating between reads and writes, the file contents should be flushed, see
 	# http://bugs.python.org/issue3207. This prevents IOError, Errno 0
+	formatted = ",".join([os.linesep + jsonRow for jsonRow in jsonRows])
 	if ch != '[':
 		# not the first item
-		jsonFile.write(',')
-	newRow = {}
-	newRow['Time'] = datetime.today()
-
-	# insert something like this into the file:
-	# {"c":[{"v":"Date(2012,8,26,0,1,0)"},{"v":18.96},{"v":19.0},null,{"v":19.94},{"v":19.6},null]},
-	jsonFile.write(os.linesep)
-	jsonFile.write("{\"c\":[")
-	now = datetime.now()
-	jsonFile.write("{{\"v\":\"Date({y},{M},{d},{h},{m},{s})\"}},".format(
-		y=now.year, M=(now.month - 1), d=now.day, h=now.hour, m=now.minute, s=now.second))
-	if row['BeerTemp'] is None:
-		jsonFile.write("null,")
-	else:
-		jsonFile.write("{\"v\":" + str(row['BeerTemp']) + "},")
-
-	if row['BeerSet'] is None:
-		jsonFile.write("null,")
-	else:
-		jsonFile.write("{\"v\":" + str(row['BeerSet']) + "},")
-
-	if row['BeerAnn'] is None:
-		jsonFile.write("null,")
-	else:
-		jsonFile.write("{\"v\":\"" + str(row['BeerAnn']) + "\"},")
-
-	if row['FridgeTemp'] is None:
-		jsonFile.write("null,")
-	else:
-		jsonFile.write("{\"v\":" + str(row['FridgeTemp']) + "},")
-
-	if row['FridgeSet'] is None:
-		jsonFile.write("null,")
-	else:
-		jsonFile.write("{\"v\":" + str(row['FridgeSet']) + "},")
-
-	if row['FridgeAnn'] is None:
-		jsonFile.write("null,")
-	else:
-		jsonFile.write("{\"v\":\"" + str(row['FridgeAnn']) + "\"},")
-
-	if row['RoomTemp'] is None:
-		jsonFile.write("null,")
-	else:
-		jsonFile.write("{\"v\":\"" + str(row['RoomTemp']) + "\"},")
-
-	if row['State'] is None:
-		jsonFile.write("null")
-	else:
-		jsonFile.write("{\"v\":\"" + str(row['State']) + "\"}")
+		formatted = ',' + formatted
 
 	# rewrite end of json file
-	jsonFile.write("]}]}")
+	jsonFile.write(formatted + "]}")
 	jsonFile.close()
 
 
+def dataTable(rows):
+	"""
+	Generates a complete DataTable JSON string, in the same format as the files written by addRow.
+
+	Params:
+	rows: iterable of row dicts. The 'Time' key holds the time of the sample in seconds since epoch
+	"""
+	formatted = [os.linesep + brewpiRowEncoder.jsonRow(row, time.localtime(row['Time'])) for row in rows]
+	return "{" + jsonCols + ",\"rows\":[" + ",".join(formatted) + "]}"
+
+
 def newEmptyFile(jsonFileName):
 	jsonFile = open(jsonFileName, "w")
 	jsonFile.write("{" + jsonCols + ",\"rows\":[]}")
 	jsonFile.close()
+
+
+dateRegex = re.compile(r'Date\((\d+),(\d+),(\d+),(\d+),(\d+),(\d+)\)')
+
+
+def parseTime(dateString):
+	"""
+	Converts a DataTable date string like "Date(2012,8,26,0,1,0)" (month counts from 0) to seconds since epoch
+	"""
+	m = dateRegex.match(dateString)
+	if m is None:
+		return None
+	y, M, d, h, mi, s = [int(x) for x in m.groups()]
+	return time.mktime((y, M + 1, d, h, mi, s, 0, 0, -1))
+
+
+def parseDataTable(text):
+	"""
+	Generator for the rows in a DataTable JSON string, as row dicts with the same keys as used by addRow.
+	The 'Time' key holds seconds since epoch. Works for older files with fewer columns too.
+	"""
+	decoded = json.loads(text)
+	ids = [col['id'] for col in decoded['cols']]
+	for r in decoded['rows']:
+		row = dict(BeerTemp=None, BeerSet=None, BeerAnn=None, FridgeTemp=None, FridgeSet=None, FridgeAnn=None,
+		           RoomTemp=None, State=None)
+		for colId, cell in zip(ids, r['c']):
+			row[colId] = None if cell is None else cell.get('v')
+		row['Time'] = parseTime(row['Time']) if row.get('Time') else None
+		if row['Time'] is None:
+			continue
+		# newer files store the room temperature and state as strings
+		if isinstance(row['RoomTemp'], basestring):
+			row['RoomTemp'] = float(row['RoomTemp']) if row['RoomTemp'] not in ('', 'None') else None
+		if isinstance(row['State'], basestring):
+			row['State'] = int(row['State']) if row['State'] not in ('', 'None') else None
+		yield row
+
+
+def isValid(text):
+	try:
+		json.loads(text)
+		return True
+	except ValueError:
+		return False
+
+
+def lastRowTime(jsonFile):
+	"""
+	Returns the time of the last row of a complete DataTable JSON file, None when it has no rows.
+	Only the end of the file is read.
+	"""
+	jsonFile.seek(0, os.SEEK_END)
+	jsonFile.seek(max(0, jsonFile.tell() - 1024))
+	tail = jsonFile.read()
+	p = tail.rfind('"Date(')
+	if p < 0:
+		return None
+	return parseTime(tail[p + 1:])
+
+
+def repairFile(jsonFileName):
+	"""
+	Repairs a DataTable JSON file of which the end was not completely written, for example after a power failure.
+	Incomplete rows at the end of the file are removed and the closing brackets are restored.
+	Only the end of the file is read when it is complete.
+
+	Returns:
+	time of the last row in the file in seconds since epoch, None when the file has no rows
+	"""
+	if not os.path.exists(jsonFileName) or os.path.getsize(jsonFileName) < 4:
+		newEmptyFile(jsonFileName)
+		return None
+	with open(jsonFileName, 'rb') as jsonFile:
+		jsonFile.seek(-4, os.SEEK_END)
+		end = jsonFile.read()
+		if end == ']}]}' or end.endswith('[]}'):  # closing brackets of the rows or of an empty file
+			return lastRowTime(jsonFile)
+		jsonFile.seek(0)
+		text = jsonFile.read()
+	if not isValid(text):
+		rowStart = os.linesep + '{"c":['
+		repaired = None
+		end = len(text)
+		while repaired is None:
+			p = text.rfind(rowStart, 0, end)
+			if p < 0:
+				rowsStart = text.find('"rows":[')
+				if rowsStart < 0:
+					newEmptyFile(jsonFileName)  # header was not written, nothing to save
+					return None
+				repaired = text[:rowsStart + len('"rows":[')] + ']}'
+				break
+			rowEnd = text.find(']}', p)
+			if rowEnd >= 0 and isValid(text[:rowEnd + 2] + ']}'):
+				repaired = text[:rowEnd + 2] + ']}'  # last row is complete, only the closing brackets were lost
+			elif isValid(text[:p].rstrip(',') + ']}'):
+				repaired = text[:p].rstrip(',') + ']}'  # drop the incomplete last row
+			end = p
+		tmp = jsonFileName + '.tmp'
+		with open(tmp, 'wb') as jsonFile:
+			jsonFile.write(repaired)
+		os.rename(tmp, jsonFileName)
+	with open(jsonFileName, 'rb') as jsonFile:
+		return lastRowTime(jsonFile)
@@ -0,0 +1,341 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import threading
+import traceback
+import Queue
+import brewpiCapture
+import brewpiJson
+import brewpiRowEncoder
+import brewpiStore
+import brewpiMirror
+import BrewPiUtil as util
+
+
+class LogTarget:
+	"""
+	The set of files the samples of one data file (one day of a beer) are written to:
+	the binary sample store, the DataTable JSON file, the CSV file of the beer and their copies in the www dir.
+	After creation, only the writer thread writes to the files of a target.
+	"""
+
+	def __init__(self, jsonFileName, wwwJsonFileName, csvFileName, wwwCsvFileName, dataTableFiles=True,
+	             rollups=None, index=None, ndjsonFileName=None, stream=None):
+		"""
+		Args:
+		jsonFileName: local DataTable JSON file, the sample store is created next to it
+		wwwJsonFileName: copy of the JSON file in the www dir
+		csvFileName: local CSV file
+		wwwCsvFileName: copy of the CSV file in the www dir
+		dataTableFiles: when False, the JSON file is only generated from the store when the target is finished
+		rollups: brewpiRollup.Rollups of the beer, updated with every sample. Shared by the targets of a beer.
+		index: brewpiIndex.BeerIndex of the beer, updated with every sample. Shared by the targets of a beer.
+		ndjsonFileName: when set, the samples are also written to this file as newline delimited JSON
+		stream: name of the controller the samples come from, when one writer logs for several controllers.
+		The writer keeps the last target of every stream open.
+		"""
+		self.jsonFileName = jsonFileName
+		self.wwwJsonFileName = wwwJsonFileName
+		self.csvFileName = csvFileName
+		self.wwwCsvFileName = wwwCsvFileName
+		self.dataTableFiles = dataTableFiles
+		self.rollups = rollups
+		self.index = index
+		self.ndjsonFileName = ndjsonFileName
+		self.stream = stream
+		self.store = brewpiStore.SampleStore(brewpiStore.segmentFileName(jsonFileName))
+		self.jsonMirror = brewpiMirror.FileMirror(jsonFileName, wwwJsonFileName, appendOnly=False)
+		self.csvMirror = brewpiMirror.FileMirror(csvFileName, wwwCsvFileName)
+
+	def __repr__(self):
+		"""
+		This special function ensures LogTarget is printed as a dict of its member variables in print statements.
+		"""
+		return repr(self.__dict__)
+
+	def description(self):
+		"""
+		Returns the file names and settings of the target as a dict that can be encoded as JSON,
+		so the target can be recreated by journal recovery
+		"""
+		return dict(jsonFileName=self.jsonFileName, wwwJsonFileName=self.wwwJsonFileName,
+		            csvFileName=self.csvFileName, wwwCsvFileName=self.wwwCsvFileName,
+		            ndjsonFileName=self.ndjsonFileName, dataTableFiles=self.dataTableFiles,
+		            dataPath=self.index.dataPath if self.index is not None else None,
+		            beerName=self.index.beerName if self.index is not None else None)
+
+	def write(self, rows, timestamps):
+		"""
+		Writes a batch of rows to all files of the target, with one write per file
+
+		Args:
+		rows: list of row dicts
+		timestamps: list of seconds since epoch, one for each row
+		"""
+		self.store.appendMany(rows, timestamps)
+		if self.index is not None:
+			self.index.update(self.jsonFileName, self.store)
+		if self.rollups is not None:
+			for row, timestamp in zip(rows, timestamps):
+				self.rollups.add(row, timestamp)
+
+		# format every sample once for all files
+		jsonRows, csvText, ndjsonText = brewpiRowEncoder.encodeRows(rows, timestamps,
+		                                                            ndjson=bool(self.ndjsonFileName))
+
+		if self.dataTableFiles and jsonRows:
+			brewpiJson.addFormattedRows(self.jsonFileName, jsonRows)
+			# copy to www dir.
+			# Do not write directly to www dir to prevent blocking www file.
+			self.jsonMirror.sync()
+
+		csvFile = open(self.csvFileName, "a")
+		csvFile.write(csvText)
+		csvFile.close()
+		self.csvMirror.sync()  # only copies the new lines to the www dir
+
+		if self.ndjsonFileName:
+			ndjsonFile = open(self.ndjsonFileName, "a")
+			ndjsonFile.write(ndjsonText)
+			ndjsonFile.close()
+
+	def sync(self):
+		"""
+		Forces the written data of the local files to the storage medium.
+		The copies in the www dir can be recreated from the local files, so they are not synced.
+		"""
+		self.store.sync()
+		if self.rollups is not None:
+			self.rollups.flush()
+		if self.index is not None:
+			self.index.save()
+		for fileName in [self.jsonFileName, self.csvFileName, self.ndjsonFileName]:
+			if fileName and os.path.exists(fileName):
+				f = open(fileName, 'rb')
+				os.fsync(f.fileno())
+				f.close()
+
+	def publishDataTable(self):
+		"""
+		Generates the DataTable JSON file from the sample store and copies it to the www dir
+		"""
+		self.store.writeDataTableFile(self.jsonFileName)
+		brewpiMirror.publish(self.jsonFileName, self.wwwJsonFileName)
+
+	def finish(self):
+		"""
+		Called when no more samples will be written to this target
+		"""
+		if not self.dataTableFiles:
+			self.publishDataTable()
+		self.sync()
+		self.store.close()
+
+
+class DataLogWriter(threading.Thread):
+	"""
+	Writes logged samples in a background thread, so a slow SD card does not delay serial handling
+	and replies on the socket. The control loop only puts samples in a bounded queue.
+
+	All samples that are waiting in the queue are written in one pass, with one write per file.
+	Written data is forced to the storage medium (fsync) every fsyncSamples samples or every fsyncSeconds seconds,
+	whichever comes first. A value of 0 disables that part of the policy.
+
+	With a journal, every batch is appended to the journal before it is written to the data files,
+	and the journal is emptied after each sync. See brewpiJournal.
+
+	Samples of several controllers can be queued to the same writer. The current target of each controller
+	(LogTarget.stream) stays open until a sample for a new target of that controller arrives.
+	"""
+
+	def __init__(self, queueSize=1000, fsyncSamples=10, fsyncSeconds=300.0, journal=None):
+		threading.Thread.__init__(self, name='DataLogWriter')
+		self.daemon = True
+		self.queue = Queue.Queue(maxsize=queueSize)
+		self.fsyncSamples = fsyncSamples
+		self.fsyncSeconds = fsyncSeconds
+		self.journal = journal
+		self.targets = {}  # stream to its current target, finished when samples arrive for a new target
+		self.unsyncedTargets = []  # targets written since the last sync
+		self.unsyncedSamples = 0
+		self.lastSync = time.time()
+		self.statsLock = threading.Lock()
+		self.samplesWritten = 0
+		self.samplesDropped = 0
+		self.batches = 0
+		self.fsyncs = 0
+		self.maxQueueDepth = 0
+		self.lastWriteLatency = 0.0
+		self.maxWriteLatency = 0.0
+		self.totalWriteLatency = 0.0
+		self.writeErrors = 0
+
+	def put(self, target, row, timestamp=None):
+		"""
+		Queues a sample for writing, never blocks. When the queue is full, the sample is dropped.
+
+		Args:
+		target: LogTarget to write the sample to
+		row: dict with the sample values. A copy is queued, so the caller can keep updating its dict.
+		timestamp: seconds since epoch, defaults to now
+
+		Returns:
+		True when the sample was queued
+		"""
+		if timestamp is None:
+			timestamp = time.time()
+		try:
+			self.queue.put_nowait((target, dict(row), timestamp))
+		except Queue.Full:
+			with self.statsLock:
+				self.samplesDropped += 1
+			util.logMessage("Error: data log queue is full, sample dropped. Is the storage medium very slow?")
+			return False
+		with self.statsLock:
+			self.maxQueueDepth = max(self.maxQueueDepth, self.queue.qsize())
+		return True
+
+	def stop(self):
+		"""
+		Writes all queued samples, finishes the current target and waits for the thread to exit
+		"""
+		if self.isAlive():
+			self.queue.put(None)
+			self.join()
+
+	def run(self):
+		try:
+			self.writeSamples()
+		except Exception:
+			brewpiCapture.saveCrashCaptures()  # sys.excepthook is not called for threads
+			raise
+
+	def writeSamples(self):
+		running = True
+		while running:
+			try:
+				# wake up to sync samples that were written after the last sync, when no new samples arrive
+				batch = [self.queue.get(timeout=self.fsyncSeconds or None)]
+			except Queue.Empty:
+				if self.unsyncedSamples:
+					self.syncTargets()
+				continue
+			while True:  # coalesce everything that is waiting
+				try:
+					batch.append(self.queue.get_nowait())
+				except Queue.Empty:
+					break
+			if None in batch:
+				running = False
+				batch = batch[:batch.index(None)]
+			try:
+				self.writeBatch(batch)
+				if not running and self.targets:
+					for target in self.targets.values():
+						target.finish()
+					self.targets = {}
+					self.unsyncedTargets = []
+					if self.journal is not None:
+						self.journal.checkpoint()
+			except (IOError, OSError), e:
+				with self.statsLock:
+					self.writeErrors += 1
+				util.logMessage("Error writing data log files: %s" % str(e))
+			except Exception:
+				# a sample that cannot be encoded or stored should not stop logging of the later samples
+				with self.statsLock:
+					self.writeErrors += 1
+				util.logMessage("Error writing data log files:\n" + traceback.format_exc())
+
+	def writeBatch(self, batch):
+		"""
+		Writes a batch of (target, row, timestamp) tuples. Consecutive samples for the same target are written together.
+		"""
+		start = time.time()
+		i = 0
+		while i < len(batch):
+			target = batch[i][0]
+			previous = self.targets.get(target.stream)
+			if target is not previous:
+				if previous is not None:
+					previous.finish()  # syncs and closes its files, it must not be synced again
+					if previous in self.unsyncedTargets:
+						self.unsyncedTargets.remove(previous)
+				self.targets[target.stream] = target
+			rows = []
+			timestamps = []
+			while i < len(batch) and batch[i][0] is target:
+				rows.append(batch[i][1])
+				timestamps.append(batch[i][2])
+				i += 1
+			if self.journal is not None:
+				self.journal.append(target, rows, timestamps)
+			target.write(rows, timestamps)
+			if target not in self.unsyncedTargets:
+				self.unsyncedTargets.append(target)
+			self.unsyncedSamples += len(rows)
+			if self.fsyncDue():
+				self.syncTargets()
+		if batch:
+			latency = time.time() - start
+			with self.statsLock:
+				self.samplesWritten += len(batch)
+				self.batches += 1
+				self.lastWriteLatency = latency
+				self.maxWriteLatency = max(self.maxWriteLatency, latency)
+				self.totalWriteLatency += latency
+
+	def syncTargets(self):
+		try:
+			for target in self.unsyncedTargets:
+				target.sync()
+			self.unsyncedTargets = []
+			if self.journal is not None:
+				self.journal.checkpoint()
+		except (IOError, OSError), e:
+			util.logMessage("Error syncing data log files: %s" % str(e))
+		except Exception:
+			util.logMessage("Error syncing data log files:\n" + traceback.format_exc())
+		self.unsyncedSamples = 0
+		self.lastSync = time.time()
+		with self.statsLock:
+			self.fsyncs += 1
+
+	def fsyncDue(self):
+		if self.fsyncSamples and self.unsyncedSamples >= self.fsyncSamples:
+			return True
+		if self.fsyncSeconds and time.time() - self.lastSync >= self.fsyncSeconds:
+			return True
+		return False
+
+	def stats(self):
+		"""
+		Returns a dict with the queue depth and write latency statistics
+		"""
+		with self.statsLock:
+			return dict(queueDepth=self.queue.qsize(),
+			            maxQueueDepth=self.maxQueueDepth,
+			            samplesWritten=self.samplesWritten,
+			            samplesDropped=self.samplesDropped,
+			            batches=self.batches,
+			            fsyncs=self.fsyncs,
+			            writeErrors=self.writeErrors,
+			            journalCheckpoints=self.journal.checkpoints if self.journal is not None else 0,
+			            lastWriteLatency=self.lastWriteLatency,
+			            maxWriteLatency=self.maxWriteLatency,
+			            avgWriteLatency=self.totalWriteLatency / self.batches if self.batches else 0.0)
@@ -0,0 +1,115 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+
+
+def tempFileName(fileName):
+	"""
+	Returns a hidden temporary file name in the same directory, so the file can be renamed atomically
+	and the web server does not list it as a data file.
+	"""
+	directory, name = os.path.split(fileName)
+	return os.path.join(directory, '.' + name + '.tmp')
+
+
+def publish(src, dst):
+	"""
+	Copies src to dst by writing a temporary file and renaming it.
+	The rename is atomic, so the web server sees either the old or the new file, never a half written one.
+	"""
+	tmp = tempFileName(dst)
+	shutil.copyfile(src, tmp)
+	if os.path.exists(dst):
+		shutil.copymode(dst, tmp)  # keep the permissions of the file that is replaced
+	os.rename(tmp, dst)
+
+
+class FileMirror:
+	"""
+	Keeps a copy of a data file in the www directory up to date.
+
+	For append only files (the CSV file), only the bytes that were appended since the last sync are written
+	to the copy. Only complete lines are copied, with a single write, so the web server never reads half a row.
+	The amount of data written per sample therefore does not grow with the length of the brew.
+
+	Files that are changed in place (the DataTable JSON file rewrites its closing brackets) are published with
+	an atomic rename. These files hold a single day of data, so their size is bounded.
+	"""
+
+	def __init__(self, src, dst, appendOnly=True):
+		""" Prepares the mirror, does not copy anything yet.
+
+		Args:
+		src: path of the local file that is written by the script
+		dst: path of the copy in the www directory
+		appendOnly: True when src only grows at the end
+		"""
+		self.src = src
+		self.dst = dst
+		self.appendOnly = appendOnly
+		self.offset = None  # number of bytes of src that dst is known to contain
+		self.bytesWritten = 0  # total bytes written to the www dir, to verify that writes stay small
+
+	def __repr__(self):
+		"""
+		This special function ensures FileMirror is printed as a dict of its member variables in print statements.
+		"""
+		return repr(self.__dict__)
+
+	def sync(self):
+		"""
+		Brings the copy in the www directory up to date with the local file
+		"""
+		if not os.path.exists(self.src):
+			return
+		if not self.appendOnly:
+			publish(self.src, self.dst)
+			self.bytesWritten += os.path.getsize(self.dst)
+			return
+
+		size = os.path.getsize(self.src)
+		if self.offset is None:
+			# first sync, the copy is assumed to hold the start of the local file when it is not longer
+			if os.path.exists(self.dst) and os.path.getsize(self.dst) <= size:
+				self.offset = os.path.getsize(self.dst)
+		elif not os.path.exists(self.dst) or os.path.getsize(self.dst) != self.offset:
+			self.offset = None  # copy was removed or changed by someone else
+		if self.offset is None or size < self.offset:
+			self.fullCopy(size)
+			return
+		if size == self.offset:
+			return
+
+		with open(self.src, 'rb') as srcFile:
+			srcFile.seek(self.offset)
+			data = srcFile.read(size - self.offset)
+		end = data.rfind('\n') + 1  # only mirror complete lines
+		if end == 0:
+			return
+		fd = os.open(self.dst, os.O_WRONLY | os.O_APPEND)
+		try:
+			os.write(fd, data[:end])
+		finally:
+			os.close(fd)
+		self.offset += end
+		self.bytesWritten += end
+
+	def fullCopy(self, size):
+		publish(self.src, self.dst)
+		self.offset = size
+		self.bytesWritten += size
@@ -0,0 +1,243 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# Multi-controller mode: one process for several fermentation chambers, each with its own Arduino.
+# The chambers are listed in the [chambers] section of the config file, with the settings that differ per chamber:
+#
+# [chambers]
+#     [[fermenter1]]
+#     port = /dev/ttyACM0
+#     beerName = IPA
+#     [[fermenter2]]
+#     port = /dev/ttyACM1
+#     beerName = Stout
+#
+# All serial ports, the web clients and the socket are served by one event loop, and one background thread writes
+# the data files of all chambers. Adding a chamber adds its state and serial port, not a process or a thread.
+#
+# Socket messages are the same as for brewpi.py, prefixed with the name of the chamber: 'fermenter2/setBeer=18.5'.
+# Messages without prefix go to the first chamber, so a web interface for a single chamber keeps working.
+# getChambers returns the state of all chambers.
+
+import sys
+import os
+import time
+import socket
+import getopt
+import simplejson as json
+
+import brewpiCapture
+import brewpiCommands
+import brewpiChamber
+import brewpiEventLoop
+import brewpiJournal
+import brewpiLogWriter
+import BrewPiUtil as util
+import BrewPiProcess
+
+logMessage = util.logMessage
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], "hc:l", ['help', 'config=', 'log'])
+except getopt.GetoptError:
+    print "Unknown parameter, available Options: --help, --config <path to config file>, --log"
+    sys.exit()
+
+configFile = None
+logToFiles = False
+for o, a in opts:
+    if o in ('-h', '--help'):
+        print "\n Available command line options: "
+        print "--help: print this help message"
+        print "--config <path to config file>: specify a config file to use. When omitted settings/config.cfg is used"
+        print "--log: redirect stderr and stdout to log files"
+        exit()
+    if o in ('-c', '--config'):
+        configFile = os.path.abspath(a)
+        if not os.path.exists(configFile):
+            sys.exit('ERROR: Config file "%s" was not found!' % configFile)
+    if o in ('-l', '--log'):
+        logToFiles = True
+
+if not configFile:
+    configFile = util.addSlash(sys.path[0]) + 'settings/config.cfg'
+
+config = util.readCfgWithDefaults(configFile)
+
+chamberIds = brewpiChamber.chamberIds(config)
+if not chamberIds:
+    sys.exit('ERROR: no chambers in the [chambers] section of "%s"' % configFile)
+for chamberId in chamberIds:
+    if not brewpiChamber.isValidChamberId(chamberId):
+        sys.exit('ERROR: invalid chamber name "%s", use letters, digits, - and _' % chamberId)
+if sys.platform.startswith('win'):
+    sys.exit('ERROR: multi-controller mode needs select on serial ports, which is not available on Windows')
+
+# check for other running instances of BrewPi that will cause conflicts with this instance,
+# like a brewpi.py with the same socket or the serial port of one of the chambers
+allProcesses = BrewPiProcess.BrewPiProcesses()
+allProcesses.update()
+if allProcesses.findConflicts(allProcesses.me()):
+    logMessage("Another instance of BrewPi is already running, which will conflict with this instance. " +
+               "This instance will exit")
+    exit(0)
+
+if logToFiles:
+    logPath = util.addSlash(config['scriptPath']) + 'logs/'
+    logMessage("Redirecting output to log files in %s, output will not be shown in console" % logPath)
+    sys.stderr = open(logPath + 'stderr.txt', 'a', 0)  # append to stderr file, unbuffered
+    sys.stdout = open(logPath + 'stdout.txt', 'w', 0)  # overwrite stdout file on script start, unbuffered
+
+# one journal and one writer thread for the samples of all chambers, the journal of brewpi.py is in data/
+sampleJournalFileName = util.addSlash(config['scriptPath']) + 'chambers/sampleJournal.bpj'
+if not os.path.exists(os.path.dirname(sampleJournalFileName)):
+    os.makedirs(os.path.dirname(sampleJournalFileName))
+brewpiJournal.recover(sampleJournalFileName)
+dataLogWriter = brewpiLogWriter.DataLogWriter(queueSize=int(config.get('logQueueSize', 1000)),
+                                              fsyncSamples=int(config.get('logFsyncSamples', 10)),
+                                              fsyncSeconds=float(config.get('logFsyncSeconds', 300)),
+                                              journal=brewpiJournal.SampleJournal(sampleJournalFileName))
+dataLogWriter.start()
+
+loop = brewpiEventLoop.EventLoop()
+chambers = dict((chamberId, brewpiChamber.Chamber(chamberId, config, configFile, loop, dataLogWriter))
+                for chamberId in chamberIds)
+logMessage("Notification: Script started for chambers " + ", ".join(chamberIds))
+brewpiCapture.installCrashHandler(lambda: dict((c, chambers[c].capture) for c in chamberIds),
+                                 util.addSlash(config['scriptPath']) + 'logs')
+
+# one listening socket for all chambers
+if util.configBool(config, 'useInetSocket', False):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    socketPort = config.get('socketPort', 6332)
+    s.bind((config.get('socketHost', 'localhost'), int(socketPort)))
+    logMessage('Bound to TCP socket on port %d ' % int(socketPort))
+else:
+    socketFile = util.addSlash(config['scriptPath']) + 'BEERSOCKET'
+    if os.path.exists(socketFile):
+        os.remove(socketFile)
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind(socketFile)
+    os.chmod(socketFile, 0777)
+s.listen(socket.SOMAXCONN)
+
+dontRunFilePath = config['wwwPath'] + 'do_not_run_brewpi'
+
+
+# commands for the whole process, other commands are handled by a chamber
+processCommands = brewpiCommands.CommandRegistry(logMessage)
+processCommand = processCommands.command
+
+
+@processCommand("ack")
+def ackCommand(conn, value):
+    conn.send('ack')
+
+
+@processCommand("getChambers")
+def getChambersCommand(conn, value):
+    conn.send(json.dumps([chambers[c].summary() for c in chamberIds]))
+
+
+@processCommand("getDataLogStats")
+def getDataLogStatsCommand(conn, value):
+    conn.send(json.dumps(dataLogWriter.stats()))
+
+
+@processCommand("getSocketStats")
+def getSocketStatsCommand(conn, value):
+    conn.send(json.dumps(server.stats()))
+
+
+@processCommand("getStats")  # calls, errors and latencies of the commands of the process and of every chamber
+def getStatsCommand(conn, value):
+    conn.send(json.dumps(dict(process=processCommands.stats(),
+                              chambers=dict((c, chambers[c].commands.stats()) for c in chamberIds))))
+
+
+@processCommand("quit")
+def quitCommand(conn, value):
+    logMessage("quit message received on socket. Stopping script.")
+    loop.stop()
+
+
+@processCommand("stopScript")
+def stopScriptCommand(conn, value):
+    logMessage("stopScript message received on socket. " +
+               "Stopping script and writing dontrunfile to prevent automatic restart")
+    with open(dontRunFilePath, "w") as dontrunfile:
+        dontrunfile.write("1")
+    loop.stop()
+
+
+@processCommand("eraseLogs")
+def eraseLogsCommand(conn, value):
+    open(util.scriptPath() + '/logs/stderr.txt', 'wb').close()
+    open(util.scriptPath() + '/logs/stdout.txt', 'wb').close()
+    logMessage("Fresh start! Log files erased.")
+
+
+def handleSocketMessage(conn, message):
+    """
+    Routes a socket message to its chamber, or handles it when it is for the whole process
+    """
+    chamberId, messageType, value = brewpiChamber.parseMessage(message)
+    if chamberId is None:
+        if messageType in processCommands:
+            processCommands.call(conn, messageType, value)
+            return
+        chamberId = chamberIds[0]
+    chamber = chambers.get(chamberId)
+    if chamber is None:
+        logMessage("Error: Received message for unknown chamber: " + message)
+        conn.send(json.dumps(None))
+    elif messageType == "programArduino":
+        logMessage("Error: programming is not available in multi-controller mode, use programArduino.py")
+    elif chamber.handleMessage(conn, messageType, value):
+        loop.callSoon(chamber.serialPass)  # update the Arduino right away
+
+
+def serialPass():
+    for chamber in chambers.values():
+        chamber.serialPass()
+
+
+def checkNewDay():
+    for chamber in chambers.values():
+        chamber.checkNewDay()
+
+
+def openChambers():
+    for chamber in chambers.values():
+        chamber.open()
+
+
+server = brewpiEventLoop.MessageServer(loop, s, handleSocketMessage)
+# the version handshakes of all chambers run at the same time, see Chamber.requestVersion
+openChambers()
+loop.callEvery(0.5, serialPass)
+loop.callEvery(1.0, checkNewDay)
+try:
+    loop.run()
+except KeyboardInterrupt:
+    pass
+
+server.close()
+dataLogWriter.stop()  # write queued samples
+for chamber in chambers.values():
+    chamber.close()
+s.close()
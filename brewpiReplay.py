@@ -0,0 +1,187 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# Replays a recorded serial session without an Arduino, to reproduce problems and to measure the processing.
+# Record a session with serialCaptureFile in the config (see brewpiCapture), then replay it:
+#
+#     python brewpiReplay.py [--speed <factor>|max] [--output <dir>] [--beer <name>] <capture file>
+#
+# The bytes received from the Arduino are fed to the line framer of the same single chamber that brewpi.py runs
+# (brewpiChamber.Chamber without a chamber name), in the chunks in which they were read, so framing problems are
+# reproduced as well. The data files are written with the layout of brewpi.py, in data/<beer name>/ of the output.
+# The chamber runs on the recorded time: samples get the time at which they were received and the data files are
+# split at the recorded days. At speed 1 the session takes as long as it was recorded, at speed 100 a hundred
+# times shorter, at max the frames are fed as fast as the data log writer keeps up.
+# The bytes sent to the Arduino are in the capture for reference, they are not replayed.
+
+import getopt
+import os
+import sys
+import time
+import configobj
+
+import brewpiCapture
+import brewpiChamber
+import brewpiLogWriter
+import BrewPiUtil as util
+
+
+class ReplayClock:
+	"""
+	Clock of a replayed session: the recorded time of the frame that is being replayed
+	"""
+
+	def __init__(self, now=0.0):
+		self.now = now
+
+	def __call__(self):
+		return self.now
+
+
+class Replay:
+	def __init__(self, outputPath, beerName='replay', dataLogWriter=None):
+		"""
+		Creates a chamber that logs to outputPath/data/<beerName>/
+
+		Params:
+		outputPath: directory for the data files and settings of the replay
+		beerName: name of the beer the samples are logged for
+		dataLogWriter: brewpiLogWriter.DataLogWriter, a writer without fsync is created when None
+		"""
+		if not os.path.exists(outputPath):
+			os.makedirs(outputPath)
+		self.configFile = os.path.join(outputPath, 'replay.cfg')
+		config = configobj.ConfigObj()
+		config.filename = self.configFile
+		config['scriptPath'] = util.addSlash(outputPath)
+		config['wwwPath'] = util.addSlash(outputPath) + 'www/'
+		config['beerName'] = beerName
+		config['interval'] = '120.0'
+		config['dataLogging'] = 'active'
+		config['boardType'] = 'leonardo'
+		config.write()
+		self.ownWriter = dataLogWriter is None
+		if dataLogWriter is None:
+			dataLogWriter = brewpiLogWriter.DataLogWriter(fsyncSamples=0, fsyncSeconds=0)
+			dataLogWriter.start()
+		self.dataLogWriter = dataLogWriter
+		self.clock = ReplayClock()
+		self.chamber = brewpiChamber.Chamber(None, config, self.configFile, None, dataLogWriter, self.clock)
+		self.started = False
+		self.frames = 0
+		self.bytes = 0
+		self.firstTime = None
+		self.lastTime = None
+		self.elapsed = 0.0
+
+	def run(self, frames, speed=None):
+		"""
+		Feeds the frames received from the Arduino to the chamber
+
+		Params:
+		frames: iterable of (wall clock time, direction, data), see brewpiCapture.readCaptureFile
+		speed: replay speed relative to the recording, None to replay as fast as possible
+		"""
+		chamber = self.chamber
+		queue = self.dataLogWriter.queue
+		maxQueueDepth = max(1, queue.maxsize // 2)
+		start = time.time()
+		for frameTime, direction, data in frames:
+			if direction != brewpiCapture.fromArduino:
+				continue
+			self.clock.now = frameTime
+			if not self.started:
+				self.started = True
+				self.firstTime = frameTime
+				chamber.openTime = time.time()
+				chamber.startLogging()
+			elif speed:
+				delay = start + (frameTime - self.firstTime) / speed - time.time()
+				if delay > 0:
+					time.sleep(delay)
+			chamber.checkNewDay()
+			chamber.framer.feed(data)
+			self.frames += 1
+			self.bytes += len(data)
+			self.lastTime = frameTime
+			while queue.qsize() > maxQueueDepth:
+				time.sleep(0.001)  # wait for the writer instead of dropping samples
+		self.elapsed += time.time() - start
+
+	def finish(self):
+		"""
+		Writes the queued samples and returns the statistics of the replay
+		"""
+		start = time.time()
+		if self.ownWriter:
+			self.dataLogWriter.stop()
+		self.elapsed += time.time() - start
+		span = (self.lastTime - self.firstTime) if self.frames else 0.0
+		return dict(frames=self.frames, bytes=self.bytes, lines=self.chamber.dispatcher.stats(),
+		            recordedSeconds=span, replaySeconds=self.elapsed,
+		            daysPerSecond=span / 86400.0 / self.elapsed if self.elapsed else None,
+		            dataLog=self.dataLogWriter.stats())
+
+
+def main(argv):
+	try:
+		opts, args = getopt.getopt(argv, "s:o:b:vh", ['speed=', 'output=', 'beer=', 'verbose', 'help'])
+	except getopt.GetoptError:
+		sys.exit("Unknown parameter, run with --help for the available options")
+	speed = 1.0
+	outputPath = None
+	beerName = 'replay'
+	verbose = False
+	for o, a in opts:
+		if o in ('-h', '--help'):
+			print "Usage: python brewpiReplay.py [options] <capture file>"
+			print "--speed <factor>|max: replay speed relative to the recording, default 1"
+			print "--output <dir>: directory for the data files, default a new directory replay-<time>"
+			print "--beer <name>: beer name for the data files, default replay"
+			print "--verbose: print the temperature lines, as brewpi.py does"
+			return
+		elif o in ('-s', '--speed'):
+			speed = None if a == 'max' else float(a)
+		elif o in ('-o', '--output'):
+			outputPath = os.path.abspath(a)
+		elif o in ('-b', '--beer'):
+			beerName = a
+		elif o in ('-v', '--verbose'):
+			verbose = True
+	if len(args) != 1:
+		sys.exit("Usage: python brewpiReplay.py [options] <capture file>")
+	if outputPath is None:
+		outputPath = os.path.abspath('replay-' + time.strftime('%Y%m%d-%H%M%S'))
+
+	replay = Replay(outputPath, beerName)
+	stdout = sys.stdout
+	if not verbose:
+		sys.stdout = open(os.devnull, 'w')
+	try:
+		replay.run(brewpiCapture.readCaptureFile(args[0]), speed)
+	finally:
+		sys.stdout = stdout
+	stats = replay.finish()
+	print "Replayed %d frames, %d bytes, lines per type %s" % (stats['frames'], stats['bytes'], stats['lines'])
+	print "%.2f days recorded, replayed in %.2f s: %.2f days of data per second" % (
+		stats['recordedSeconds'] / 86400.0, stats['replaySeconds'], stats['daysPerSecond'] or 0.0)
+	print "Samples written: %d, dropped: %d. Data files in %s" % (
+		stats['dataLog']['samplesWritten'], stats['dataLog']['samplesDropped'],
+		replay.chamber.config['scriptPath'] + 'data/' + beerName)
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
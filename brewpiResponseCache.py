@@ -0,0 +1,82 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+
+# The web interface polls lcd, getControlSettings and getControlVariables every few seconds from every open page.
+# Their replies only change when a line from the Arduino changes the state they are made from, so the encoded reply
+# is kept and sent again until then. The handlers of the 'L', 'C', 'S' and 'V' lines invalidate the replies of their
+# state when the received values differ from the current ones, and so does the script when it changes the control
+# settings itself.
+
+# read-only socket commands whose replies are made from the state of a serial line type
+commandsForLine = {
+	'L': ('lcd',),
+	'C': ('getControlConstants',),
+	'S': ('getControlSettings', 'getMode', 'getFridge', 'getBeer'),
+	'V': ('getControlVariables',),
+}
+
+
+class ResponseCache:
+	"""
+	Encoded replies of read-only socket commands, with the number of hits, misses and invalidations per command
+	"""
+
+	def __init__(self):
+		self.replies = {}  # command: (key, encoded reply)
+		self.hits = collections.defaultdict(int)
+		self.misses = collections.defaultdict(int)
+		self.invalidations = collections.defaultdict(int)
+
+	def reply(self, command, encode, key=None):
+		"""
+		Returns the encoded reply of a command, from the cache or made by encode
+
+		Params:
+		command: name of the socket command
+		encode: function without arguments that returns the encoded reply, called when it is not in the cache
+		key: other values the reply depends on, like config settings. The cached reply is only used when it was made
+		     with an equal key.
+		"""
+		entry = self.replies.get(command)
+		if entry is not None and entry[0] == key:
+			self.hits[command] += 1
+			return entry[1]
+		self.misses[command] += 1
+		data = encode()
+		self.replies[command] = (key, data)
+		return data
+
+	def invalidate(self, *commands):
+		for command in commands:
+			if self.replies.pop(command, None) is not None:
+				self.invalidations[command] += 1
+
+	def lineChanged(self, messageType):
+		"""
+		Invalidates the replies made from the state of a serial line type
+		"""
+		self.invalidate(*commandsForLine[messageType])
+
+	def stats(self):
+		result = {}
+		for command in set(self.hits) | set(self.misses):
+			hits = self.hits[command]
+			misses = self.misses[command]
+			result[command] = dict(hits=hits, misses=misses, invalidations=self.invalidations[command],
+			                       hitRate=float(hits) / (hits + misses))
+		return result
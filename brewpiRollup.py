@@ -0,0 +1,322 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import struct
+import threading
+import time
+import brewpiStore
+
+# Rollups hold the minimum, maximum and mean of the temperatures per minute, hour and day for a complete beer.
+# Loading weeks of data for a chart only needs a few hundred records from one of these files,
+# instead of all raw samples from all daily files.
+rollupExtension = '.bpr'
+resolutions = (60, 3600, 86400)
+resolutionNames = {60: 'minutes', 3600: 'hours', 86400: 'days'}
+
+headerFormat = '<4sHHI'  # magic, format version, record size, resolution in seconds
+headerSize = struct.calcsize(headerFormat)
+magic = 'BPR1'
+formatVersion = 2  # version 1 did not have the number of samples per field
+
+fields = brewpiStore.tempFields
+# bucket start (seconds since epoch), number of samples, min, max, mean for each field, last state, padding,
+# number of samples that had a value for each field
+recordFormat = '<dI' + 'fff' * len(fields) + 'B3x' + 'I' * len(fields)
+recordSize = struct.calcsize(recordFormat)
+recordStruct = struct.Struct(recordFormat)
+
+nan = float('nan')
+
+
+def rollupFileName(dataPath, beerName, resolution):
+	return os.path.join(dataPath, beerName + '-' + resolutionNames[resolution] + rollupExtension)
+
+
+class Bucket:
+	"""
+	Accumulates the samples of one time bucket
+	"""
+
+	def __init__(self, start):
+		self.start = start
+		self.count = 0
+		self.min = [None] * len(fields)
+		self.max = [None] * len(fields)
+		self.sum = [0.0] * len(fields)
+		self.n = [0] * len(fields)  # number of samples that had a value for the field
+		self.state = None
+
+	def add(self, row):
+		self.count += 1
+		for i, key in enumerate(fields):
+			v = row.get(key)
+			if v is None:
+				continue
+			v = float(v)
+			if self.n[i] == 0 or v < self.min[i]:
+				self.min[i] = v
+			if self.n[i] == 0 or v > self.max[i]:
+				self.max[i] = v
+			self.sum[i] += v
+			self.n[i] += 1
+		if row.get('State') is not None:
+			self.state = int(row['State'])
+
+	def pack(self):
+		values = [self.start, self.count]
+		for i in range(len(fields)):
+			if self.n[i]:
+				values += [self.min[i], self.max[i], self.sum[i] / self.n[i]]
+			else:
+				values += [nan, nan, nan]
+		values.append(brewpiStore.noState if self.state is None else self.state)
+		values += self.n
+		return recordStruct.pack(*values)
+
+	def row(self):
+		return unpackRecord(self.pack())
+
+
+def unpackRecord(data, offset=0):
+	"""
+	Unpacks a rollup record into a dict. Each temperature field holds a list [min, mean, max], or None.
+	"""
+	values = recordStruct.unpack_from(data, offset)
+	row = {'Time': values[0], 'count': values[1]}
+	for i, key in enumerate(fields):
+		low, high, mean = values[2 + 3 * i: 5 + 3 * i]
+		if mean != mean:  # NaN, no values in this bucket
+			row[key] = None
+		else:
+			d = brewpiStore.tempDecimals
+			row[key] = [round(low, d), round(mean, d), round(high, d)]
+	state = values[2 + 3 * len(fields)]
+	row['State'] = None if state == brewpiStore.noState else state
+	return row
+
+
+def unpackFieldCounts(data, offset=0):
+	"""
+	Returns the number of samples that had a value, for each field of a rollup record
+	"""
+	return list(recordStruct.unpack_from(data, offset)[-len(fields):])
+
+
+class RollupTier:
+	"""
+	Rollup file for one resolution. Finished buckets are appended to the file.
+	The bucket in progress is written when the tier is flushed and rewritten in place when it receives more samples.
+	"""
+
+	def __init__(self, fileName, resolution):
+		self.fileName = fileName
+		self.resolution = resolution
+		self.bucket = None
+		self.bucketWritten = False  # True when the current bucket is the last record in the file
+		self.lastRow = None
+		self.lastCounts = None
+		if os.path.exists(fileName) and os.path.getsize(fileName) >= headerSize and not isCurrentFormat(fileName):
+			os.rename(fileName, fileName + '.v1')  # keep the rollups in the old format, start a new file
+		if os.path.exists(fileName) and os.path.getsize(fileName) >= headerSize:
+			self.count = recordCount(fileName)
+			if self.count:
+				# resume the last bucket, it might not have been complete when it was written
+				with open(fileName, 'rb') as f:
+					f.seek(headerSize + (self.count - 1) * recordSize)
+					record = f.read(recordSize)
+				self.lastRow = unpackRecord(record)
+				self.lastCounts = unpackFieldCounts(record)
+		else:
+			f = open(fileName, 'wb')
+			f.write(struct.pack(headerFormat, magic, formatVersion, recordSize, resolution))
+			f.close()
+			self.count = 0
+
+	def bucketStart(self, timestamp):
+		# buckets are aligned to local time, so day buckets start at midnight
+		offset = -time.altzone if time.localtime(timestamp).tm_isdst > 0 else -time.timezone
+		return (timestamp + offset) // self.resolution * self.resolution - offset
+
+	def add(self, row, timestamp):
+		start = self.bucketStart(timestamp)
+		if self.bucket is None or start != self.bucket.start:
+			if self.bucket is not None:
+				self.writeBucket()
+			self.bucket = Bucket(start)
+			self.bucketWritten = False
+			if self.lastRow is not None and self.lastRow['Time'] == start:
+				self.resumeBucket(self.lastRow, self.lastCounts)
+				self.bucketWritten = True
+			self.lastRow = None
+			self.lastCounts = None
+		self.bucket.add(row)
+
+	def resumeBucket(self, lastRow, counts):
+		b = self.bucket
+		b.count = lastRow['count']
+		b.state = lastRow['State']
+		for i, key in enumerate(fields):
+			if lastRow[key] is not None and counts[i]:
+				low, mean, high = lastRow[key]
+				b.min[i] = low
+				b.max[i] = high
+				b.n[i] = counts[i]
+				b.sum[i] = mean * counts[i]
+
+	def writeBucket(self):
+		f = open(self.fileName, 'r+b')
+		if self.bucketWritten:
+			f.seek(headerSize + (self.count - 1) * recordSize)
+		else:
+			f.seek(headerSize + self.count * recordSize)
+			self.count += 1
+		f.write(self.bucket.pack())
+		f.truncate()  # drop an incomplete record after a crash
+		f.close()
+		self.bucketWritten = True
+
+	def flush(self):
+		if self.bucket is not None:
+			self.writeBucket()
+
+
+def isCurrentFormat(fileName):
+	with open(fileName, 'rb') as f:
+		fileMagic, version, size, resolution = struct.unpack(headerFormat, f.read(headerSize))
+	return fileMagic == magic and version == formatVersion and size == recordSize
+
+
+def recordCount(fileName):
+	return max(0, (os.path.getsize(fileName) - headerSize) // recordSize)
+
+
+def readRange(fileName, start, end):
+	"""
+	Reads the records of a rollup file with a bucket start between start and end.
+	Records are sorted by time, so the first record is found with a binary search and only the needed slice is read.
+	"""
+	if not os.path.exists(fileName):
+		return []
+	rows = []
+	with open(fileName, 'rb') as f:
+		fileMagic, version, size, resolution = struct.unpack(headerFormat, f.read(headerSize))
+		if fileMagic != magic or size != recordSize:
+			raise IOError("%s is not a BrewPi rollup file" % fileName)
+		count = recordCount(fileName)
+
+		def timeAt(index):
+			f.seek(headerSize + index * recordSize)
+			return struct.unpack('<d', f.read(8))[0]
+
+		low, high = 0, count
+		while low < high:
+			mid = (low + high) // 2
+			if timeAt(mid) + resolution <= start:  # bucket ends before the start of the range
+				low = mid + 1
+			else:
+				high = mid
+		f.seek(headerSize + low * recordSize)
+		while low < count:
+			data = f.read(min(count - low, 1024) * recordSize)
+			for offset in xrange(0, len(data) - recordSize + 1, recordSize):
+				row = unpackRecord(data, offset)
+				if row['Time'] > end:
+					return rows
+				rows.append(row)
+			low += len(data) // recordSize
+	return rows
+
+
+def chooseResolution(start, end, maxPoints):
+	"""
+	Returns the finest resolution that returns no more than maxPoints buckets for the time range.
+	When no resolution is coarse enough, the coarsest one is returned.
+	"""
+	for resolution in resolutions:
+		if (end - start) / float(resolution) <= maxPoints:
+			return resolution
+	return resolutions[-1]
+
+
+def query(dataPath, beerName, start, end, maxPoints=500):
+	"""
+	Reads rollups of a beer for a time range, from the tier that fits the point budget.
+
+	Params:
+	dataPath: data directory of the beer
+	beerName: name of the beer
+	start, end: time range in seconds since epoch
+	maxPoints: maximum number of buckets to return
+
+	Returns:
+	dict with the chosen resolution in seconds and the rows
+	"""
+	resolution = chooseResolution(start, end, maxPoints)
+	return dict(resolution=resolution, rows=readRange(rollupFileName(dataPath, beerName, resolution), start, end))
+
+
+class Rollups:
+	"""
+	Maintains all rollup tiers of a beer while samples arrive
+	"""
+
+	def __init__(self, dataPath, beerName):
+		self.dataPath = dataPath
+		self.beerName = beerName
+		self.lock = threading.Lock()  # samples are added in the log writer thread, queries come from the socket
+		self.tiers = [RollupTier(rollupFileName(dataPath, beerName, r), r) for r in resolutions]
+
+	def add(self, row, timestamp):
+		with self.lock:
+			for tier in self.tiers:
+				tier.add(row, timestamp)
+
+	def replay(self, rows, timestamps):
+		"""
+		Adds samples that are replayed from the journal after a crash. A bucket that was written before the journal
+		received samples for a later bucket is complete, so samples in it are not added again.
+		"""
+		with self.lock:
+			for tier in self.tiers:
+				written = tier.lastRow['Time'] if tier.lastRow is not None else None
+				starts = [tier.bucketStart(timestamp) for timestamp in timestamps]
+				for row, timestamp, start in zip(rows, timestamps, starts):
+					if written is not None and (start < written or (start == written and starts[-1] > written)):
+						continue
+					tier.add(row, timestamp)
+
+	def flush(self):
+		"""
+		Writes the buckets in progress, so the files are complete up to the last sample
+		"""
+		with self.lock:
+			for tier in self.tiers:
+				tier.flush()
+
+	def query(self, start, end, maxPoints=500):
+		"""
+		Same as the module level query function, but includes the bucket that is still in progress
+		"""
+		with self.lock:
+			result = query(self.dataPath, self.beerName, start, end, maxPoints)
+			tier = self.tiers[resolutions.index(result['resolution'])]
+			if tier.bucket is not None and start - tier.resolution < tier.bucket.start <= end:
+				rows = result['rows']
+				if rows and rows[-1]['Time'] == tier.bucket.start:
+					rows.pop()  # replace the written version of the bucket with the current one
+				rows.append(tier.bucket.row())
+		return result
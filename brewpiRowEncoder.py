@@ -0,0 +1,129 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import simplejson as json
+import BrewPiUtil as util
+
+# Formats a logged sample for all output files in one pass, with a single conversion of the timestamp.
+# The output is the same as the DataTable rows written by brewpiJson and the lines of the CSV file.
+
+# Column order of the DataTable rows. Numbers are written as numbers, except RoomTemp and State,
+# which have always been written as strings. The web interface relies on that.
+jsonTemplate = ('{"c":[{"v":"Date(%d,%d,%d,%d,%d,%d)"},' +
+                ','.join(['%s'] * 8) + ']}')
+csvTemplate = ';'.join(['%s'] * 9) + '\n'
+ndjsonTemplate = ('{"Time":%.3f,"BeerTemp":%s,"BeerSet":%s,"BeerAnn":%s,"FridgeTemp":%s,"FridgeSet":%s,' +
+                  '"FridgeAnn":%s,"RoomTemp":%s,"State":%s}\n')
+csvTimeFormat = "%b %d %Y %H:%M:%S"
+
+
+def jsonString(v):
+	""" Annotations are free text, so they are escaped. They are rare, so this does not need to be fast """
+	return 'null' if v is None else '{"v":' + json.dumps(str(v)) + '}'
+
+
+def plainString(v):
+	return 'null' if v is None else json.dumps(str(v))
+
+
+def jsonRow(row, tm):
+	"""
+	Formats a row as DataTable JSON row
+
+	Params:
+	row: dict with the sample values
+	tm: time.struct_time of the sample in local time
+	"""
+	beerTemp, beerSet, beerAnn, fridgeTemp, fridgeSet, fridgeAnn, roomTemp, state = \
+		row['BeerTemp'], row['BeerSet'], row['BeerAnn'], row['FridgeTemp'], row['FridgeSet'], row['FridgeAnn'], \
+		row['RoomTemp'], row['State']
+	return jsonTemplate % (
+		tm[0], tm[1] - 1, tm[2], tm[3], tm[4], tm[5],
+		'null' if beerTemp is None else '{"v":%s}' % beerTemp,
+		'null' if beerSet is None else '{"v":%s}' % beerSet,
+		'null' if beerAnn is None else jsonString(beerAnn),
+		'null' if fridgeTemp is None else '{"v":%s}' % fridgeTemp,
+		'null' if fridgeSet is None else '{"v":%s}' % fridgeSet,
+		'null' if fridgeAnn is None else jsonString(fridgeAnn),
+		'null' if roomTemp is None else '{"v":"%s"}' % roomTemp,
+		'null' if state is None else '{"v":"%s"}' % state)
+
+
+def csvRow(row, tm):
+	"""
+	Formats a row as a line for the semicolon separated CSV file
+	"""
+	return csvTemplate % (time.strftime(csvTimeFormat, tm), row['BeerTemp'], row['BeerSet'], row['BeerAnn'],
+	                      row['FridgeTemp'], row['FridgeSet'], row['FridgeAnn'], row['State'], row['RoomTemp'])
+
+
+def ndjsonRow(row, timestamp):
+	"""
+	Formats a row as a line of newline delimited JSON, with the time in seconds since epoch
+	"""
+	beerTemp, beerSet, beerAnn, fridgeTemp, fridgeSet, fridgeAnn, roomTemp, state = \
+		row['BeerTemp'], row['BeerSet'], row['BeerAnn'], row['FridgeTemp'], row['FridgeSet'], row['FridgeAnn'], \
+		row['RoomTemp'], row['State']
+	return ndjsonTemplate % (
+		timestamp,
+		'null' if beerTemp is None else beerTemp,
+		'null' if beerSet is None else beerSet,
+		'null' if beerAnn is None else plainString(beerAnn),
+		'null' if fridgeTemp is None else fridgeTemp,
+		'null' if fridgeSet is None else fridgeSet,
+		'null' if fridgeAnn is None else plainString(fridgeAnn),
+		'null' if roomTemp is None else roomTemp,
+		'null' if state is None else state)
+
+
+def encodeRow(row, timestamp, ndjson=True):
+	"""
+	Formats a sample for all output files
+
+	Params:
+	row: dict with the sample values, with the keys used by brewpiJson.addRow
+	timestamp: time of the sample in seconds since epoch
+	ndjson: False when no NDJSON file is written, the NDJSON line is None then
+
+	Returns:
+	tuple of the DataTable JSON row, the CSV line and the NDJSON line
+	"""
+	tm = time.localtime(timestamp)
+	return jsonRow(row, tm), csvRow(row, tm), ndjsonRow(row, timestamp) if ndjson else None
+
+
+def encodeRows(rows, timestamps, ndjson=True):
+	"""
+	Formats a batch of samples for all output files. Each output can be written with a single write.
+	Rows with missing keys are logged and left out.
+
+	Returns:
+	tuple of a list of DataTable JSON rows, the CSV text and the NDJSON text (None when ndjson is False)
+	"""
+	jsonRows = []
+	csvLines = []
+	ndjsonLines = []
+	for row, timestamp in zip(rows, timestamps):
+		try:
+			j, c, n = encodeRow(row, timestamp, ndjson)
+		except KeyError, e:
+			util.logMessage("KeyError in line from Arduino: %s" % str(e))
+			continue
+		jsonRows.append(j)
+		csvLines.append(c)
+		ndjsonLines.append(n)
+	return jsonRows, ''.join(csvLines), ''.join(ndjsonLines) if ndjson else None
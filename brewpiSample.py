@@ -0,0 +1,152 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import simplejson as json
+
+# Decoder for the temperature lines of the Arduino: T:{"bt":19.02,"bs":19.0,"ba":null,"ft":18.91,...}
+# The line is parsed by the C scanner of simplejson, without the checks and wrappers of json.loads, and the known
+# keys are copied into a TempSample with a fixed set of fields. Fields that are not in a line keep their value
+# of the previous line, as the row dict of the data log always did.
+# Lines with other keys, like the long key names of old Arduino versions, take the generic path. Keys that are not
+# sample fields are only kept for the line they were in, so the next line with known keys takes the fast path again.
+
+sampleFields = ('BeerTemp', 'BeerSet', 'BeerAnn', 'FridgeTemp', 'FridgeSet', 'FridgeAnn', 'RoomTemp', 'State', 'Time')
+
+renameTempKeys = {"bt": "BeerTemp", "bs": "BeerSet", "ba": "BeerAnn", "ft": "FridgeTemp", "fs": "FridgeSet",
+                  "fa": "FridgeAnn", "rt": "RoomTemp", "s": "State", "t": "Time"}
+
+shortKeys = frozenset(key for key, field in renameTempKeys.items() if field in sampleFields)
+
+
+class TempSample(object):
+	"""
+	Values of a temperature sample. Can be read like the row dict of the data log: sample['BeerTemp'].
+
+	changed is a tuple with the names of the fields that differ from the previous sample, found when it is read.
+	Time is the time the Arduino sent with the sample ("t"), None when it sends none.
+	extra holds the keys of the Arduino that are not sample fields, None when there are none.
+	"""
+	__slots__ = sampleFields + ('extra', 'previous')
+
+	def __init__(self, BeerTemp=0, BeerSet=0, BeerAnn=None, FridgeTemp=0, FridgeSet=0, FridgeAnn=None,
+	             RoomTemp=None, State=None, Time=None, extra=None):
+		self.BeerTemp = BeerTemp
+		self.BeerSet = BeerSet
+		self.BeerAnn = BeerAnn
+		self.FridgeTemp = FridgeTemp
+		self.FridgeSet = FridgeSet
+		self.FridgeAnn = FridgeAnn
+		self.RoomTemp = RoomTemp
+		self.State = State
+		self.Time = Time
+		self.extra = extra
+		self.previous = None  # values of the previous sample
+
+	def __repr__(self):
+		return 'TempSample(%r)' % self.asDict()
+
+	def __getitem__(self, key):
+		if key in sampleFields:
+			return getattr(self, key)
+		if self.extra is not None and key in self.extra:
+			return self.extra[key]
+		raise KeyError(key)
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	@property
+	def changed(self):
+		if self.previous is None:
+			return ()
+		return tuple(field for field, a, b in zip(sampleFields, self.values(), self.previous) if a != b)
+
+	def values(self):
+		return (self.BeerTemp, self.BeerSet, self.BeerAnn, self.FridgeTemp, self.FridgeSet, self.FridgeAnn,
+		        self.RoomTemp, self.State, self.Time)
+
+	def copy(self):
+		return TempSample(*self.values(), extra=dict(self.extra) if self.extra is not None else None)
+
+	def asDict(self):
+		"""
+		Returns the row dict for the data log writer. Time is only in it when the Arduino sent it.
+		"""
+		row = dict(BeerTemp=self.BeerTemp, BeerSet=self.BeerSet, BeerAnn=self.BeerAnn, FridgeTemp=self.FridgeTemp,
+		           FridgeSet=self.FridgeSet, FridgeAnn=self.FridgeAnn, RoomTemp=self.RoomTemp, State=self.State)
+		if self.Time is not None:
+			row['Time'] = self.Time
+		if self.extra is not None:
+			row.update(self.extra)
+		return row
+
+
+class TempDecoder:
+	"""
+	Decodes the data of temperature lines into TempSamples. Keeps the last sample, to fill in missing fields and
+	to find the fields that changed.
+	"""
+
+	def __init__(self):
+		self.scan = json.JSONDecoder().scan_once
+		self.sample = TempSample()
+		self.fastLines = 0
+		self.genericLines = 0
+
+	def decode(self, data):
+		"""
+		Returns the TempSample for the data of a 'T' line, which becomes the last sample.
+		Raises json.JSONDecodeError for invalid data, like json.loads.
+		"""
+		try:
+			values, end = self.scan(data, 0)
+		except StopIteration:
+			raise json.JSONDecodeError("Expecting value", data, 0)
+		if end != len(data) and data[end:].strip():
+			raise json.JSONDecodeError("Extra data", data, end)
+		if not isinstance(values, dict):
+			raise json.JSONDecodeError("Expecting object", data, 0)
+		prev = self.sample
+		if values.viewkeys() <= shortKeys:
+			self.fastLines += 1
+			if len(values) == 8 and 't' not in values:  # all fields, as sent by the current Arduino versions
+				sample = TempSample(values['bt'], values['bs'], values['ba'], values['ft'], values['fs'],
+				                    values['fa'], values['rt'], values['s'], prev.Time)
+			else:
+				get = values.get
+				sample = TempSample(get('bt', prev.BeerTemp), get('bs', prev.BeerSet), get('ba', prev.BeerAnn),
+				                    get('ft', prev.FridgeTemp), get('fs', prev.FridgeSet), get('fa', prev.FridgeAnn),
+				                    get('rt', prev.RoomTemp), get('s', prev.State), get('t', prev.Time))
+		else:
+			self.genericLines += 1
+			sample = TempSample(*prev.values())  # the extra keys of the previous line are not carried forward
+			for key, value in values.iteritems():
+				field = renameTempKeys.get(key, key)
+				if field in sampleFields:
+					setattr(sample, field, value)
+				else:
+					if sample.extra is None:
+						sample.extra = {}
+					sample.extra[field] = value
+		sample.previous = prev.values()
+		self.sample = sample
+		return sample
+
+	def stats(self):
+		return dict(fast=self.fastLines, generic=self.genericLines)
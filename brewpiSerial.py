@@ -0,0 +1,541 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import io
+import threading
+import time
+import traceback
+import serial
+import simplejson as json
+import brewpiCapture
+import BrewPiUtil as util
+
+# Lines from the Arduino start with a character for the message type, followed by ':' and the data.
+# The reader thread reads them as soon as they arrive and calls the handler registered for the message type.
+
+
+class MessageDispatcher:
+	"""
+	Table of handlers for the lines received from the Arduino, keyed by message type.
+	Handlers are called with the data of the line, the part after the 'T:' prefix.
+	"""
+
+	def __init__(self, lock=None):
+		"""
+		Params:
+		lock: lock that is held while a handler runs, when other threads use the state that the handlers change
+		"""
+		self.lock = lock
+		self.handlers = {}
+		self.listeners = []  # called with the message type of every dispatched line
+		# number of lines dispatched per message type, only updated by the thread that reads the port
+		self.counts = collections.defaultdict(int)
+		self.errors = collections.defaultdict(int)  # number of lines per message type that the handler failed on
+
+	def register(self, messageType, handler):
+		"""
+		Registers the handler for a message type, replacing the previous handler
+
+		Params:
+		messageType: first character of the line
+		handler: function that takes the data of the line as argument
+		"""
+		self.handlers[messageType] = handler
+
+	def unregister(self, messageType):
+		self.handlers.pop(messageType, None)
+
+	def addListener(self, listener):
+		"""
+		Adds a function that is called with the message type of every line, before the handler
+		"""
+		self.listeners.append(listener)
+
+	def dispatch(self, line):
+		"""
+		Calls the handler for a line. Errors in the data are logged, they do not stop the reader.
+		"""
+		messageType = line[:1]
+		handler = self.handlers.get(messageType)
+		if handler is None:
+			if line:
+				util.logMessage("Cannot process line from Arduino: " + line)
+			return
+		self.call(handler, messageType, line[2:])
+
+	def call(self, handler, messageType, data):
+		"""
+		Calls the handler with the data of a line that was already split in message type and data.
+		An error in the handler is logged and counted, it does not stop reading the lines that follow.
+		LineFramer calls this directly for every line, with the handler it looked up itself.
+		"""
+		self.counts[messageType] += 1
+		if self.listeners:
+			for listener in self.listeners:
+				listener(messageType)
+		try:
+			if self.lock is None:
+				handler(data)
+			else:
+				with self.lock:
+					handler(data)
+		except json.decoder.JSONDecodeError, e:
+			self.errors[messageType] += 1
+			util.logMessage("JSON decode error: %s" % str(e))
+			util.logMessage("Line received was: %s:%s" % (messageType, data))
+		except UnicodeDecodeError as e:
+			self.errors[messageType] += 1
+			util.logMessage("Unicode decode error: %s" % str(e))
+			util.logMessage("Line received was: %s:%s" % (messageType, data))
+		except Exception:
+			self.errors[messageType] += 1
+			util.logMessage("Error handling line from Arduino:\n" + traceback.format_exc())
+			util.logMessage("Line received was: %s:%s" % (messageType, data))
+
+	def stats(self):
+		return dict(self.counts)
+
+	def errorStats(self):
+		return dict(self.errors)
+
+
+class LineFramer:
+	"""
+	Frames the bytes received from the Arduino into lines and dispatches the complete ones.
+	Used by the reader thread and by the event loop run mode, which reads the port when it is readable.
+
+	Received bytes are read straight into a bytearray that is reused for the whole session. Lines are found with
+	bytearray.find and only the data of a line is copied out of the buffer, as the string for the handler
+	(the JSON decoder does not take a bytearray or memoryview). The incomplete last line stays in the buffer.
+	"""
+
+	def __init__(self, dispatcher, size=4096):
+		self.dispatcher = dispatcher
+		self.buffer = bytearray(size)
+		self.start = 0  # start of the first line that is not dispatched yet
+		self.end = 0  # end of the received bytes
+		self.received = 0  # total number of bytes received
+		self.lines = 0
+		self.lastLineTime = None
+		self.port = None
+		self.portFile = None
+		self.capture = None  # brewpiCapture.SerialCapture attached to the port
+
+	def pending(self):
+		"""
+		Returns the bytes of the incomplete line that is waiting for the rest of its bytes
+		"""
+		return str(self.buffer[self.start:self.end])
+
+	def reserve(self, size):
+		"""
+		Makes room for size more bytes after the received bytes.
+		The incomplete line is moved to the start of the buffer, the buffer only grows for very long lines.
+		"""
+		if self.end + size <= len(self.buffer):
+			return
+		pendingSize = self.end - self.start
+		if self.start:
+			self.buffer[:pendingSize] = self.buffer[self.start:self.end]
+			self.start = 0
+			self.end = pendingSize
+		if pendingSize + size > len(self.buffer):
+			self.buffer.extend(bytearray(pendingSize + size - len(self.buffer)))
+
+	def feed(self, data):
+		"""
+		Adds received bytes and dispatches the lines they complete
+		"""
+		self.reserve(len(data))
+		self.buffer[self.end:self.end + len(data)] = data
+		self.received += len(data)
+		self.frame(self.end + len(data))
+
+	def readFrom(self, ser):
+		"""
+		Reads all bytes that are waiting on the serial port and dispatches the complete lines.
+		When nothing is waiting, this blocks until a byte arrives or the timeout of the port expires.
+		On POSIX the bytes are read from the file descriptor of the port directly into the buffer.
+		"""
+		waiting = ser.inWaiting()
+		if not waiting:
+			data = ser.read(1)
+			if data:
+				self.feed(data)
+			return
+		if ser is not self.port:
+			self.port = ser
+			self.capture = getattr(ser, 'capture', None)
+			try:
+				self.portFile = io.FileIO(ser.fileno(), 'r', closefd=False)
+			except (AttributeError, NotImplementedError, ValueError):
+				self.portFile = None  # no file descriptor, on Windows
+		if self.portFile is None:
+			self.feed(ser.read(waiting))
+			return
+		self.reserve(waiting)
+		count = self.portFile.readinto(memoryview(self.buffer)[self.end:self.end + waiting]) or 0
+		self.received += count
+		if self.capture is not None and count:
+			self.capture.record(brewpiCapture.fromArduino, str(self.buffer[self.end:self.end + count]))
+		self.frame(self.end + count)
+
+	def frame(self, end):
+		""" Dispatches the complete lines up to end """
+		buffer = self.buffer
+		find = buffer.find
+		newline = find('\n', self.end, end)
+		self.end = end
+		if newline < 0:
+			return
+		view = memoryview(buffer)
+		handlers = self.dispatcher.handlers
+		call = self.dispatcher.call
+		start = self.start
+		lines = 0
+		while newline >= 0:
+			lineEnd = newline - 1 if newline > start and buffer[newline - 1] == 13 else newline  # strip \r
+			if lineEnd > start:
+				lines += 1
+				messageType = view[start]
+				handler = handlers.get(messageType)
+				if handler is not None and lineEnd > start + 1:
+					call(handler, messageType, view[start + 2:lineEnd].tobytes())
+				else:
+					self.dispatcher.dispatch(view[start:lineEnd].tobytes())
+			start = newline + 1
+			newline = find('\n', start, end)
+		del view  # the buffer cannot be resized while a memoryview of it exists
+		self.start = start
+		self.lines += lines
+		self.lastLineTime = time.time()
+
+
+class SerialReader(threading.Thread):
+	"""
+	Reads the serial port in a background thread. Lines are framed as soon as their bytes arrive
+	and handed to the dispatcher, so received values are processed within milliseconds.
+	The framer keeps the line count and the time of the last line.
+	"""
+
+	def __init__(self, ser, dispatcher, onError=None):
+		"""
+		Params:
+		ser: open serial port. Its timeout determines how fast the reader notices that it is stopped.
+		dispatcher: MessageDispatcher that processes the received lines
+		onError: function that is called with the exception from the reader thread when reading the port failed,
+		         for example because the Arduino was unplugged. The reader has stopped when it is called.
+		"""
+		threading.Thread.__init__(self, name='SerialReader')
+		self.daemon = True
+		self.ser = ser
+		self.framer = LineFramer(dispatcher)
+		self.onError = onError
+		self.running = True
+
+	def stop(self, timeout=None):
+		"""
+		Stops the reader and waits for it, for example before the serial port is closed
+
+		Params:
+		timeout: seconds to wait at most, None to wait until the reader has stopped
+		"""
+		self.running = False
+		if self.isAlive() and threading.current_thread() is not self:
+			self.join(timeout)
+
+	def run(self):
+		try:
+			self.readLines()
+		except Exception:
+			brewpiCapture.saveCrashCaptures()  # sys.excepthook is not called for threads
+			raise
+
+	def readLines(self):
+		while self.running:
+			try:
+				# block until at least one byte arrives or the timeout expires, then take everything that is waiting
+				self.framer.readFrom(self.ser)
+			except (serial.SerialException, OSError, IOError), e:
+				if self.running:
+					util.logMessage("Error reading serial port, serial reader stopped: %s" % str(e))
+					if self.onError is not None:
+						self.onError(e)
+				return
+
+	def feed(self, data):
+		self.framer.feed(data)
+
+
+# boards with native USB do not reset when the serial port is opened, other boards start their bootloader
+nativeUsbBoards = ('leonardo', 'micro', 'esplora', 'yun')
+
+
+def resetsOnOpen(boardType):
+	"""
+	Returns True when the board resets when the serial port is opened, so it cannot answer right away
+	"""
+	return boardType.lower() not in nativeUsbBoards
+
+
+def requestVersion(ser, quietTime=0.0, timeout=12.0, firstInterval=0.1, maxInterval=1.0):
+	"""
+	Startup handshake: requests the version with 'n' until the 'N' line is received.
+	Requests are repeated at short intervals that double up to maxInterval, so an Arduino that is already running
+	answers within a fraction of a second.
+
+	A board that resets when the port is opened should not receive data while its bootloader runs. For those boards,
+	nothing is written for quietTime seconds, unless the Arduino starts sending before that.
+
+	Params:
+	ser: open serial port with a short read timeout
+	quietTime: maximum seconds to wait for a resetting board before the first request
+	timeout: seconds to keep requesting after the quiet time
+
+	Returns:
+	(data of the 'N' line or None when no version was received, seconds the handshake took)
+	"""
+	start = time.time()
+	buffer = ''
+	nextRequest = start + quietTime
+	interval = firstInterval
+	receivedData = False
+	while True:
+		now = time.time()
+		if now >= nextRequest:
+			if now - start >= quietTime + timeout:
+				return None, now - start
+			ser.write('n')
+			nextRequest = now + interval
+			interval = min(interval * 2, maxInterval)
+		data = ser.read(ser.inWaiting() or 1)
+		if not data:
+			continue
+		if not receivedData:
+			receivedData = True
+			nextRequest = min(nextRequest, time.time())  # the Arduino is running, no need to wait any longer
+		buffer += data
+		lines = buffer.split('\n')
+		buffer = lines.pop()
+		for line in lines:
+			if line.startswith('N:'):
+				return line.rstrip('\r')[2:], time.time() - start
+
+
+class DemandPoller:
+	"""
+	Decides which periodic requests are sent to the Arduino in a serial pass.
+	A request is sent every pass while a client asked for its data in the last activeSeconds seconds.
+	Otherwise it is only sent every idleInterval seconds, to keep the data reasonably up to date.
+	"""
+
+	def __init__(self, activeSeconds=30.0, idleInterval=10.0):
+		self.activeSeconds = activeSeconds
+		self.idleInterval = idleInterval
+		self.lastDemand = {}  # request character to the time a client last asked for its data
+		self.lastSent = {}
+		self.sent = collections.defaultdict(int)
+		self.avoided = collections.defaultdict(int)
+
+	def isActive(self, request, now=None):
+		if now is None:
+			now = time.time()
+		return now - self.lastDemand.get(request, float('-inf')) < self.activeSeconds
+
+	def demand(self, request, now=None):
+		"""
+		Records that a client asked for the data of a request
+
+		Returns:
+		True when the request was idle, so the data the client received might be old
+		"""
+		if now is None:
+			now = time.time()
+		wasActive = self.isActive(request, now)
+		self.lastDemand[request] = now
+		return not wasActive
+
+	def due(self, request, now=None):
+		"""
+		Returns True when the request should be sent in this pass, and counts the sent and avoided requests
+		"""
+		if now is None:
+			now = time.time()
+		if self.isActive(request, now) or now - self.lastSent.get(request, float('-inf')) >= self.idleInterval:
+			self.lastSent[request] = now
+			self.sent[request] += 1
+			return True
+		self.avoided[request] += 1
+		return False
+
+	def stats(self):
+		return dict(sent=dict(self.sent), avoided=dict(self.avoided),
+		            active=[request for request in sorted(self.lastDemand) if self.isActive(request)])
+
+
+# message type of the reply the Arduino sends for a request. Commands that are not listed get no reply.
+replyTypes = {'l': 'L', 's': 'S', 'c': 'C', 'v': 'V', 't': 'T', 'n': 'N', 'd': 'd', 'h': 'h', 'U': 'U'}
+# single character requests and requests for the device lists, a second one in the queue would get the same answer
+# when no command that changes the Arduino is queued between them
+coalescedRequests = ('l', 's', 'c', 'v', 't', 'n', 'S', 'C', 'd', 'h')
+# requests that only read from the Arduino, a request can be merged with an equal one queued before these
+readRequests = ('l', 's', 'c', 'v', 't', 'n', 'd', 'h')
+
+
+def settingPairs(command):
+	"""
+	Splits the data of a 'j' command in its key:value pairs. Works for JSON ('j{"mode":"b"}') and for the
+	shorter form without quotes that the script writes ('j{mode:b, beerSet:20.0}').
+
+	Returns:
+	list of (key, pair text) tuples, in the order of the command
+	"""
+	pairs = []
+	for pair in command[1:].strip().lstrip('{').rstrip('}').split(','):
+		if ':' not in pair:
+			continue
+		key = pair.split(':', 1)[0].strip().strip('"\'')
+		pairs.append((key, pair.strip()))
+	return pairs
+
+
+class CommandStats:
+	""" Round trip times of a request type, from the write until the reply was received """
+
+	def __init__(self, window=100):
+		self.sent = 0
+		self.replies = 0
+		self.timeouts = 0
+		self.coalesced = 0
+		self.maxRtt = 0.0
+		self.recent = collections.deque(maxlen=window)
+
+	def addRtt(self, rtt):
+		self.replies += 1
+		self.maxRtt = max(self.maxRtt, rtt)
+		self.recent.append(rtt)
+
+	def toDict(self):
+		recent = sorted(self.recent)
+		result = dict(sent=self.sent, replies=self.replies, timeouts=self.timeouts, coalesced=self.coalesced,
+		              maxRtt=self.maxRtt, p50Rtt=None, p99Rtt=None)
+		if recent:
+			result['p50Rtt'] = recent[len(recent) // 2]
+			result['p99Rtt'] = recent[min(len(recent) - 1, int(len(recent) * 0.99))]
+		return result
+
+
+class CommandQueue:
+	"""
+	Outbound queue for the commands to the Arduino. All queued commands are written with one write when the queue is
+	flushed, once per serial pass. Redundant commands are merged while they wait:
+	- a request that is already queued is not queued again, for example five 's' become one. Only when nothing but
+	  read requests was queued after it: a request after a changing command should see the change.
+	- settings ('j' commands) are merged into the last queued command when it is a 'j' command. For keys that occur
+	  more than once, the last value is kept, so successive setBeer messages only send the last temperature.
+	The Arduino receives the commands in the order they were queued, so merging never moves a command past another.
+	Other commands, like device updates ('U'), are sent as they are.
+
+	Requests that get a reply are tracked until the reply arrives, to measure the round trip time per request.
+	Requests without a reply after timeout seconds are counted as timed out.
+	"""
+
+	def __init__(self, timeout=5.0):
+		self.timeout = timeout
+		self.lock = threading.Lock()  # commands are queued by the main loop, replies arrive in the reader thread
+		self.queue = []  # commands waiting for the next flush
+		self.pending = collections.defaultdict(collections.deque)  # reply type to (request, write time)
+		self.stats = collections.defaultdict(CommandStats)  # per request: first character of the command
+		self.writes = 0
+		self.bytesWritten = 0
+
+	def put(self, command):
+		"""
+		Queues a command for the next flush
+		"""
+		if not command:
+			return
+		with self.lock:
+			request = command[0]
+			if request in coalescedRequests:
+				for queued in reversed(self.queue):
+					if queued == command:
+						self.stats[request].coalesced += 1
+						return
+					if queued[0] not in readRequests:
+						break
+			if request == 'j' and self.queue and self.queue[-1][0] == 'j':
+				queued = self.queue[-1]
+				merged = dict(settingPairs(queued))
+				keys = [key for key, pair in settingPairs(queued)]
+				for key, pair in settingPairs(command):
+					if key not in merged:
+						keys.append(key)
+					merged[key] = pair
+				self.queue[-1] = 'j{' + ', '.join(merged[key] for key in keys) + '}'
+				self.stats[request].coalesced += 1
+				return
+			self.queue.append(command)
+
+	def flush(self, ser):
+		"""
+		Writes all queued commands to the serial port with one write and starts tracking their replies
+		"""
+		with self.lock:
+			if not self.queue:
+				return
+			commands = self.queue
+			self.queue = []
+			now = time.time()
+			for command in commands:
+				request = command[0]
+				self.stats[request].sent += 1
+				if request in replyTypes:
+					self.pending[replyTypes[request]].append((request, now))
+		data = ''.join(commands)
+		ser.write(data)
+		self.writes += 1
+		self.bytesWritten += len(data)
+
+	def reply(self, messageType):
+		"""
+		Matches a line received from the Arduino with the oldest request that waits for that type of reply.
+		Registered as listener of the MessageDispatcher.
+		"""
+		with self.lock:
+			pending = self.pending.get(messageType)
+			if pending:
+				request, sent = pending.popleft()
+				self.stats[request].addRtt(time.time() - sent)
+
+	def expire(self, now=None):
+		"""
+		Stops waiting for the replies to requests that are older than the timeout
+		"""
+		if now is None:
+			now = time.time()
+		with self.lock:
+			for pending in self.pending.values():
+				while pending and now - pending[0][1] > self.timeout:
+					request, sent = pending.popleft()
+					self.stats[request].timeouts += 1
+
+	def getStats(self):
+		with self.lock:
+			return dict(writes=self.writes, bytesWritten=self.bytesWritten, queued=len(self.queue),
+			            pending=sum(len(p) for p in self.pending.values()),
+			            commands=dict((request, stats.toDict()) for request, stats in self.stats.items()))
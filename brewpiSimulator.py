@@ -0,0 +1,255 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+# A simulated BrewPi Arduino behind a pseudo-terminal, for testing and benchmarking the script without hardware.
+# It answers the same serial commands as the Arduino firmware with the same line protocol.
+# Linux only, the pseudo-terminal is created with the pty module.
+#
+# Usage: python brewpiSimulator.py [--rate <temperature lines per second>] [--delay <reply delay in seconds>]
+# Then set port = <the printed device> in config.cfg and start brewpi.py.
+
+import getopt
+import os
+import pty
+import select
+import sys
+import threading
+import time
+import tty
+import simplejson as json
+import expandLogMessage
+import brewpiSerial
+
+logIds = {}  # log key from LogMessages.h to (log type, ID)
+for logType, messages in [('E', expandLogMessage.errorDict), ('W', expandLogMessage.warningDict),
+                          ('I', expandLogMessage.infoDict)]:
+	for logId, message in messages.items():
+		logIds[message['logKey']] = (logType, logId)
+
+defaultSettings = dict(mode='b', beerSet=20.0, fridgeSet=20.0, heatEst=0.2, coolEst=5.0)
+defaultConstants = dict(tempFormat='C', tempSetMin=1.0, tempSetMax=30.0, pidMax=10.0, Kp=20.0, Ki=0.6, Kd=-3.0,
+                        iMaxErr=0.5, idleRangeH=1.0, idleRangeL=-1.0, heatTargetH=0.301, heatTargetL=-0.199,
+                        coolTargetH=0.199, coolTargetL=-0.301, maxHeatTimeForEst='600', maxCoolTimeForEst='1200',
+                        fridgeFastFilt='1', fridgeSlowFilt='4', fridgeSlopeFilt='3', beerFastFilt='3',
+                        beerSlowFilt='5', beerSlopeFilt='4', lah=0, hs=0)
+variables = dict(beerDiff=0.0, diffIntegral=0.0, beerSlope=0.0, p=0.0, i=0.0, d=0.0, estPeak=0.0,
+                 negPeakEst=0.0, posPeakEst=0.0, negPeak=0.0, posPeak=0.0)
+installedDevices = [dict(c=1, b=0, f=9, h=2, p=5, x=0, d=0, a='28FF93A344160418', i=0, t=1),
+                    dict(c=1, b=0, f=5, h=2, p=5, x=0, d=0, a='2891B3A344160467', i=1, t=1),
+                    dict(c=1, b=0, f=2, h=1, p=6, x=1, d=0, i=2, t=2),
+                    dict(c=1, b=0, f=3, h=1, p=7, x=1, d=0, i=3, t=2)]
+availableDevices = [dict(c=0, b=0, f=0, h=1, p=8, x=1, d=0, t=3)]
+modeNames = {'b': 'Beer Constant', 'f': 'Fridge Constant', 'p': 'Beer Profile', 'o': 'Off'}
+commandsWithData = 'jdhU'  # commands followed by JSON data between braces
+
+
+class FakeArduino:
+	"""
+	Simulated Arduino on the master side of a pseudo-terminal.
+	The script opens the slave side (portName) as if it were the serial port of the Arduino.
+	"""
+
+	def __init__(self, version='0.2.3', board='s', shield=2, rate=0.0, delay=0.0, bootTime=0.0):
+		"""
+		Params:
+		version: BrewPi version reported in the 'N' line
+		board: board character, see brewpiVersion.AvrInfo.boards
+		shield: shield number, see brewpiVersion.AvrInfo.shields
+		rate: temperature lines per second that are sent without request, 0 to only send them on request
+		delay: seconds to wait before each reply, to simulate a slow controller
+		bootTime: seconds after start during which received commands are ignored, like a board that just reset
+		"""
+		self.version = version
+		self.board = board
+		self.shield = shield
+		self.rate = rate
+		self.delay = delay
+		self.bootTime = bootTime
+		self.startTime = None
+		self.settings = dict(defaultSettings)
+		self.constants = dict(defaultConstants)
+		self.beerTemp = 19.0
+		self.fridgeTemp = 18.0
+		self.state = 0
+		self.commands = 0
+		self.linesSent = 0
+		self.buffer = ''
+		self.running = False
+		self.thread = None
+		self.master, self.slave = pty.openpty()
+		tty.setraw(self.slave)  # no echo and no line editing, the bytes pass unchanged
+		self.portName = os.ttyname(self.slave)
+
+	def start(self):
+		self.startTime = time.time()
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name='FakeArduino')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join()
+		os.close(self.master)
+		os.close(self.slave)
+
+	def run(self):
+		nextTemperature = time.time()
+		while self.running:
+			timeout = 0.1
+			if self.rate:
+				timeout = max(0, min(timeout, nextTemperature - time.time()))
+			if select.select([self.master], [], [], timeout)[0]:
+				try:
+					data = os.read(self.master, 4096)
+				except OSError:
+					return  # slave side closed
+				if time.time() - self.startTime >= self.bootTime:
+					self.feed(data)
+			if self.rate and time.time() >= nextTemperature and time.time() - self.startTime >= self.bootTime:
+				self.send('T', self.temperatures())
+				nextTemperature += 1.0 / self.rate
+				if nextTemperature < time.time() - 1:
+					nextTemperature = time.time()  # cannot keep up, do not send a burst
+
+	def feed(self, data):
+		"""
+		Splits received bytes into commands and answers each complete command
+		"""
+		self.buffer += data
+		while self.buffer:
+			command = self.buffer[0]
+			if command in ' \r\n':
+				self.buffer = self.buffer[1:]
+				continue
+			if command in commandsWithData:
+				end = self.buffer.find('}')
+				if end < 0:
+					return  # wait for the rest of the data
+				data, self.buffer = self.buffer[1:end + 1], self.buffer[end + 1:]
+			else:
+				data, self.buffer = '', self.buffer[1:]
+			self.commands += 1
+			if self.delay:
+				time.sleep(self.delay)
+			self.handle(command, data)
+
+	def send(self, messageType, data):
+		if not isinstance(data, basestring):
+			data = json.dumps(data)
+		os.write(self.master, messageType + ':' + data + '\n')
+		self.linesSent += 1
+
+	def log(self, logKey, *values):
+		logType, logId = logIds[logKey]
+		self.send('D', dict(logType=logType, logID=logId, V=list(values)))
+
+	def temperatures(self):
+		# move slowly towards the setting, so the charts show something
+		target = self.settings['beerSet'] if self.settings['mode'] != 'o' else 20.0
+		self.beerTemp += (target - self.beerTemp) * 0.01
+		self.fridgeTemp += (target - 1.0 - self.fridgeTemp) * 0.05
+		self.state = 2 if self.fridgeTemp > target else 0
+		return dict(bt=round(self.beerTemp, 2), bs=self.settings['beerSet'], ft=round(self.fridgeTemp, 2),
+		            fs=self.settings['fridgeSet'], rt=21.5, s=self.state)
+
+	def lcd(self):
+		return ['Mode   %s' % modeNames.get(self.settings['mode'], ''),
+		        'Beer   %5.1f %5.1f \xb0C' % (self.beerTemp, self.settings['beerSet']),
+		        'Fridge %5.1f %5.1f \xb0C' % (self.fridgeTemp, self.settings['fridgeSet']),
+		        'Idling for     00m05']
+
+	def handle(self, command, data):
+		if command == 'n':
+			self.send('N', dict(v=self.version, n='simulated', c='', s=self.shield, y=1, b=self.board,
+			                    l=str(expandLogMessage.getVersion())))
+		elif command == 't':
+			self.send('T', self.temperatures())
+		elif command == 'l':
+			# the LCD has a degree sign that is not valid UTF-8, like the real LCD text
+			self.send('L', '["' + '","'.join(self.lcd()) + '"]')
+		elif command == 's':
+			self.send('S', self.settings)
+		elif command == 'c':
+			self.send('C', self.constants)
+		elif command == 'v':
+			self.send('V', variables)
+		elif command == 'S':
+			self.settings = dict(defaultSettings)
+			self.log('INFO_DEFAULT_SETTINGS_LOADED')
+		elif command == 'C':
+			self.constants = dict(defaultConstants)
+			self.log('INFO_DEFAULT_CONSTANTS_LOADED')
+		elif command == 'j':
+			for key, pair in brewpiSerial.settingPairs('j' + data):
+				value = pair.split(':', 1)[1].strip().strip('"\'')
+				try:
+					value = float(value)
+				except ValueError:
+					pass
+				if key in self.settings:
+					self.settings[key] = value
+				elif key in self.constants:
+					self.constants[key] = value
+				else:
+					self.log('WARNING_COULD_NOT_PROCESS_SETTING')
+					continue
+				self.log('INFO_RECEIVED_SETTING', key, str(value))
+		elif command == 'd':
+			self.send('d', installedDevices)
+		elif command == 'h':
+			self.send('h', availableDevices)
+		elif command == 'U':
+			self.send('U', data)
+		else:
+			self.log('WARNING_INVALID_COMMAND', ord(command))
+
+
+def main(argv):
+	usage = "Usage: python brewpiSimulator.py [--rate <temperature lines per second>] [--delay <seconds>]"
+	try:
+		opts, args = getopt.getopt(argv, "hr:d:", ['help', 'rate=', 'delay='])
+	except getopt.GetoptError:
+		print usage
+		return 2
+	rate = 0.0
+	delay = 0.0
+	for o, a in opts:
+		if o in ('-h', '--help'):
+			print usage
+			return 0
+		elif o in ('-r', '--rate'):
+			rate = float(a)
+		elif o in ('-d', '--delay'):
+			delay = float(a)
+	arduino = FakeArduino(rate=rate, delay=delay)
+	arduino.start()
+	print "Simulated Arduino on %s, set port = %s in config.cfg. Press Ctrl-C to stop." % (
+		arduino.portName, arduino.portName)
+	sys.stdout.flush()
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		pass
+	arduino.stop()
+	print "Received %d commands, sent %d lines" % (arduino.commands, arduino.linesSent)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
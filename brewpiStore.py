@@ -0,0 +1,316 @@
+# Copyright 2013 BrewPi
+# This file is part of BrewPi.
+
+# BrewPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BrewPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BrewPi.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import struct
+import time
+import simplejson as json
+import brewpiJson
+
+# A segment file holds the samples of one data file (one day of a beer) as fixed width records.
+# Appending a sample is a single write at the end of the file. The DataTable JSON that the web interface
+# uses is only generated when it is requested, see SampleStore.dataTableJson().
+segmentExtension = '.bps'
+# Annotations are strings of variable length. They are rare, so they are kept in a small side table.
+# Each line of the side table is a JSON list: [record index, BeerAnn, FridgeAnn]
+annotationExtension = '.bpa'
+
+headerFormat = '<4sHH'  # magic, format version, record size
+headerSize = struct.calcsize(headerFormat)
+magic = 'BPS1'
+formatVersion = 1
+
+# Time (seconds since epoch), BeerTemp, BeerSet, FridgeTemp, FridgeSet, RoomTemp, State, 3 bytes padding
+recordFormat = '<d5fB3x'
+recordSize = struct.calcsize(recordFormat)
+recordStruct = struct.Struct(recordFormat)
+
+# order of the temperature fields in a record
+tempFields = ('BeerTemp', 'BeerSet', 'FridgeTemp', 'FridgeSet', 'RoomTemp')
+annotationFields = ('BeerAnn', 'FridgeAnn')
+
+noState = 255  # State is stored as unsigned byte, 255 means no state received
+nan = float('nan')
+# temperatures are stored as 32 bit floats, round them to recover the value sent by the Arduino
+tempDecimals = 3
+
+
+def segmentFileName(jsonFileName):
+	"""
+	Returns the segment file that belongs to a data table JSON file (same name, different extension)
+	"""
+	return os.path.splitext(jsonFileName)[0] + segmentExtension
+
+
+def annotationFileName(segmentFileName):
+	return os.path.splitext(segmentFileName)[0] + annotationExtension
+
+
+def packRecord(row, timestamp):
+	"""
+	Packs a row dict as used by brewpiJson.addRow into a fixed width binary record.
+	Missing values (None) are stored as NaN, or as noState for the state.
+	"""
+	values = [timestamp]
+	for key in tempFields:
+		v = row.get(key)
+		values.append(nan if v is None else float(v))
+	state = row.get('State')
+	values.append(noState if state is None else int(state))
+	return recordStruct.pack(*values)
+
+
+def unpackRecord(data, offset=0):
+	"""
+	Unpacks a binary record into a row dict with the same keys as the rows passed to brewpiJson.addRow.
+	Annotations are not part of the record and are set to None.
+	"""
+	values = recordStruct.unpack_from(data, offset)
+	row = {'Time': values[0], 'BeerAnn': None, 'FridgeAnn': None}
+	for i, key in enumerate(tempFields):
+		v = values[i + 1]
+		row[key] = None if v != v else round(v, tempDecimals)  # v != v is only true for NaN
+	state = values[6]
+	row['State'] = None if state == noState else state
+	return row
+
+
+class SampleStore:
+	"""
+	Append-only store for temperature samples in a binary segment file with an annotation side table.
+	"""
+
+	def __init__(self, fileName):
+		""" Opens the segment file, creates it when it does not exist yet.
+		A partially written record at the end of the file (for example after a power failure) is discarded.
+
+		Args:
+		fileName: path of the segment file, usually ending in segmentExtension
+		"""
+		self.fileName = fileName
+		self.annotationFileName = annotationFileName(fileName)
+		self.count = 0
+		self.lastTime = None
+		self.file = None
+		self.open()
+
+	def __repr__(self):
+		"""
+		This special function ensures SampleStore is printed as a dict of its member variables in print statements.
+		"""
+		return repr(self.__dict__)
+
+	def __len__(self):
+		return self.count
+
+	def open(self):
+		if os.path.exists(self.fileName) and os.path.getsize(self.fileName) >= headerSize:
+			f = open(self.fileName, 'r+b')
+			checkHeader(f.read(headerSize), self.fileName)
+			size = os.path.getsize(self.fileName)
+			self.count = (size - headerSize) // recordSize
+			if headerSize + self.count * recordSize != size:
+				f.truncate(headerSize + self.count * recordSize)  # drop incomplete record
+			if self.count:
+				f.seek(headerSize + (self.count - 1) * recordSize)
+				self.lastTime = unpackRecord(f.read(recordSize))['Time']
+			f.close()
+		else:
+			f = open(self.fileName, 'wb')
+			f.write(struct.pack(headerFormat, magic, formatVersion, recordSize))
+			f.close()
+		# unbuffered, so every append is one write system call and visible to readers right away
+		self.file = open(self.fileName, 'ab', 0)
+
+	def close(self):
+		if self.file:
+			self.file.close()
+			self.file = None
+
+	def append(self, row, timestamp=None):
+		"""
+		Appends a row to the store. The row is a dict with the keys used by brewpiJson.addRow.
+
+		Args:
+		row: dict with the sample values
+		timestamp: seconds since epoch, defaults to now
+
+		Returns:
+		index of the appended record
+		"""
+		if timestamp is None:
+			timestamp = time.time()
+		index = self.count
+		self.appendMany([row], [timestamp])
+		return index
+
+	def appendMany(self, rows, timestamps):
+		"""
+		Appends multiple rows with a single write.
+
+		Args:
+		rows: list of row dicts
+		timestamps: list of seconds since epoch, one for each row
+		"""
+		records = []
+		annotations = []
+		for row, timestamp in zip(rows, timestamps):
+			records.append(packRecord(row, timestamp))
+			if row.get('BeerAnn') is not None or row.get('FridgeAnn') is not None:
+				annotations.append(json.dumps([self.count + len(records) - 1, row.get('BeerAnn'), row.get('FridgeAnn')]))
+		if not records:
+			return
+		self.file.write(''.join(records))
+		self.count += len(records)
+		self.lastTime = timestamps[len(records) - 1]
+		if annotations:
+			annotationFile = open(self.annotationFileName, 'ab')
+			annotationFile.write('\n'.join(annotations) + '\n')
+			annotationFile.close()
+
+	def sync(self):
+		"""
+		Forces the appended records to the storage medium. Does nothing when the store is closed.
+		"""
+		if self.file:
+			os.fsync(self.file.fileno())
+
+	def annotations(self):
+		"""
+		Returns a dict of record index to (BeerAnn, FridgeAnn) tuples read from the side table
+		"""
+		return readAnnotations(self.annotationFileName)
+
+	def rows(self, start=0, stop=None):
+		"""
+		Generator for the rows in the store, with annotations filled in.
+
+		Args:
+		start: index of the first record
+		stop: index after the last record, defaults to the number of records at the moment of the call
+		"""
+		count = self.count if stop is None else min(stop, self.count)
+		return readRows(self.fileName, start, count)
+
+	def dataTableJson(self):
+		"""
+		Generates the Google DataTable JSON for all samples in the store.
+		The output has the same format as the files written by brewpiJson.
+		"""
+		return brewpiJson.dataTable(self.rows())
+
+	def writeDataTableFile(self, jsonFileName):
+		"""
+		Writes the DataTable JSON to a file. The file is written under a temporary name first and then renamed,
+		so readers never see a half written file.
+		"""
+		tempFileName = jsonFileName + '.tmp'
+		jsonFile = open(tempFileName, 'wb')
+		jsonFile.write(self.dataTableJson())
+		jsonFile.close()
+		os.rename(tempFileName, jsonFileName)
+
+
+def checkHeader(header, fileName):
+	fileMagic, version, size = struct.unpack(headerFormat, header)
+	if fileMagic != magic or size != recordSize:
+		raise IOError("%s is not a BrewPi sample segment file" % fileName)
+	if version > formatVersion:
+		raise IOError("Segment file %s has unsupported format version %d" % (fileName, version))
+
+
+def recordCount(fileName):
+	"""
+	Returns the number of complete records in a segment file
+	"""
+	return max(0, (os.path.getsize(fileName) - headerSize) // recordSize)
+
+
+def readAnnotations(annotationFileName):
+	"""
+	Returns a dict of record index to (BeerAnn, FridgeAnn) tuples read from an annotation side table
+	"""
+	result = {}
+	if os.path.exists(annotationFileName):
+		with open(annotationFileName, 'rb') as annotationFile:
+			for line in annotationFile:
+				try:
+					index, beerAnn, fridgeAnn = json.loads(line)
+				except (ValueError, TypeError):
+					continue  # skip a line that was not completely written
+				result[index] = (beerAnn, fridgeAnn)
+	return result
+
+
+def readRows(fileName, start, stop):
+	"""
+	Generator for the rows with index start up to stop in a segment file, with annotations filled in.
+	The records are read in chunks, so memory use does not depend on the number of rows.
+	"""
+	if start >= stop:
+		return
+	annotations = readAnnotations(os.path.splitext(fileName)[0] + annotationExtension)
+	with open(fileName, 'rb') as f:
+		checkHeader(f.read(headerSize), fileName)
+		f.seek(headerSize + start * recordSize)
+		index = start
+		while index < stop:
+			data = f.read(min(stop - index, 1024) * recordSize)
+			if len(data) < recordSize:
+				break
+			for offset in xrange(0, len(data) - recordSize + 1, recordSize):
+				row = unpackRecord(data, offset)
+				ann = annotations.get(index)
+				if ann:
+					row['BeerAnn'], row['FridgeAnn'] = ann
+				index += 1
+				yield row
+
+
+def findTime(f, count, t):
+	"""
+	Binary search in an open segment file for the index of the first record at or after time t.
+	Records are appended in time order.
+	"""
+	low, high = 0, count
+	while low < high:
+		mid = (low + high) // 2
+		f.seek(headerSize + mid * recordSize)
+		if struct.unpack('<d', f.read(8))[0] < t:
+			low = mid + 1
+		else:
+			high = mid
+	return low
+
+
+def indexRange(fileName, start, end):
+	"""
+	Returns the indexes (first, stop) of the records in a segment file with a time between start and end
+	"""
+	count = recordCount(fileName)
+	with open(fileName, 'rb') as f:
+		first = findTime(f, count, start)
+		stop = findTime(f, count, end + 1e-6)
+	return first, stop
+
+
+def readTimeRange(fileName, start, end):
+	"""
+	Generator for the rows in a segment file with a time between start and end (seconds since epoch).
+	Only the records in the time range are read from the file.
+	"""
+	first, stop = indexRange(fileName, start, end)
+	return readRows(fileName, first, stop)
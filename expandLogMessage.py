@@ -19,7 +19,7 @@ import simplejson as json
 import parseEnum
 import os
 
-logMessagesFile = os.path.dirname(__file__) + '/LogMessages.h'
+logMessagesFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'LogMessages.h')
 
 errorDict = parseEnum.parseEnumInFile(logMessagesFile, 'errorMessages')
 infoDict = parseEnum.parseEnumInFile(logMessagesFile, 'infoMessages')
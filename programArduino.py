@@ -23,6 +23,7 @@ import os
 from brewpiVersion import AvrInfo
 import expandLogMessage
 import settingRestore
+import brewpiSerial
 from sys import stderr
 import BrewPiUtil as util
 
@@ -92,35 +93,24 @@ def programArduino(config, boardType, hexFile, restoreWhat):
         printStdErr("Could not open serial port. Programming aborted.")
         return 0
 
-    time.sleep(5)  # give the arduino some time to reboot in case of an Arduino UNO
-
     printStdErr("Checking old version before programming.")
 
     avrVersionOld = None
 
-    retries = 0
-    requestVersion = True
-    while requestVersion:
-        for line in ser:
-            if line[0] == 'N':
-                data = line.strip('\n')[2:]
-                avrVersionOld = AvrInfo(data)
-                printStdErr("Found Arduino " + str(avrVersionOld.board) +
-                            " with a " + str(avrVersionOld.shield) + " shield, " +
-                            "running BrewPi version " + str(avrVersionOld.version) +
-                            " build " + str(avrVersionOld.build) +
-                            " on port " + port + "\n")
-                requestVersion = False
-                break
-        else:
-            ser.write('n')  # request version info
-            time.sleep(1)
-            retries += 1
-            if retries > 10:
-                printStdErr(("Warning: Cannot receive version number from Arduino. " +
-                             "Your Arduino is either not programmed yet or running a very old version of BrewPi. "
-                             "Arduino will be reset to defaults."))
-                break
+    # give an Arduino UNO up to 5 seconds to reboot, it resets when the port is opened
+    quietTime = 5.0 if brewpiSerial.resetsOnOpen(boardType) else 0.0
+    versionData, handshakeTime = brewpiSerial.requestVersion(ser, quietTime=quietTime)
+    if versionData is not None:
+        avrVersionOld = AvrInfo(versionData)
+        printStdErr("Found Arduino " + str(avrVersionOld.board) +
+                    " with a " + str(avrVersionOld.shield) + " shield, " +
+                    "running BrewPi version " + str(avrVersionOld.version) +
+                    " build " + str(avrVersionOld.build) +
+                    " on port " + port + "\n")
+    else:
+        printStdErr(("Warning: Cannot receive version number from Arduino. " +
+                     "Your Arduino is either not programmed yet or running a very old version of BrewPi. "
+                     "Arduino will be reset to defaults."))
 
     oldSettings = {}
 
@@ -243,27 +233,14 @@ def programArduino(config, boardType, hexFile, restoreWhat):
 
     # read new version
     avrVersionNew = None
-    retries = 0
-    requestVersion = True
-    while requestVersion:
-        for line in ser:
-            if line[0] == 'N':
-                data = line.strip('\n')[2:]
-                avrVersionNew = AvrInfo(data)
-                printStdErr("Checking new version: Found Arduino " + avrVersionNew.board +
-                            " with a " + str(avrVersionNew.shield) + " shield, " +
-                            "running BrewPi version " + str(avrVersionNew.version) +
-                            " build " + str(avrVersionNew.build) +
-                            " on port " + port + "\n")
-                requestVersion = False
-                break
-
-        else:
-            ser.write('n')  # request version info
-            time.sleep(1)
-            retries += 1
-            if retries > 10:
-                break
+    versionData, handshakeTime = brewpiSerial.requestVersion(ser, quietTime=quietTime)
+    if versionData is not None:
+        avrVersionNew = AvrInfo(versionData)
+        printStdErr("Checking new version: Found Arduino " + avrVersionNew.board +
+                    " with a " + str(avrVersionNew.shield) + " shield, " +
+                    "running BrewPi version " + str(avrVersionNew.version) +
+                    " build " + str(avrVersionNew.build) +
+                    " on port " + port + "\n")
 
     printStdErr("Resetting EEPROM to default settings")
     ser.write('E')
@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+import BrewPiProcess
+
+
+class FakeProcess:
+	def __init__(self, pid, cmdline):
+		self._pid = pid
+		self.name = 'python'
+		self.cmdline = cmdline
+
+
+class ConflictTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.processes = BrewPiProcess.BrewPiProcesses()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def writeConfig(self, name, port, lines=[]):
+		fileName = os.path.join(self.dir, name + '.cfg')
+		with open(fileName, 'w') as f:
+			f.write('\n'.join(['scriptPath = %s/%s' % (self.dir, name), 'port = ' + port] + lines) + '\n')
+		return fileName
+
+	def test_multiChambersUseTheirPorts(self):
+		multiConfig = self.writeConfig('multi', '/dev/ttyACM0', ['[chambers]', '[[f1]]', 'port = /dev/ttyACM5', '[[f2]]',
+		                                                         'port = /dev/ttyACM6'])
+		multi = self.processes.parseProcess(FakeProcess(1, ['python', 'brewpiMulti.py', '--config', multiConfig]))
+		self.assertEqual(sorted(multi.ports), ['/dev/ttyACM5', '/dev/ttyACM6'])
+
+		single = self.processes.parseProcess(FakeProcess(2, ['python', 'brewpi.py', '--config',
+		                                                     self.writeConfig('single', '/dev/ttyACM6')]))
+		self.assertTrue(multi.conflict(single))
+		other = self.processes.parseProcess(FakeProcess(3, ['python', 'brewpi.py', '--config',
+		                                                    self.writeConfig('other', '/dev/ttyACM0')]))
+		self.assertFalse(multi.conflict(other))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,117 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import serial
+import brewpiCapture
+import brewpiSerial
+import brewpiSimulator
+
+
+class SerialCaptureTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_ringBufferKeepsLastFrames(self):
+		capture = brewpiCapture.SerialCapture(size=3)
+		for i in range(5):
+			capture.record(brewpiCapture.toArduino, 't')
+			capture.record(brewpiCapture.fromArduino, 'T:{"bt":%d}\n' % i)
+		frames = capture.toJson()
+		self.assertEqual([frame[1:] for frame in frames], [['<', 'T:{"bt":3}\n'], ['>', 't'], ['<', 'T:{"bt":4}\n']])
+		self.assertTrue(abs(frames[-1][0] - time.time()) < 1)
+		self.assertEqual(capture.toJson(1)[0][2], 'T:{"bt":4}\n')
+		self.assertEqual(capture.stats()['frames'], {'<': 5, '>': 5})
+
+	def test_captureFile(self):
+		fileName = os.path.join(self.dir, 'serial.bpcap')
+		capture = brewpiCapture.SerialCapture(size=2, fileName=fileName, maxFileSize=100)
+		for i in range(10):
+			capture.record(brewpiCapture.fromArduino, 'L:["18.0\xb0C"]\n')
+		capture.close()
+		frames = list(brewpiCapture.readCaptureFile(fileName)) + list(brewpiCapture.readCaptureFile(fileName + '.1'))
+		self.assertTrue(len(frames) > 0)
+		self.assertEqual(frames[0][1:], ('<', 'L:["18.0\xb0C"]\n'))
+		self.assertEqual(capture.toJson()[0][2], u'L:["18.0\xb0C"]\n')
+
+		capture.save(fileName)
+		self.assertEqual(len(list(brewpiCapture.readCaptureFile(fileName))), 2)
+		with open(fileName, 'ab') as f:
+			f.write('\0\0')  # incomplete record
+		self.assertEqual(len(list(brewpiCapture.readCaptureFile(fileName))), 2)
+
+	def test_attach(self):
+		arduino = brewpiSimulator.FakeArduino()
+		arduino.start()
+		ser = serial.Serial(arduino.portName, 57600, timeout=0.1)
+		capture = brewpiCapture.SerialCapture()
+		capture.attach(ser)
+		dispatcher = brewpiSerial.MessageDispatcher()
+		framer = brewpiSerial.LineFramer(dispatcher)
+		try:
+			ser.write('t')
+			end = time.time() + 2
+			while framer.lines < 1 and time.time() < end:
+				framer.readFrom(ser)
+		finally:
+			ser.close()
+			arduino.stop()
+		directions = [direction for t, direction, data in capture.frames]
+		self.assertEqual(directions[0], '>')
+		self.assertTrue(''.join(data for t, direction, data in capture.frames if direction == '<').startswith('T:{'))
+
+	def test_recordFromThreads(self):
+		fileName = os.path.join(self.dir, 'serial.bpcap')
+		capture = brewpiCapture.SerialCapture(size=10000, fileName=fileName, maxFileSize=1000000)
+
+		def record(direction):
+			for i in range(2000):
+				capture.record(direction, 'x' * 10)
+		threads = [threading.Thread(target=record, args=(direction,))
+		           for direction in (brewpiCapture.fromArduino, brewpiCapture.toArduino)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		capture.close()
+		self.assertEqual(capture.stats()['frames'], {'<': 2000, '>': 2000})
+		frames = list(brewpiCapture.readCaptureFile(fileName))
+		self.assertEqual(len(frames), 4000)
+		times = [t for t, direction, data in frames]
+		self.assertEqual(times, sorted(times))
+
+	def test_crashInReaderThreadSavesCapture(self):
+		capture = brewpiCapture.SerialCapture()
+		capture.record(brewpiCapture.fromArduino, 'T:{"bt":20}\n')
+		previousHook = sys.excepthook
+		brewpiCapture.installCrashHandler(lambda: dict(serial=capture), self.dir)
+
+		class BrokenPort:
+			def inWaiting(self):
+				raise RuntimeError("broken")
+
+		stderr = sys.stderr
+		sys.stderr = open(os.devnull, 'w')  # the thread prints the traceback
+		try:
+			reader = brewpiSerial.SerialReader(BrokenPort(), brewpiSerial.MessageDispatcher())
+			reader.start()
+			reader.join(2)
+		finally:
+			sys.stderr.close()
+			sys.stderr = stderr
+			sys.excepthook = previousHook
+			del brewpiCapture.crashHandlers[:]
+		self.assertFalse(reader.isAlive())
+		saved = [name for name in os.listdir(self.dir) if name.startswith('crash-serial')]
+		self.assertEqual(len(saved), 1)
+		self.assertEqual(len(list(brewpiCapture.readCaptureFile(os.path.join(self.dir, saved[0])))), 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import configobj
+import simplejson as json
+import brewpiChamber
+import brewpiEventLoop
+import brewpiLogWriter
+import brewpiSimulator
+
+
+class FakeConnection:
+	def __init__(self):
+		self.sent = []
+
+	def send(self, data):
+		self.sent.append(data)
+
+	sendall = send
+
+
+class ParseTestCase(unittest.TestCase):
+	def test_parseMessage(self):
+		self.assertEqual(brewpiChamber.parseMessage('fermenter2/setBeer=18.5'), ('fermenter2', 'setBeer', '18.5'))
+		self.assertEqual(brewpiChamber.parseMessage('lcd'), (None, 'lcd', ''))
+		# a slash in the value is not a chamber prefix
+		self.assertEqual(brewpiChamber.parseMessage('setActiveProfile=ales/pale'), (None, 'setActiveProfile', 'ales/pale'))
+
+	def test_chamberConfig(self):
+		config = configobj.ConfigObj(['scriptPath = /home/brewpi/', 'wwwPath = /var/www', 'interval = 120.0',
+		                              '[chambers]', '[[f1]]', 'port = /dev/ttyACM0', 'interval = 60.0', '[[f2]]',
+		                              'port = /dev/ttyACM1'])
+		self.assertEqual(brewpiChamber.chamberIds(config), ['f1', 'f2'])
+		settings = brewpiChamber.chamberConfig(config, 'f1')
+		self.assertEqual(settings['scriptPath'], '/home/brewpi/chambers/f1/')
+		self.assertEqual(settings['wwwPath'], '/var/www/chambers/f1/')
+		self.assertEqual(settings['interval'], '60.0')
+		self.assertEqual(brewpiChamber.chamberConfig(config, 'f2')['interval'], '120.0')
+		self.assertFalse(brewpiChamber.isValidChamberId('../f1'))
+
+
+class ChambersTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.arduinos = [brewpiSimulator.FakeArduino(), brewpiSimulator.FakeArduino()]
+		lines = ['scriptPath = %s' % self.dir, 'wwwPath = %s/www' % self.dir, 'interval = 0.2', 'dataLogging = active',
+		         'boardType = leonardo',
+		         '[chambers]']
+		for i, arduino in enumerate(self.arduinos):
+			arduino.start()
+			lines += ['[[f%d]]' % i, 'port = %s' % arduino.portName, 'beerName = beer%d' % i]
+		self.configFile = os.path.join(self.dir, 'config.cfg')
+		configobj.ConfigObj(lines).write(open(self.configFile, 'w'))
+		config = configobj.ConfigObj(self.configFile)
+		self.loop = brewpiEventLoop.EventLoop()
+		self.writer = brewpiLogWriter.DataLogWriter(fsyncSamples=0, fsyncSeconds=0)
+		self.writer.start()
+		self.chambers = [brewpiChamber.Chamber(c, config, self.configFile, self.loop, self.writer)
+		                 for c in brewpiChamber.chamberIds(config)]
+
+	def tearDown(self):
+		self.writer.stop()
+		for chamber in self.chambers:
+			chamber.close()
+		for arduino in self.arduinos:
+			arduino.stop()
+		shutil.rmtree(self.dir)
+
+	def runLoop(self, seconds):
+		end = time.time() + seconds
+		while time.time() < end:
+			self.loop.runOnce(0.05)
+			for chamber in self.chambers:
+				chamber.serialPass()
+
+	def test_chambersAreIndependent(self):
+		for chamber in self.chambers:
+			chamber.open()
+		self.runLoop(1.0)
+		self.assertTrue(all(chamber.avrVersion is not None for chamber in self.chambers))
+
+		conn = FakeConnection()
+		self.assertTrue(self.chambers[1].handleMessage(conn, 'setBeer', '17.5'))
+		self.runLoop(0.3)
+		self.assertEqual(self.arduinos[1].settings['beerSet'], 17.5)
+		self.assertEqual(self.arduinos[0].settings['beerSet'], 20.0)
+		self.chambers[1].handleMessage(conn, 'getBeer', '')
+		self.assertEqual(conn.sent, ['17.5'])
+		self.assertEqual(self.chambers[1].commands.stats()['commands']['setBeer']['calls'], 1)
+		self.assertFalse('setBeer' in self.chambers[0].commands.stats()['commands'])
+
+		self.writer.stop()
+		for i in range(2):
+			csvFile = os.path.join(self.dir, 'chambers', 'f%d' % i, 'data', 'beer%d' % i, 'beer%d.csv' % i)
+			self.assertTrue(len(open(csvFile).readlines()) >= 3)
+
+	def test_repliesAreCachedUntilStateChanges(self):
+		chamber = self.chambers[0]
+		conn = FakeConnection()
+		line = '{"mode":"b","beerSet":20.0,"fridgeSet":18.0,"heatEst":0.2,"coolEst":5}'
+		chamber.handleControlSettings(line)
+		for i in range(3):
+			chamber.handleMessage(conn, 'getControlSettings', '')
+			chamber.handleControlSettings(line)  # the same settings again do not invalidate the reply
+		chamber.setConfig('dataLogging', 'paused')
+		chamber.handleMessage(conn, 'getControlSettings', '')
+		chamber.handleMessage(conn, 'setBeer', '17.5')
+		chamber.handleMessage(conn, 'getControlSettings', '')
+		replies = [json.loads(reply) for reply in conn.sent]
+		self.assertEqual([r['dataLogging'] for r in replies], ['active'] * 3 + ['paused'] * 2)
+		self.assertEqual(replies[-1]['beerSet'], 17.5)
+		self.assertFalse('dataLogging' in chamber.cs)
+		stats = chamber.responseCache.stats()['getControlSettings']
+		self.assertEqual((stats['hits'], stats['misses'], stats['invalidations']), (2, 3, 1))
+
+	def test_setConfig(self):
+		self.chambers[0].setConfig('dataLogging', 'paused')
+		self.assertEqual(configobj.ConfigObj(self.configFile)['chambers']['f0']['dataLogging'], 'paused')
+		self.assertEqual(self.chambers[0].config['dataLogging'], 'paused')
+		self.assertEqual(self.chambers[1].config['dataLogging'], 'active')
+
+
+class SingleChamberTestCase(unittest.TestCase):
+	""" The chamber of brewpi.py, with the top level settings """
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.configFile = os.path.join(self.dir, 'config.cfg')
+		configobj.ConfigObj(['scriptPath = %s' % self.dir, 'wwwPath = %s/www' % self.dir, 'interval = 120.0',
+		                     'dataLogging = active', 'beerName = ale']).write(open(self.configFile, 'w'))
+		self.writer = brewpiLogWriter.DataLogWriter(fsyncSamples=0, fsyncSeconds=0)
+		self.writer.start()
+		self.chamber = brewpiChamber.Chamber(None, configobj.ConfigObj(self.configFile), self.configFile, None,
+		                                     self.writer)
+		self.chamber.startLogging()
+
+	def tearDown(self):
+		self.writer.stop()
+		shutil.rmtree(self.dir)
+
+	def test_topLevelSettings(self):
+		self.assertEqual(self.chamber.config['scriptPath'], self.dir + '/')
+		self.assertEqual(self.chamber.config['wwwPath'], self.dir + '/www/')
+		self.assertTrue(self.chamber.jsonFileName.startswith(self.dir + '/data/ale/ale-'))
+		conn = FakeConnection()
+		self.chamber.handleMessage(conn, 'interval', '60')
+		self.chamber.handleMessage(conn, 'dateTimeFormatDisplay', 'mm/dd/yy')
+		userConfig = configobj.ConfigObj(self.configFile)
+		self.assertEqual((userConfig['interval'], userConfig['dateTimeFormatDisplay']), ('60.0', 'mm/dd/yy'))
+		self.assertFalse('chambers' in userConfig)
+		wwwSettings = json.load(open(os.path.join(self.dir, 'www', 'userSettings.json')))
+		self.assertEqual(wwwSettings['dateTimeFormatDisplay'], 'mm/dd/yy')
+
+	def test_stopLoggingClearsBeerName(self):
+		conn = FakeConnection()
+		self.chamber.handleMessage(conn, 'stopLogging', '')
+		self.assertEqual(json.loads(conn.sent[0])['status'], 0)
+		userConfig = configobj.ConfigObj(self.configFile)
+		self.assertEqual((userConfig['dataLogging'], userConfig['beerName']), ('stopped', 'None'))
+
+	def test_commandsBeforeVersion(self):
+		conn = FakeConnection()
+		self.chamber.handleMessage(conn, 'getDeviceList', '')
+		self.chamber.handleMessage(conn, 'getStartupStats', '')
+		self.assertEqual(conn.sent, ['device-list-not-up-to-date', json.dumps(dict(handshake=None, firstSample=None))])
+
+
+if __name__ == '__main__':
+	unittest.main()
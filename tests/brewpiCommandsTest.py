@@ -0,0 +1,72 @@
+import unittest
+import brewpiCommands
+
+
+class FakeConnection:
+	def __init__(self):
+		self.sent = []
+
+	def send(self, data):
+		self.sent.append(data)
+
+
+class CommandRegistryTestCase(unittest.TestCase):
+	def setUp(self):
+		self.logged = []
+		self.registry = brewpiCommands.CommandRegistry(self.logged.append)
+		self.conn = FakeConnection()
+
+	def test_valuesAreParsedBeforeTheHandler(self):
+		temperatures = []
+
+		@self.registry.command('setBeer', brewpiCommands.floatValue)
+		def setBeer(conn, newTemp):
+			temperatures.append(newTemp)
+			return True
+
+		self.registry.register('interval', lambda conn, value: temperatures.append(value),
+		                       brewpiCommands.between(brewpiCommands.intValue, 6, 4999))
+		self.assertTrue(self.registry.dispatch(self.conn, 'setBeer=18.5'))
+		self.assertFalse(self.registry.dispatch(self.conn, 'setBeer=warm'))
+		self.assertFalse(self.registry.dispatch(self.conn, 'interval=5'))
+		self.assertFalse(self.registry.dispatch(self.conn, 'interval'))
+		self.registry.dispatch(self.conn, 'interval=120')
+		self.assertEqual(temperatures, [18.5, 120])
+		self.assertEqual(len(self.logged), 3)
+		self.assertTrue('setBeer' in self.logged[0])
+
+	def test_stats(self):
+		def fail(conn, value):
+			raise IOError("disk full")
+
+		self.registry.register('ack', lambda conn, value: conn.send('ack'))
+		self.registry.register('applyDevice', lambda conn, value: True, brewpiCommands.jsonText)
+		self.registry.register('eraseLogs', fail)
+		for i in range(3):
+			self.registry.dispatch(self.conn, 'ack')
+		self.registry.dispatch(self.conn, 'applyDevice={"i":0,"c":1}')
+		self.registry.dispatch(self.conn, 'applyDevice={i:0}')
+		self.assertRaises(IOError, self.registry.dispatch, self.conn, 'eraseLogs')
+		self.registry.dispatch(self.conn, 'setSomething=1')
+		self.assertEqual(self.conn.sent, ['ack'] * 3)
+
+		stats = self.registry.stats()
+		commands = stats['commands']
+		self.assertEqual(sorted(commands), ['ack', 'applyDevice', 'eraseLogs'])
+		self.assertEqual((commands['ack']['calls'], commands['ack']['errors']), (3, 0))
+		self.assertEqual((commands['applyDevice']['calls'], commands['applyDevice']['errors']), (2, 1))
+		self.assertEqual(commands['eraseLogs']['errors'], 1)
+		self.assertEqual(sum(commands['ack']['histogram']), 3)
+		self.assertEqual(len(commands['ack']['histogram']), len(stats['latencyBucketsMs']) + 1)
+		self.assertTrue(commands['ack']['maxLatencyMs'] >= commands['ack']['avgLatencyMs'])
+		self.assertEqual(stats['unknown'], 1)
+
+	def test_timeRange(self):
+		self.assertEqual(brewpiCommands.timeRange('{"start": 10, "end": 20}'), (10.0, 20.0))
+		self.assertEqual(brewpiCommands.rollupRange('{"end": 86400, "points": 10}'), (-518400.0, 86400.0, 10))
+		for value in ['', '{"end": 20}', '[1, 2]', '{"start": "x"}']:
+			self.assertRaises(brewpiCommands.CommandError, brewpiCommands.timeRange, value)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import brewpiConvert
+import brewpiStore
+
+
+class ConvertTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.dataPath = os.path.join(self.dir, 'data')
+		self.outputPath = os.path.join(self.dir, 'converted')
+		os.makedirs(os.path.join(self.dataPath, 'Ale'))
+		with open(os.path.join(self.dataPath, 'Ale', 'Ale.csv'), 'wb') as f:
+			f.write("Sep 26 2012 00:01:00;18.96;19.00;None;19.94;19.60;None\n"
+			        "Oct 25 2013 10:00:00;19.50;20.00;Beer temp changed;18.25;None;None;1;21.12\n"
+			        "Oct 25 2013 10:02")  # incomplete last line
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_parseCsvLine(self):
+		row = brewpiConvert.parseCsvLine("Oct 25 2013 10:00:00;19.50;20.00;Beer temp changed;18.25;None;None;1;21.12\n")
+		self.assertEqual(row['BeerTemp'], 19.5)
+		self.assertEqual(row['BeerAnn'], 'Beer temp changed')
+		self.assertEqual(row['FridgeSet'], None)
+		self.assertEqual(row['State'], 1)
+		self.assertEqual(row['RoomTemp'], 21.12)
+		row = brewpiConvert.parseCsvLine("Sep 26 2012 00:01:00;18.96;19.00;None;19.94;19.60;None\n")
+		self.assertEqual(row['FridgeSet'], 19.6)
+		self.assertEqual(row['State'], None)
+
+	def test_dataFileKey(self):
+		files = ['Ale-2013-10-26.json', 'Ale-2013-10-25-2.json', 'Ale-2013-10-25.json']
+		self.assertEqual(sorted(files, key=brewpiConvert.dataFileKey),
+		                 ['Ale-2013-10-25.json', 'Ale-2013-10-25-2.json', 'Ale-2013-10-26.json'])
+
+	def test_convertCsvToStore(self):
+		results = brewpiConvert.convert(self.dataPath, self.outputPath, 'bps', processes=1)
+		self.assertEqual(results[0]['error'], None)
+		self.assertEqual(results[0]['samples'], 2)
+		store = brewpiStore.SampleStore(os.path.join(self.outputPath, 'Ale.bps'))
+		rows = list(store.rows())
+		self.assertEqual([r['BeerTemp'] for r in rows], [18.96, 19.5])
+		self.assertEqual(rows[1]['BeerAnn'], 'Beer temp changed')
+
+	def test_convertToSqlite(self):
+		brewpiConvert.convert(self.dataPath, self.outputPath, 'sqlite', processes=1)
+		db = sqlite3.connect(os.path.join(self.outputPath, 'Ale.sqlite'))
+		self.assertEqual(db.execute('SELECT BeerTemp, State FROM samples ORDER BY Time').fetchall(),
+		                 [(18.96, None), (19.5, 1)])
+
+
+if __name__ == '__main__':
+	unittest.main()
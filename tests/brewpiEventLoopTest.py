@@ -0,0 +1,276 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import simplejson as json
+import BrewPiSocket
+import brewpiEventLoop
+import brewpiSerial
+
+
+class EventLoopTestCase(unittest.TestCase):
+	def setUp(self):
+		self.loop = brewpiEventLoop.EventLoop()
+		self.calls = []
+
+	def test_timersRunInOrder(self):
+		self.loop.callLater(0.02, self.calls.append, 'later')
+		self.loop.callLater(0.01, self.calls.append, 'sooner')
+		cancelled = self.loop.callLater(0.01, self.calls.append, 'cancelled')
+		cancelled.cancel()
+		self.loop.callSoon(self.calls.append, 'soon')
+		for i in range(10):
+			self.loop.runOnce(0.05)
+		self.assertEqual(self.calls, ['soon', 'sooner', 'later'])
+
+	def test_callEveryRepeats(self):
+		self.loop.callEvery(0.005, self.calls.append, 'tick')
+		for i in range(5):
+			self.loop.runOnce(0.05)
+		self.assertEqual(len(self.calls), 5)
+
+	def test_callbackErrorDoesNotStopLoop(self):
+		def fail():
+			raise NameError("avrVersion")
+		self.loop.callSoon(fail)
+		self.loop.callSoon(self.calls.append, 'after')
+		for i in range(3):
+			self.loop.runOnce(0.01)
+		self.assertEqual(self.calls, ['after'])
+
+	def test_priorityReaderFirst(self):
+		r1, w1 = os.pipe()
+		r2, w2 = os.pipe()
+		self.loop.addReader(r1, lambda: self.calls.append(os.read(r1, 10)))
+		self.loop.addReader(r2, lambda: self.calls.append(os.read(r2, 10)), priority=True)
+		os.write(w1, 'socket')
+		os.write(w2, 'serial')
+		self.loop.runOnce(0.1)
+		self.assertEqual(self.calls, ['serial', 'socket'])
+		for fd in (r1, w1, r2, w2):
+			os.close(fd)
+
+
+class MessageServerTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.socketFile = os.path.join(self.dir, 'BEERSOCKET')
+		self.listenSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.listenSocket.bind(self.socketFile)
+		self.listenSocket.listen(10)
+		self.loop = brewpiEventLoop.EventLoop()
+
+	def tearDown(self):
+		self.listenSocket.close()
+		shutil.rmtree(self.dir)
+
+	def connect(self, message):
+		client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		client.connect(self.socketFile)
+		client.sendall(message)
+		return client
+
+	def receive(self, client):
+		data = ''
+		while True:
+			chunk = client.recv(65536)
+			if not chunk:
+				return data
+			data += chunk
+
+	def test_concurrentClients(self):
+		def handler(conn, message):
+			conn.send(message.upper())
+			conn.sendall('x' * 200000)  # larger than the socket buffer
+		server = brewpiEventLoop.MessageServer(self.loop, self.listenSocket, handler)
+		clients = [self.connect('getmode'), self.connect('lcd')]
+		for i in range(5):
+			self.loop.runOnce(0.05)
+		self.assertEqual(server.maxConnections, 2)
+		for client in clients:
+			client.setblocking(0)
+		pending = list(clients)
+		buffers = dict((c, '') for c in clients)
+		for i in range(500):
+			self.loop.runOnce(0.01)
+			for client in list(pending):
+				try:
+					chunk = client.recv(65536)
+				except socket.error:
+					continue
+				if chunk:
+					buffers[client] += chunk
+				else:
+					pending.remove(client)
+			if not pending:
+				break
+		self.assertEqual(buffers[clients[0]], 'GETMODE' + 'x' * 200000)
+		self.assertEqual(buffers[clients[1]], 'LCD' + 'x' * 200000)
+		self.assertEqual(server.messages, 2)
+		self.assertEqual(len(server.connections), 0)
+
+	def test_requestLatencyAndTimeout(self):
+		server = brewpiEventLoop.MessageServer(self.loop, self.listenSocket, lambda conn, message: conn.send('ok'),
+		                                       clientTimeout=0.1)
+		silent = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		silent.connect(self.socketFile)  # never sends a message
+		clients = [self.connect('lcd'), self.connect('lcd'), self.connect('getMode=1')]
+		for i in range(20):
+			self.loop.runOnce(0.02)
+		for client in clients:
+			self.assertEqual(self.receive(client), 'ok')
+		self.assertEqual(self.receive(silent), '')  # closed by the server
+		stats = server.stats()
+		self.assertEqual(stats['timeouts'], 1)
+		self.assertEqual(stats['connections'], 0)
+		self.assertEqual(stats['latency']['requests'], 3)
+		self.assertEqual(stats['commands']['lcd']['requests'], 2)
+		self.assertEqual(stats['commands']['getMode']['requests'], 1)
+		self.assertTrue(0 <= stats['latency']['p50Latency'] <= stats['latency']['p99Latency'] < 0.1)
+
+	def test_framedRequestsArePipelined(self):
+		def handler(conn, message):
+			if message == 'getDeviceList':
+				conn.send('d' * 100000)  # one send larger than the socket buffer
+			elif message != 'setBeer=20':  # no reply
+				conn.send(message.upper())
+		server = brewpiEventLoop.MessageServer(self.loop, self.listenSocket, handler)
+		running = [True]
+
+		def runLoop():
+			while running[0]:
+				self.loop.runOnce(0.01)
+		thread = threading.Thread(target=runLoop)
+		thread.start()
+		try:
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			sock.settimeout(5)
+			sock.connect(self.socketFile)
+			client = BrewPiSocket.FramedClient(sock)
+			replies = client.pipeline(['lcd', 'setBeer=20', 'getDeviceList', 'getMode'])
+			self.assertEqual(replies, ['LCD', '', 'd' * 100000, 'GETMODE'])
+			self.assertEqual(client.request('ack'), 'ACK')  # the connection stays open
+			self.assertEqual(self.connect('lcd').recv(100), 'LCD')  # one-shot clients are served as before
+			client.close()
+		finally:
+			running[0] = False
+			thread.join()
+		self.assertEqual(server.messages, 6)
+		self.assertEqual(server.stats()['commands']['getDeviceList']['requests'], 1)
+
+	def test_invalidFrameClosesConnection(self):
+		server = brewpiEventLoop.MessageServer(self.loop, self.listenSocket, lambda conn, message: conn.send('ok'))
+		client = self.connect(BrewPiSocket.packFrame(1, 'lcd') + '\x01garbage!')
+		for i in range(5):
+			self.loop.runOnce(0.05)
+		self.assertEqual(self.receive(client), '')
+		self.assertEqual(len(server.connections), 0)
+
+	def test_subscribersReceiveEvents(self):
+		publisher = brewpiEventLoop.EventPublisher(self.loop)
+		server = brewpiEventLoop.MessageServer(self.loop, self.listenSocket,
+		                                       lambda conn, message: publisher.subscribe(conn, message.split('=', 1)[1]))
+		running = [True]
+
+		def runLoop():
+			while running[0]:
+				self.loop.runOnce(1.0)  # woken up by the events published from the test thread
+		thread = threading.Thread(target=runLoop)
+		thread.start()
+		try:
+			stream = self.connect('subscribe=lcd,sample').makefile()
+			self.assertEqual(json.loads(stream.readline())['data'], ['lcd', 'sample'])
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			sock.settimeout(5)
+			sock.connect(self.socketFile)
+			framed = BrewPiSocket.FramedClient(sock)
+			requestId = framed.send('subscribe=')
+			self.assertEqual(framed.receive(), (requestId, ''))  # the reply to subscribe
+			self.assertEqual(json.loads(framed.receive()[1])['type'], 'subscribed')
+			self.assertTrue(publisher.wants('sample'))
+			self.assertFalse(publisher.wants('unknown'))
+
+			publisher.publish('controlSettings', {'mode': 'b'})
+			publisher.publish('lcd', ['Beer 19.0 \xb0C'])
+			publisher.publish('sample', {'BeerTemp': 19.0})
+			self.assertEqual([json.loads(stream.readline())['type'] for i in range(2)], ['lcd', 'sample'])
+			events = [json.loads(framed.receive()[1]) for i in range(3)]
+			self.assertEqual([event['type'] for event in events], ['controlSettings', 'lcd', 'sample'])
+			self.assertEqual(events[1]['data'], [u'Beer 19.0 \xb0C'])
+			stream.close()
+			framed.close()
+			deadline = time.time() + 2
+			while publisher.subscriptions and time.time() < deadline:
+				time.sleep(0.01)
+			self.assertEqual(len(publisher.subscriptions), 0)
+			self.assertFalse(publisher.wants('sample'))
+		finally:
+			running[0] = False
+			self.loop.callSoonThreadsafe(lambda: None)
+			thread.join()
+			self.loop.close()
+		self.assertEqual(server.stats()['timeouts'], 0)
+
+	def test_slowSubscriberEventsAreDropped(self):
+		publisher = brewpiEventLoop.EventPublisher(self.loop, maxBuffered=65536)
+		brewpiEventLoop.MessageServer(self.loop, self.listenSocket, lambda conn, message: publisher.subscribe(conn, ''))
+		client = self.connect('subscribe')
+		for i in range(5):
+			self.loop.runOnce(0.01)
+		for i in range(200):  # more than the socket buffers and maxBuffered, the client does not read
+			publisher.publish('log', 'x' * 10000)
+			self.loop.runOnce(0)
+		self.assertTrue(publisher.dropped > 0)
+		subscription = list(publisher.subscriptions)[0]
+		self.assertTrue(subscription.conn.pendingBytes() <= 65536)
+		client.setblocking(0)
+		received = ''
+		for i in range(200):
+			self.loop.runOnce(0.01)
+			try:
+				received += client.recv(65536)
+			except socket.error:
+				pass
+		publisher.publish('log', 'after')
+		for i in range(5):
+			self.loop.runOnce(0.01)
+		client.setblocking(1)
+		client.settimeout(1)
+		while '"after"' not in received or not received.endswith('\n'):
+			received += client.recv(65536)
+		events = [json.loads(line) for line in received.splitlines()]
+		self.assertEqual(events[-2], dict(type='dropped', time=events[-2]['time'], data=publisher.dropped))
+		self.assertEqual(len(events), 1 + 200 - publisher.dropped + 2)
+		self.loop.close()
+
+	def test_serialTransportDispatchesLines(self):
+		class PipeSerial:
+			def __init__(self, fd):
+				self.fd = fd
+
+			def fileno(self):
+				return self.fd
+
+			def inWaiting(self):
+				return 0
+
+			def read(self, size=1):
+				return os.read(self.fd, 4096)
+
+		r, w = os.pipe()
+		received = []
+		dispatcher = brewpiSerial.MessageDispatcher()
+		dispatcher.register('T', received.append)
+		brewpiEventLoop.SerialTransport(self.loop, PipeSerial(r), brewpiSerial.LineFramer(dispatcher))
+		os.write(w, 'T:{"bt":19.0}\nT:')
+		self.loop.runOnce(0.1)
+		self.assertEqual(received, ['{"bt":19.0}'])
+		os.close(r)
+		os.close(w)
+
+
+if __name__ == '__main__':
+	unittest.main()
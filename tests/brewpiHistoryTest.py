@@ -0,0 +1,117 @@
+import array
+import os
+import shutil
+import tempfile
+import unittest
+import simplejson as json
+import brewpiChamber
+import brewpiHistory
+import brewpiIndex
+import brewpiJson
+import brewpiStore
+
+
+class FakeConnection:
+	def __init__(self):
+		self.sent = []
+
+	def send(self, data):
+		self.sent.append(data)
+
+	sendall = send
+
+
+class HistoryTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.numpy = brewpiHistory.numpy
+		# two daily segments of 3 samples, one minute apart
+		self.times = [1382745420.0, 1382745480.0, 1382745540.0, 1382745600.0, 1382745660.0, 1382745720.0]
+		self.stores = []
+		for day, times in (('2013-10-25', self.times[:3]), ('2013-10-26', self.times[3:])):
+			jsonFileName = os.path.join(self.dir, 'beer-%s.json' % day)
+			brewpiJson.newEmptyFile(jsonFileName)
+			store = brewpiStore.SampleStore(brewpiStore.segmentFileName(jsonFileName))
+			for t in times:
+				store.append(self.row(19.0 + (t - self.times[0]) / 600, state=None if t == self.times[1] else 1), t)
+			self.stores.append(store)
+		self.index = brewpiIndex.BeerIndex(self.dir, 'beer')
+
+	def tearDown(self):
+		brewpiHistory.numpy = self.numpy
+		for store in self.stores:
+			store.close()
+		shutil.rmtree(self.dir)
+
+	def row(self, beerTemp, state=1):
+		return {'BeerTemp': beerTemp, 'BeerSet': 20.0, 'BeerAnn': None, 'FridgeTemp': 18.25,
+		        'FridgeSet': None, 'FridgeAnn': None, 'RoomTemp': 21.12, 'State': state}
+
+	def test_windowOfSegment(self):
+		reader = brewpiHistory.SegmentReader(self.stores[0].fileName)
+		try:
+			self.assertEqual(len(reader), 3)
+			self.assertEqual(reader.window(self.times[1], self.times[2]), (1, 3))
+			self.assertEqual(reader.window(self.times[0] + 1, self.times[1] - 1), (1, 1))
+			self.assertEqual(reader.window(self.times[2] + 1, self.times[5]), (3, 3))
+			self.stores[0].append(self.row(19.5), self.times[2] + 30)
+			self.stores[0].sync()
+			self.assertEqual(len(reader), 3)  # the map only covers the records of when it was opened
+			reader.refresh()
+			self.assertEqual(reader.window(self.times[2], self.times[2] + 30), (2, 4))
+		finally:
+			reader.close()
+
+	def checkHistoryAcrossSegments(self):
+		history = brewpiHistory.History(self.dir, self.index, self.times[1], self.times[4])
+		try:
+			self.assertEqual(len(history.segments), 2)
+			joined = history.toJson()
+		finally:
+			history.close()
+		self.assertEqual(joined['Time'], self.times[1:5])
+		self.assertEqual(joined['BeerTemp'], [19.1, 19.2, 19.3, 19.4])
+		self.assertEqual(joined['FridgeSet'], [None] * 4)
+		self.assertEqual(joined['State'], [None, 1, 1, 1])
+		return joined
+
+	@unittest.skipIf(brewpiHistory.numpy is None, "NumPy is not installed")
+	def test_numpyColumnsAcrossSegments(self):
+		reader = brewpiHistory.SegmentReader(self.stores[1].fileName)
+		try:
+			columns = reader.columns(self.times[0], self.times[4])
+			self.assertTrue(isinstance(columns['Time'], brewpiHistory.numpy.ndarray))
+			self.assertEqual(columns['Time'].tolist(), self.times[3:5])
+			del columns  # the views have to be released before the map is closed
+		finally:
+			reader.close()
+		self.checkHistoryAcrossSegments()
+
+	def test_arrayFallbackAcrossSegments(self):
+		brewpiHistory.numpy = None
+		reader = brewpiHistory.SegmentReader(self.stores[1].fileName)
+		try:
+			self.assertEqual(reader.records(self.times[0], self.times[4]), None)
+			columns = reader.columns(self.times[0], self.times[4])
+		finally:
+			reader.close()
+		self.assertTrue(isinstance(columns['Time'], array.array))
+		self.assertEqual(columns['Time'].typecode, 'd')
+		self.assertEqual(columns['State'].typecode, 'B')
+		self.assertEqual(columns['Time'].tolist(), self.times[3:5])
+		self.checkHistoryAcrossSegments()
+
+	def test_getHistoryCommand(self):
+		chamber = brewpiChamber.Chamber(None, dict(scriptPath=self.dir, wwwPath=self.dir), None, None, None)
+		conn = FakeConnection()
+		chamber.commands.dispatch(conn, 'getHistory={"start": 0}')
+		self.assertEqual(json.loads(conn.sent[-1]), None)  # not logging
+		chamber.index = self.index
+		chamber.commands.dispatch(conn, 'getHistory=' + json.dumps(dict(start=self.times[1], end=self.times[4])))
+		self.assertEqual(json.loads(conn.sent[-1]), self.checkHistoryAcrossSegments())
+		chamber.commands.dispatch(conn, 'getHistory=' + json.dumps(dict(start=0, end=1)))
+		self.assertEqual(json.loads(conn.sent[-1]), dict((key, []) for key in brewpiHistory.columns))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,86 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import brewpiIndex
+import brewpiJson
+import brewpiStore
+
+
+class BeerIndexTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.t0 = 1382745420.0
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def row(self, beerTemp=19.5):
+		return {'BeerTemp': beerTemp, 'BeerSet': 20.0, 'BeerAnn': None, 'FridgeTemp': 18.25,
+		        'FridgeSet': None, 'FridgeAnn': None, 'RoomTemp': 21.12, 'State': 1}
+
+	def segment(self, jsonFile, times):
+		jsonFileName = os.path.join(self.dir, jsonFile)
+		brewpiJson.newEmptyFile(jsonFileName)
+		store = brewpiStore.SampleStore(brewpiStore.segmentFileName(jsonFileName))
+		store.appendMany([self.row(19.0 + i / 10.0) for i in range(len(times))], times)
+		return jsonFileName, store
+
+	def test_updateOnAppend(self):
+		index = brewpiIndex.BeerIndex(self.dir, 'beer')
+		self.assertEqual(index.entries, [])
+		jsonFileName, store = self.segment('beer-2013-10-25.json', [self.t0, self.t0 + 60])
+		index.update(jsonFileName, store)
+		store.appendMany([self.row()], [self.t0 + 120])
+		index.update(jsonFileName, store)
+		store.close()
+		self.assertEqual(index.entries, [dict(file='beer-2013-10-25.json', segment='beer-2013-10-25.bps',
+		                                      first=self.t0, last=self.t0 + 120, rows=3,
+		                                      dataStart=brewpiStore.headerSize,
+		                                      dataEnd=brewpiStore.headerSize + 3 * brewpiStore.recordSize)])
+		index.save()
+		self.assertFalse(index.dirty)
+		self.assertEqual(brewpiIndex.BeerIndex(self.dir, 'beer').entries, index.entries)  # loaded, not rebuilt
+
+	def test_rebuildFromDataFiles(self):
+		self.segment('beer-2013-10-26.json', [self.t0 + 86400, self.t0 + 86460])[1].close()
+		oldFileName = os.path.join(self.dir, 'beer-2013-10-25.json')  # written before the sample store existed
+		brewpiJson.newEmptyFile(oldFileName)
+		times = [self.t0, self.t0 + 60, self.t0 + 120]
+		brewpiJson.addRows(oldFileName, [self.row() for t in times], [datetime.datetime.fromtimestamp(t) for t in times])
+		self.segment('other-2013-10-25.json', [self.t0])[1].close()
+		with open(brewpiIndex.indexFileName(self.dir, 'beer'), 'wb') as f:
+			f.write('{"version": 1, "files": [')  # torn index file
+		index = brewpiIndex.BeerIndex(self.dir, 'beer')
+		self.assertEqual([e['file'] for e in index.entries], ['beer-2013-10-25.json', 'beer-2013-10-26.json'])
+		old, new = index.entries
+		self.assertEqual((old['segment'], old['first'], old['last'], old['rows']), (None, self.t0, self.t0 + 120, 3))
+		self.assertEqual((old['dataStart'], old['dataEnd']), (0, os.path.getsize(oldFileName)))
+		self.assertEqual((new['first'], new['last'], new['rows']), (self.t0 + 86400, self.t0 + 86460, 2))
+		self.assertEqual(brewpiIndex.BeerIndex(self.dir, 'beer').entries, index.entries)  # the rebuilt index was saved
+
+	def test_queryRange(self):
+		times = [self.t0 + 60 * i for i in range(5)]
+		self.segment('beer-2013-10-25.json', times[:3])[1].close()
+		jsonFileName, store = self.segment('beer-2013-10-26.json', times[3:])
+		store.close()
+		self.segment('beer-2013-10-27.json', [self.t0 + 2 * 86400])[1].close()
+		index = brewpiIndex.BeerIndex(self.dir, 'beer')
+
+		files = index.files(times[2], times[3])
+		self.assertEqual([e['file'] for e in files], ['beer-2013-10-25.json', 'beer-2013-10-26.json'])
+		self.assertEqual([(e['dataStart'], e['dataEnd']) for e in files],
+		                 [(brewpiStore.headerSize, brewpiStore.headerSize + 3 * brewpiStore.recordSize),
+		                  (brewpiStore.headerSize, brewpiStore.headerSize + 2 * brewpiStore.recordSize)])
+		self.assertEqual(brewpiStore.indexRange(brewpiStore.segmentFileName(jsonFileName), times[2], times[3]),
+		                 (0, 1))
+
+		rows = list(index.query(times[1], times[3]))
+		self.assertEqual([row['Time'] for row in rows], times[1:4])
+		self.assertEqual([row['BeerTemp'] for row in rows], [19.1, 19.2, 19.0])
+		self.assertEqual(list(index.query(times[4] + 1, self.t0 + 86400)), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+import brewpiJson
+import brewpiJournal
+import brewpiLogWriter
+import brewpiStore
+
+
+class SampleJournalTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.journalFileName = os.path.join(self.dir, 'sampleJournal.bpj')
+		self.jsonFileName = os.path.join(self.dir, 'test-2013-10-25.json')
+		self.csvFileName = os.path.join(self.dir, 'test.csv')
+		brewpiJson.newEmptyFile(self.jsonFileName)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def target(self):
+		return brewpiLogWriter.LogTarget(self.jsonFileName, os.path.join(self.dir, 'www.json'),
+		                                 self.csvFileName, os.path.join(self.dir, 'www.csv'))
+
+	def row(self, beerTemp=19.5):
+		return {'BeerTemp': beerTemp, 'BeerSet': 20.0, 'BeerAnn': None, 'FridgeTemp': 18.25,
+		        'FridgeSet': None, 'FridgeAnn': None, 'RoomTemp': 21.12, 'State': 1}
+
+	def writeJournaled(self, journal, target, count, start=1382700000.0):
+		rows = [self.row(19.0 + i) for i in range(count)]
+		timestamps = [start + 60 * i for i in range(count)]
+		journal.append(target, rows, timestamps)
+		target.write(rows, timestamps)
+
+	def test_readRecordsStopsAtTornRecord(self):
+		journal = brewpiJournal.SampleJournal(self.journalFileName)
+		target = self.target()
+		self.writeJournaled(journal, target, 2)
+		self.writeJournaled(journal, target, 1, start=1382701000.0)
+		journal.close()
+		with open(self.journalFileName, 'r+b') as f:
+			f.truncate(os.path.getsize(self.journalFileName) - 3)
+		records = list(brewpiJournal.readRecords(self.journalFileName))
+		self.assertEqual(len(records), 1)
+		self.assertEqual(len(records[0]['samples']), 2)
+
+	def test_checkpointEmptiesJournal(self):
+		journal = brewpiJournal.SampleJournal(self.journalFileName)
+		self.writeJournaled(journal, self.target(), 2)
+		journal.checkpoint()
+		journal.close()
+		self.assertEqual(os.path.getsize(self.journalFileName), 0)
+
+	def test_recoverRepairsTornFiles(self):
+		journal = brewpiJournal.SampleJournal(self.journalFileName)
+		target = self.target()
+		self.writeJournaled(journal, target, 3)
+		target.store.close()
+		journal.close()
+		# power failure while the last sample was written
+		for fileName, cut in [(self.jsonFileName, 10), (self.csvFileName, 5),
+		                      (brewpiStore.segmentFileName(self.jsonFileName), brewpiStore.recordSize + 7)]:
+			with open(fileName, 'r+b') as f:
+				f.truncate(os.path.getsize(fileName) - cut)
+
+		self.assertEqual(brewpiJournal.recover(self.journalFileName), 3)
+		self.assertEqual(os.path.getsize(self.journalFileName), 0)
+		with open(self.jsonFileName, 'rb') as f:
+			rows = list(brewpiJson.parseDataTable(f.read()))
+		self.assertEqual([r['BeerTemp'] for r in rows], [19.0, 20.0, 21.0])
+		with open(self.csvFileName, 'rb') as f:
+			self.assertEqual(len(f.read().splitlines()), 3)
+		store = brewpiStore.SampleStore(brewpiStore.segmentFileName(self.jsonFileName))
+		self.assertEqual([r['Time'] for r in store.rows()], [1382700000.0, 1382700060.0, 1382700120.0])
+
+	def test_recoverDoesNotDuplicateSamples(self):
+		journal = brewpiJournal.SampleJournal(self.journalFileName)
+		target = self.target()
+		self.writeJournaled(journal, target, 3)
+		target.store.close()
+		journal.close()
+		brewpiJournal.recover(self.journalFileName)
+		with open(self.jsonFileName, 'rb') as f:
+			self.assertEqual(len(list(brewpiJson.parseDataTable(f.read()))), 3)
+		with open(self.csvFileName, 'rb') as f:
+			self.assertEqual(len(f.read().splitlines()), 3)
+		self.assertEqual(brewpiStore.recordCount(brewpiStore.segmentFileName(self.jsonFileName)), 3)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import brewpiJournal
+import brewpiJson
+import brewpiLogWriter
+
+
+class FakeTarget:
+	def __init__(self):
+		self.stream = None
+		self.rows = []
+
+	def write(self, rows, timestamps):
+		for row in rows:
+			if row.get('BeerAnn') == 'bad':
+				raise TypeError("cannot encode annotation")
+		self.rows.extend(rows)
+
+	def sync(self):
+		pass
+
+	def finish(self):
+		pass
+
+
+class DataLogWriterTestCase(unittest.TestCase):
+	def test_errorInBatchDoesNotStopWriter(self):
+		writer = brewpiLogWriter.DataLogWriter(fsyncSamples=0, fsyncSeconds=0)
+		writer.start()
+		target = FakeTarget()
+		writer.put(target, dict(BeerTemp=20.0, BeerAnn='bad'))
+		end = time.time() + 2
+		while writer.stats()['writeErrors'] == 0 and time.time() < end:
+			time.sleep(0.01)
+		writer.put(target, dict(BeerTemp=20.5, BeerAnn=None))
+		writer.stop()
+		self.assertEqual([row['BeerTemp'] for row in target.rows], [20.5])
+		self.assertEqual(writer.stats()['writeErrors'], 1)
+		self.assertFalse(writer.isAlive())
+
+	def test_syncAndCheckpointAfterDayRollover(self):
+		directory = tempfile.mkdtemp()
+		try:
+			journal = brewpiJournal.SampleJournal(os.path.join(directory, 'sampleJournal.bpj'))
+			writer = brewpiLogWriter.DataLogWriter(fsyncSamples=2, fsyncSeconds=0, journal=journal)
+			targets = []
+			for day in ('2013-10-25', '2013-10-26'):
+				jsonFileName = os.path.join(directory, 'test-%s.json' % day)
+				brewpiJson.newEmptyFile(jsonFileName)
+				targets.append(brewpiLogWriter.LogTarget(jsonFileName, os.path.join(directory, 'www-%s.json' % day),
+				                                         os.path.join(directory, 'test.csv'),
+				                                         os.path.join(directory, 'www.csv')))
+			row = dict(BeerTemp=19.5, BeerSet=20.0, BeerAnn=None, FridgeTemp=18.25, FridgeSet=None, FridgeAnn=None,
+			           RoomTemp=21.12, State=1)
+			writer.writeBatch([(targets[0], row, 1382745540.0)])  # not synced yet when the day rolls over
+			writer.writeBatch([(targets[1], row, 1382745600.0)])
+			self.assertEqual(writer.unsyncedSamples, 0)
+			self.assertEqual(writer.unsyncedTargets, [])
+			self.assertEqual(journal.checkpoints, 1)
+			self.assertEqual(os.path.getsize(journal.fileName), 0)
+			writer.writeBatch([(targets[1], row, 1382745660.0), (targets[1], row, 1382745720.0)])
+			self.assertEqual(journal.checkpoints, 2)
+			self.assertEqual(len(targets[1].store), 3)
+			targets[1].finish()
+			journal.close()
+		finally:
+			shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+	unittest.main()
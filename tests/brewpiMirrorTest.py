@@ -0,0 +1,86 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import brewpiMirror
+
+
+class FileMirrorTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.src = os.path.join(self.dir, 'beer.csv')
+		self.dst = os.path.join(self.dir, 'www.csv')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def append(self, data, fileName=None):
+		with open(fileName or self.src, 'ab') as f:
+			f.write(data)
+
+	def read(self, fileName):
+		with open(fileName, 'rb') as f:
+			return f.read()
+
+	def test_appendOnlyCopiesNewLines(self):
+		mirror = brewpiMirror.FileMirror(self.src, self.dst)
+		self.append('row1\nrow2\n')
+		mirror.sync()
+		self.assertEqual(self.read(self.dst), 'row1\nrow2\n')
+		inode = os.stat(self.dst).st_ino
+		written = mirror.bytesWritten
+
+		self.append('row3\nro')  # the log writer is halfway a row
+		mirror.sync()
+		self.assertEqual(self.read(self.dst), 'row1\nrow2\nrow3\n')
+		self.append('w4\n')
+		mirror.sync()
+		mirror.sync()  # nothing new
+		self.assertEqual(self.read(self.dst), self.read(self.src))
+		self.assertEqual(mirror.bytesWritten - written, len('row3\nrow4\n'))
+		self.assertEqual(os.stat(self.dst).st_ino, inode)  # appended, not replaced
+
+	def test_changedCopyIsReplaced(self):
+		self.append('row1\nrow2\n')
+		self.append('row1\n', self.dst)  # the copy of an earlier run holds the start of the file
+		mirror = brewpiMirror.FileMirror(self.src, self.dst)
+		mirror.sync()
+		self.assertEqual(mirror.bytesWritten, len('row2\n'))
+		with open(self.dst, 'wb') as f:
+			f.write('edited')
+		self.append('row3\n')
+		mirror.sync()
+		self.assertEqual(self.read(self.dst), 'row1\nrow2\nrow3\n')
+
+	def test_publishIsAtomic(self):
+		src = os.path.join(self.dir, 'beer.json')
+		dst = os.path.join(self.dir, 'www.json')
+		self.append('{"rows":[1]}', src)
+		self.append('{"rows":[]}', dst)
+		os.chmod(dst, 0644)
+		reader = open(dst, 'rb')  # a web server that is reading the old copy
+		copyfile = shutil.copyfile
+		copies = []
+
+		def checkedCopy(fromName, toName):
+			copyfile(fromName, toName)
+			copies.append(toName)
+			self.assertEqual(self.read(dst), '{"rows":[]}')  # the target is not touched while the copy is written
+
+		shutil.copyfile = checkedCopy
+		try:
+			brewpiMirror.FileMirror(src, dst, appendOnly=False).sync()
+		finally:
+			shutil.copyfile = copyfile
+		self.assertEqual(copies, [brewpiMirror.tempFileName(dst)])
+		self.assertFalse(os.path.exists(copies[0]))  # renamed to the target
+		self.assertEqual(self.read(dst), '{"rows":[1]}')
+		self.assertEqual(reader.read(), '{"rows":[]}')
+		reader.close()
+		self.assertEqual(stat.S_IMODE(os.stat(dst).st_mode), 0644)
+		self.assertTrue(os.path.basename(copies[0]).startswith('.'))  # hidden from the file list of the web server
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import brewpiCapture
+import brewpiReplay
+
+
+def session(start, samples):
+	""" Frames of a session with a sample every 10 minutes, the reads split lines like a serial port does """
+	yield start, brewpiCapture.toArduino, 'n'
+	yield start, brewpiCapture.fromArduino, 'N:{"v":"0.2.3","n":"test","c":"","s":2,"y":1,"b":"s","l":"1"}\n'
+	for i in range(samples):
+		t = start + 600 * (i + 1)
+		yield t, brewpiCapture.fromArduino, 'T:{"BeerTemp":%.1f,"Fridge' % (18 + i * 0.1)
+		yield t + 0.01, brewpiCapture.fromArduino, 'Temp":17.0}\r\nL:["line 1","line 2","line 3","line %d"]\n' % i
+
+
+class ReplayTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.captureFile = os.path.join(self.dir, 'session.bpcap')
+		self.stdout = sys.stdout
+		sys.stdout = open(os.devnull, 'w')
+
+	def tearDown(self):
+		sys.stdout = self.stdout
+		shutil.rmtree(self.dir)
+
+	def test_replayUsesRecordedTime(self):
+		start = time.mktime((2014, 3, 1, 22, 0, 0, 0, 0, -1))  # the session runs past midnight
+		brewpiCapture.writeCaptureFile(self.captureFile, session(start, 24))
+		replay = brewpiReplay.Replay(os.path.join(self.dir, 'replay'), 'ale')
+		replay.run(brewpiCapture.readCaptureFile(self.captureFile))
+		stats = replay.finish()
+		self.assertEqual(stats['lines'], {'N': 1, 'T': 24, 'L': 24})
+		self.assertEqual(stats['dataLog']['samplesWritten'], 24)
+		self.assertEqual(replay.chamber.lcdText[3], 'line 23')
+		dataPath = os.path.join(self.dir, 'replay', 'data', 'ale')  # the layout of brewpi.py
+		self.assertTrue(os.path.exists(os.path.join(dataPath, 'ale-2014-03-01.json')))
+		self.assertTrue(os.path.exists(os.path.join(dataPath, 'ale-2014-03-02.json')))
+		rows = open(os.path.join(dataPath, 'ale.csv')).readlines()
+		self.assertEqual(len(rows), 24)
+		self.assertTrue(rows[0].startswith('Mar 01 2014 22:10:00'))
+		self.assertTrue(rows[-1].startswith('Mar 02 2014 02:00:00'))
+
+	def test_speed(self):
+		brewpiCapture.writeCaptureFile(self.captureFile, session(time.time(), 2))  # 20 minutes
+		replay = brewpiReplay.Replay(os.path.join(self.dir, 'replay'))
+		replay.run(brewpiCapture.readCaptureFile(self.captureFile), speed=6000)
+		self.assertTrue(0.2 <= replay.finish()['replaySeconds'] < 1.0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import brewpiResponseCache
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+	def setUp(self):
+		self.cache = brewpiResponseCache.ResponseCache()
+		self.encoded = []
+
+	def encode(self, value):
+		def encoder():
+			self.encoded.append(value)
+			return value
+		return encoder
+
+	def test_replyIsEncodedOnce(self):
+		self.assertEqual(self.cache.reply('lcd', self.encode('a')), 'a')
+		self.assertEqual(self.cache.reply('lcd', self.encode('b')), 'a')
+		self.assertEqual(self.encoded, ['a'])
+		self.cache.lineChanged('L')
+		self.assertEqual(self.cache.reply('lcd', self.encode('b')), 'b')
+		self.assertEqual(self.cache.stats()['lcd'], dict(hits=1, misses=2, invalidations=1, hitRate=1 / 3.0))
+
+	def test_keyChangesReply(self):
+		self.cache.reply('getControlSettings', self.encode('active'), 'active')
+		self.assertEqual(self.cache.reply('getControlSettings', self.encode('paused'), 'paused'), 'paused')
+		self.assertEqual(self.cache.reply('getControlSettings', self.encode('x'), 'paused'), 'paused')
+		self.cache.lineChanged('V')  # other commands are not invalidated
+		self.assertEqual(self.cache.stats()['getControlSettings']['hits'], 1)
+		self.assertEqual(self.cache.stats()['getControlSettings']['invalidations'], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
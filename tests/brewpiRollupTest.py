@@ -0,0 +1,83 @@
+import os
+import shutil
+import struct
+import time
+import tempfile
+import unittest
+import brewpiRollup
+
+
+class RollupTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.t0 = time.mktime((2013, 9, 24, 12, 0, 0, 0, 0, -1))  # aligned to a whole hour in local time
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def addSamples(self, rollups, count, interval=120):
+		for i in range(count):
+			rollups.add({'BeerTemp': 18.0 + (i % 2), 'BeerSet': 20.0, 'FridgeTemp': None, 'State': 1},
+			            self.t0 + i * interval)
+
+	def test_chooseResolutionFitsPointBudget(self):
+		self.assertEqual(brewpiRollup.chooseResolution(0, 3600, 100), 60)
+		self.assertEqual(brewpiRollup.chooseResolution(0, 7 * 86400, 500), 3600)
+		self.assertEqual(brewpiRollup.chooseResolution(0, 28 * 86400, 100), 86400)
+
+	def test_minMaxMean(self):
+		rollups = brewpiRollup.Rollups(self.dir, 'beer')
+		self.addSamples(rollups, 30)  # one hour of samples
+		rollups.flush()
+		result = brewpiRollup.query(self.dir, 'beer', self.t0, self.t0 + 3599, 1)
+		self.assertEqual(result['resolution'], 3600)
+		self.assertEqual(len(result['rows']), 1)
+		row = result['rows'][0]
+		self.assertEqual(row['count'], 30)
+		self.assertEqual(row['BeerTemp'], [18.0, 18.5, 19.0])
+		self.assertEqual(row['FridgeTemp'], None)
+
+	def test_bucketIsResumedAfterReopen(self):
+		rollups = brewpiRollup.Rollups(self.dir, 'beer')
+		self.addSamples(rollups, 10)
+		rollups.flush()
+		rollups = brewpiRollup.Rollups(self.dir, 'beer')
+		rollups.add({'BeerTemp': 30.0}, self.t0 + 1800)
+		rollups.flush()
+		rows = brewpiRollup.query(self.dir, 'beer', self.t0, self.t0 + 3599, 1)['rows']
+		self.assertEqual(len(rows), 1)
+		self.assertEqual(rows[0]['count'], 11)
+		self.assertEqual(rows[0]['BeerTemp'][2], 30.0)
+
+	def test_fieldCountsAreResumed(self):
+		rollups = brewpiRollup.Rollups(self.dir, 'beer')
+		rollups.add({'BeerTemp': 18.0, 'RoomTemp': 10.0}, self.t0)
+		for i in range(1, 4):
+			rollups.add({'BeerTemp': 18.0, 'RoomTemp': None}, self.t0 + i * 60)
+		rollups.flush()
+		rollups = brewpiRollup.Rollups(self.dir, 'beer')
+		rollups.add({'BeerTemp': 18.0, 'RoomTemp': 20.0}, self.t0 + 300)
+		rollups.flush()
+		row = brewpiRollup.query(self.dir, 'beer', self.t0, self.t0 + 3599, 1)['rows'][0]
+		self.assertEqual(row['count'], 5)
+		self.assertEqual(row['RoomTemp'], [10.0, 15.0, 20.0])  # the mean of 2 values, not of 5 samples
+
+	def test_oldFormatIsMovedAside(self):
+		fileName = brewpiRollup.rollupFileName(self.dir, 'beer', 60)
+		with open(fileName, 'wb') as f:
+			f.write(struct.pack(brewpiRollup.headerFormat, brewpiRollup.magic, 1, 68, 60) + '\0' * 68)
+		rollups = brewpiRollup.Rollups(self.dir, 'beer')
+		self.addSamples(rollups, 2)
+		rollups.flush()
+		self.assertTrue(os.path.exists(fileName + '.v1'))
+		self.assertEqual(len(brewpiRollup.readRange(fileName, self.t0, self.t0 + 3600)), 2)
+
+	def test_queryIncludesBucketInProgress(self):
+		rollups = brewpiRollup.Rollups(self.dir, 'beer')
+		self.addSamples(rollups, 45)
+		result = rollups.query(self.t0, self.t0 + 2 * 3600, 2)
+		self.assertEqual([row['count'] for row in result['rows']], [30, 15])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import simplejson as json
+import brewpiSample
+
+
+class TempDecoderTestCase(unittest.TestCase):
+	def setUp(self):
+		self.decoder = brewpiSample.TempDecoder()
+
+	def test_knownKeys(self):
+		sample = self.decoder.decode('{"bt":19.02,"bs":19.0,"ba":null,"ft":18.91,"fs":18.5,"fa":"door open","rt":21.3,"s":0}')
+		self.assertEqual(sample.asDict(), dict(BeerTemp=19.02, BeerSet=19.0, BeerAnn=None, FridgeTemp=18.91,
+		                                       FridgeSet=18.5, FridgeAnn='door open', RoomTemp=21.3, State=0))
+		self.assertEqual(sample['FridgeAnn'], 'door open')
+		self.assertEqual(sample.get('Time'), None)
+		self.assertEqual(self.decoder.stats(), {'fast': 1, 'generic': 0})
+
+	def test_missingFieldsKeepPreviousValue(self):
+		self.decoder.decode('{"bt":19.0,"bs":19.0,"ft":18.0,"fs":18.0,"rt":21.0,"s":0}')
+		sample = self.decoder.decode('{"bt":19.5,"s":1}')
+		self.assertEqual((sample.BeerTemp, sample.FridgeTemp, sample.State), (19.5, 18.0, 1))
+		self.assertEqual(sample.changed, ('BeerTemp', 'State'))
+		self.assertEqual(self.decoder.decode('{"bt":19.5}').changed, ())
+
+	def test_unknownKeysTakeGenericPath(self):
+		sample = self.decoder.decode('{"BeerTemp":19.0,"bs":20.0,"hum":55}')
+		self.assertEqual(sample.asDict()['BeerTemp'], 19.0)
+		self.assertEqual(sample.asDict()['BeerSet'], 20.0)
+		self.assertEqual(sample['hum'], 55)
+		self.assertEqual(self.decoder.stats(), {'fast': 0, 'generic': 1})
+
+	def test_fastPathAfterUnknownKey(self):
+		self.decoder.decode('{"bt":19.0,"bs":20.0,"hum":55}')
+		sample = self.decoder.decode('{"bt":19.5,"ft":18.0}')
+		self.assertEqual((sample.BeerTemp, sample.BeerSet, sample.FridgeTemp), (19.5, 20.0, 18.0))
+		self.assertEqual(sample.get('hum'), None)  # extra keys are not carried forward
+		self.assertEqual(self.decoder.stats(), {'fast': 1, 'generic': 1})
+
+	def test_timeIsAField(self):
+		sample = self.decoder.decode('{"bt":19.0,"t":1234}')
+		self.assertEqual(sample.asDict()['Time'], 1234)
+		self.assertEqual(self.decoder.decode('{"bt":19.5}')['Time'], 1234)
+		self.assertEqual(self.decoder.stats(), {'fast': 2, 'generic': 0})
+
+	def test_sameResultAsJsonLoads(self):
+		row = dict(BeerTemp=0, FridgeTemp=0, BeerAnn=None, FridgeAnn=None, RoomTemp=None, State=None, BeerSet=0,
+		           FridgeSet=0)
+		for line in ['{"bt":19,"bs":19.00,"ba":null,"ft":-1.5e1,"fs":18.5,"fa":null,"rt":null,"s":3}',
+		             '{"bt":19.1}', '{"ba":"dry hopped \\u00b0","s":4} ']:
+			for key, value in json.loads(line).items():
+				row[brewpiSample.renameTempKeys.get(key, key)] = value
+			self.assertEqual(self.decoder.decode(line).asDict(), row)
+
+	def test_invalidData(self):
+		for data in ['', '{"bt":19.0', '{"bt":19.0}x', '[1, 2]']:
+			self.assertRaises(json.JSONDecodeError, self.decoder.decode, data)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,219 @@
+import threading
+import time
+import unittest
+import serial
+import brewpiSerial
+import brewpiSimulator
+
+
+class MessageDispatcherTestCase(unittest.TestCase):
+	def setUp(self):
+		self.received = []
+		self.dispatcher = brewpiSerial.MessageDispatcher()
+		self.dispatcher.register('T', lambda data: self.received.append(('T', data)))
+		self.dispatcher.register('L', lambda data: self.received.append(('L', data)))
+
+	def test_dispatchByMessageType(self):
+		self.dispatcher.dispatch('T:{"bt":19.0}')
+		self.dispatcher.dispatch('L:["a","b"]')
+		self.dispatcher.dispatch('X:unknown')
+		self.assertEqual(self.received, [('T', '{"bt":19.0}'), ('L', '["a","b"]')])
+		self.assertEqual(self.dispatcher.stats(), {'T': 1, 'L': 1})
+
+	def test_registerReplacesHandler(self):
+		self.dispatcher.register('T', lambda data: self.received.append(('new', data)))
+		self.dispatcher.dispatch('T:1')
+		self.dispatcher.unregister('L')
+		self.dispatcher.dispatch('L:2')
+		self.assertEqual(self.received, [('new', '1')])
+
+	def test_handlersRunWithLock(self):
+		lock = threading.RLock()
+		dispatcher = brewpiSerial.MessageDispatcher(lock=lock)
+		dispatcher.register('T', lambda data: self.received.append(lock._is_owned()))
+		dispatcher.dispatch('T:1')
+		self.assertEqual(self.received, [True])
+
+	def test_handlerErrorIsCountedAndReadingGoesOn(self):
+		self.dispatcher.register('D', lambda data: {}[data])  # KeyError
+		self.dispatcher.register('V', lambda data: int(data))  # ValueError
+		reader = brewpiSerial.SerialReader(None, self.dispatcher)
+		reader.feed('D:missing\nV:x\nT:1\n')
+		self.assertEqual(self.received, [('T', '1')])
+		self.assertEqual(self.dispatcher.errorStats(), {'D': 1, 'V': 1})
+		self.assertEqual(self.dispatcher.stats(), {'D': 1, 'V': 1, 'T': 1})
+
+	def test_portErrorStopsReader(self):
+		class UnpluggedPort:
+			def inWaiting(self):
+				raise serial.SerialException("device disconnected")
+
+		errors = []
+		reader = brewpiSerial.SerialReader(UnpluggedPort(), self.dispatcher, onError=errors.append)
+		reader.start()
+		reader.join(2)
+		self.assertFalse(reader.isAlive())
+		self.assertEqual([str(e) for e in errors], ["device disconnected"])
+
+	def test_readerFramesLines(self):
+		reader = brewpiSerial.SerialReader(None, self.dispatcher)
+		reader.feed('T:{"bt"')
+		self.assertEqual(self.received, [])
+		reader.feed(':19.0}\r\nL:["a"]\nT:')
+		self.assertEqual(self.received, [('T', '{"bt":19.0}'), ('L', '["a"]')])
+		reader.feed('2\n')
+		self.assertEqual(self.received[-1], ('T', '2'))
+		self.assertEqual(reader.framer.lines, 3)
+
+	def test_framerReusesBuffer(self):
+		framer = brewpiSerial.LineFramer(self.dispatcher, size=16)
+		for i in range(10):
+			framer.feed('T:%d\nL:' % i)
+			framer.feed('"x"\n')
+		self.assertEqual(len(framer.buffer), 16)
+		self.assertEqual(self.received[-2:], [('T', '9'), ('L', '"x"')])
+		framer.feed('T:' + 'a' * 40)  # longer than the buffer
+		self.assertEqual(framer.pending(), 'T:' + 'a' * 40)
+		framer.feed('\n')
+		self.assertEqual(self.received[-1], ('T', 'a' * 40))
+		self.assertEqual(framer.lines, 21)
+
+	def test_framerReadsSerialPort(self):
+		arduino = brewpiSimulator.FakeArduino(rate=100)
+		arduino.start()
+		ser = serial.Serial(arduino.portName, 57600, timeout=0.1)
+		framer = brewpiSerial.LineFramer(self.dispatcher)
+		try:
+			end = time.time() + 2
+			while framer.lines < 20 and time.time() < end:
+				framer.readFrom(ser)
+		finally:
+			ser.close()
+			arduino.stop()
+		self.assertTrue(framer.lines >= 20)
+		self.assertTrue(framer.portFile is not None)
+		self.assertTrue(all(messageType == 'T' and data.startswith('{') for messageType, data in self.received))
+
+
+class DemandPollerTestCase(unittest.TestCase):
+	def test_idleRequestsAreSentSlowly(self):
+		poller = brewpiSerial.DemandPoller(activeSeconds=30.0, idleInterval=10.0)
+		sent = [t for t in range(0, 60) if poller.due('l', 1000.0 + t * 0.5)]
+		self.assertEqual(len(sent), 3)  # at 0, 10 and 20 seconds
+		self.assertEqual(poller.stats()['avoided'], {'l': 57})
+
+	def test_demandedRequestsAreSentEveryPass(self):
+		poller = brewpiSerial.DemandPoller(activeSeconds=30.0, idleInterval=10.0)
+		self.assertTrue(poller.demand('l', 1000.0))  # was idle, the client might have received old data
+		self.assertFalse(poller.demand('l', 1001.0))
+		self.assertTrue(all(poller.due('l', 1001.0 + t * 0.5) for t in range(20)))
+		self.assertFalse(poller.due('s', 1011.0) and poller.due('s', 1011.5))
+		self.assertFalse(poller.isActive('l', 1031.0))
+
+
+class FakeSerial:
+	def __init__(self):
+		self.writes = []
+
+	def write(self, data):
+		self.writes.append(data)
+
+
+class CommandQueueTestCase(unittest.TestCase):
+	def setUp(self):
+		self.queue = brewpiSerial.CommandQueue(timeout=5.0)
+		self.ser = FakeSerial()
+
+	def test_requestsAreCoalesced(self):
+		for i in range(5):
+			self.queue.put('s')
+		self.queue.put('l')
+		self.queue.put('U{i:1}')
+		self.queue.put('U{i:1}')  # device updates are never merged
+		self.queue.flush(self.ser)
+		self.assertEqual(self.ser.writes, ['slU{i:1}U{i:1}'])
+		self.assertEqual(self.queue.getStats()['commands']['s']['coalesced'], 4)
+
+	def test_settingsKeepLastValue(self):
+		self.queue.put('j{mode:b, beerSet:19.0}')
+		self.queue.put('j{mode:b, beerSet:19.5}')
+		self.queue.put('j{"tempFormat": "F"}')
+		self.queue.flush(self.ser)
+		self.assertEqual(self.ser.writes, ['j{mode:b, beerSet:19.5, "tempFormat": "F"}'])
+
+	def test_mergingKeepsOrder(self):
+		self.queue.put('s')
+		self.queue.put('j{beerSet:19.0}')
+		self.queue.put('S')
+		self.queue.put('s')  # asks for the settings after the changes
+		self.queue.put('j{beerSet:19.5}')  # not merged with the first j, S resets the settings in between
+		self.queue.put('j{mode:b}')
+		self.queue.put('l')
+		self.queue.put('s')
+		self.queue.flush(self.ser)
+		self.assertEqual(self.ser.writes, ['sj{beerSet:19.0}Ssj{beerSet:19.5, mode:b}ls'])
+		self.assertEqual(self.queue.getStats()['commands']['j']['coalesced'], 1)
+
+	def test_repliesAreMatched(self):
+		self.queue.put('s')
+		self.queue.put('c')
+		self.queue.put('j{mode:o}')
+		self.queue.flush(self.ser)
+		self.queue.reply('S')
+		self.queue.reply('S')  # unsolicited, ignored
+		stats = self.queue.getStats()
+		self.assertEqual(stats['pending'], 1)
+		self.assertEqual(stats['commands']['s']['replies'], 1)
+		self.assertTrue(stats['commands']['s']['p50Rtt'] >= 0)
+		self.queue.expire(time.time() + 10)
+		stats = self.queue.getStats()
+		self.assertEqual(stats['pending'], 0)
+		self.assertEqual(stats['commands']['c']['timeouts'], 1)
+		self.assertEqual(stats['commands']['j']['sent'], 1)
+
+	def test_emptyQueueDoesNotWrite(self):
+		self.queue.flush(self.ser)
+		self.assertEqual(self.ser.writes, [])
+
+
+class BoardTypeTestCase(unittest.TestCase):
+	def test_resetsOnOpen(self):
+		self.assertFalse(brewpiSerial.resetsOnOpen('leonardo'))
+		self.assertTrue(brewpiSerial.resetsOnOpen('uno'))
+
+
+class RequestVersionTestCase(unittest.TestCase):
+	def open(self, **kwargs):
+		self.arduino = brewpiSimulator.FakeArduino(**kwargs)
+		self.arduino.start()
+		self.ser = serial.Serial(self.arduino.portName, 57600, timeout=0.1)
+
+	def tearDown(self):
+		self.ser.close()
+		self.arduino.stop()
+
+	def test_runningBoardAnswersRightAway(self):
+		self.open()
+		version, elapsed = brewpiSerial.requestVersion(self.ser)
+		self.assertTrue(version.startswith('{'))
+		self.assertTrue(elapsed < 0.5)
+
+	def test_dataEndsQuietTime(self):
+		self.open(rate=20)
+		version, elapsed = brewpiSerial.requestVersion(self.ser, quietTime=10.0)
+		self.assertTrue(version is not None)
+		self.assertTrue(elapsed < 1.0)
+
+	def test_requestsAreRepeatedWhileBooting(self):
+		self.open(bootTime=0.5)
+		version, elapsed = brewpiSerial.requestVersion(self.ser)
+		self.assertTrue(version is not None)
+		self.assertTrue(0.5 <= elapsed < 1.5)
+
+	def test_noAnswer(self):
+		self.open(bootTime=10.0)
+		self.assertEqual(brewpiSerial.requestVersion(self.ser, timeout=0.5)[0], None)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import serial
+import simplejson as json
+import brewpiSimulator
+import expandLogMessage
+from brewpiVersion import AvrInfo
+
+
+class FakeArduinoTestCase(unittest.TestCase):
+	def setUp(self):
+		self.arduino = brewpiSimulator.FakeArduino()
+		self.arduino.start()
+		self.ser = serial.Serial(self.arduino.portName, 57600, timeout=2)
+
+	def tearDown(self):
+		self.ser.close()
+		self.arduino.stop()
+
+	def ask(self, command):
+		self.ser.write(command)
+		return self.ser.readline().rstrip('\n')
+
+	def test_version(self):
+		line = self.ask('n')
+		self.assertEqual(line[:2], 'N:')
+		avrVersion = AvrInfo(line[2:])
+		self.assertEqual(avrVersion.version, '0.2.3')
+		self.assertEqual(avrVersion.board, 'standard')
+		self.assertEqual(int(avrVersion.log), expandLogMessage.getVersion())
+
+	def test_requests(self):
+		self.assertIn('bt', json.loads(self.ask('t')[2:]))
+		lcd = self.ask('l')
+		self.assertEqual(len(json.loads(lcd[2:].replace('\xb0', '&deg'))), 4)
+		self.assertEqual(json.loads(self.ask('s')[2:])['mode'], 'b')
+		self.assertEqual(len(json.loads(self.ask('d{}')[2:])), 4)
+
+	def test_settingsAndLogMessages(self):
+		line = self.ask('j{mode:f, fridgeSet:12.5}')
+		self.assertEqual(expandLogMessage.expandLogMessage(line[2:]), 'INFO MESSAGE 12: Received new setting: mode = f')
+		self.ser.readline()
+		settings = json.loads(self.ask('s')[2:])
+		self.assertEqual((settings['mode'], settings['fridgeSet']), ('f', 12.5))
+		line = self.ask('x')
+		self.assertEqual(expandLogMessage.expandLogMessage(line[2:]),
+		                 'WARNING 1: Invalid command received by Arduino: x')
+
+	def test_rate(self):
+		self.arduino.rate = 100
+		lines = [self.ser.readline() for i in range(20)]
+		self.assertTrue(all(line.startswith('T:') for line in lines))
+
+
+if __name__ == '__main__':
+	unittest.main()
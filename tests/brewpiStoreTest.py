@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+import simplejson as json
+import brewpiJson
+import brewpiStore
+
+
+class SampleStoreTestCase(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.fileName = os.path.join(self.dir, 'test-2013-10-25.bps')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def row(self, beerTemp=19.5, beerAnn=None, state=1):
+		return {'BeerTemp': beerTemp, 'BeerSet': 20.0, 'BeerAnn': beerAnn, 'FridgeTemp': 18.25,
+		        'FridgeSet': None, 'FridgeAnn': None, 'RoomTemp': 21.12, 'State': state}
+
+	def test_appendIsFixedWidth(self):
+		store = brewpiStore.SampleStore(self.fileName)
+		store.append(self.row(), 1000.0)
+		store.append(self.row(), 1120.0)
+		store.close()
+		self.assertEqual(os.path.getsize(self.fileName), brewpiStore.headerSize + 2 * brewpiStore.recordSize)
+
+	def test_rowsRoundTrip(self):
+		store = brewpiStore.SampleStore(self.fileName)
+		store.append(self.row(18.96, 'Beer temp changed', None), 1000.0)
+		store.append(self.row(19.04), 1120.0)
+		rows = list(store.rows())
+		self.assertEqual(len(rows), 2)
+		self.assertEqual(rows[0]['Time'], 1000.0)
+		self.assertEqual(rows[0]['BeerTemp'], 18.96)
+		self.assertEqual(rows[0]['BeerAnn'], 'Beer temp changed')
+		self.assertEqual(rows[0]['FridgeSet'], None)
+		self.assertEqual(rows[0]['State'], None)
+		self.assertEqual(rows[1]['RoomTemp'], 21.12)
+		self.assertEqual(rows[1]['State'], 1)
+		self.assertEqual(rows[1]['BeerAnn'], None)
+
+	def test_reopenDropsIncompleteRecord(self):
+		store = brewpiStore.SampleStore(self.fileName)
+		store.append(self.row(), 1000.0)
+		store.append(self.row(), 1120.0)
+		store.close()
+		with open(self.fileName, 'r+b') as f:
+			f.truncate(os.path.getsize(self.fileName) - 5)
+		store = brewpiStore.SampleStore(self.fileName)
+		self.assertEqual(len(store), 1)
+		self.assertEqual(store.lastTime, 1000.0)
+		store.append(self.row(), 1240.0)
+		self.assertEqual([r['Time'] for r in store.rows()], [1000.0, 1240.0])
+
+	def test_dataTableJsonMatchesAddRow(self):
+		store = brewpiStore.SampleStore(self.fileName)
+		store.append(self.row(), 1000.0)
+		store.append(self.row(19.0, 'Annotation'), 1120.0)
+		decoded = json.loads(store.dataTableJson())
+		self.assertEqual(len(decoded['cols']), 9)
+		self.assertEqual(len(decoded['rows']), 2)
+		self.assertEqual(decoded['rows'][1]['c'][3], {'v': 'Annotation'})
+
+		jsonFileName = os.path.join(self.dir, 'test.json')
+		brewpiJson.newEmptyFile(jsonFileName)
+		brewpiJson.addRow(jsonFileName, self.row())
+		addRowDecoded = json.load(open(jsonFileName))
+		self.assertEqual(decoded['rows'][0]['c'][1:], addRowDecoded['rows'][0]['c'][1:])
+
+
+if __name__ == '__main__':
+	unittest.main()